@@ -1,4 +1,4 @@
-from flask import redirect, send_file, session, abort, jsonify, request, url_for, Blueprint, current_app
+from flask import redirect, send_file, session, abort, jsonify, request, url_for, Blueprint, current_app, Response, stream_with_context
 from flask_login import login_user, login_required, current_user, logout_user
 from pathlib import Path
 from datetime import datetime
@@ -8,10 +8,14 @@ import os
 import mimetypes
 import time
 import helpers
+import metrics
 from db.repositories import (
     get_cards_with_attachments,
+    iter_cards_with_attachments,
     list_logs_desc,
+    count_logs,
     list_recently_deleted_messages_desc,
+    count_recently_deleted_messages,
     get_google_slides_presentation_id,
     upsert_google_slides_id,
     get_attachment_prefs_with_attachment,
@@ -19,16 +23,26 @@ from db.repositories import (
     create_attachment,
     list_swap_prefs,
     delete_swap_pref_by_id,
+    swap_messages_for_recipients,
+    delete_messages,
+    count_messages_to_delete,
     browse_messages as browse_messages_repo,
+    iter_browse_messages,
+    search_messages as search_messages_repo,
+    BROWSE_MESSAGES_PAGE_SIZE,
+    LOGS_PAGE_SIZE,
+    SEARCH_MESSAGES_LIMIT,
     list_admins,
     add_admin as add_admin_repo,
     delete_admin,
     list_hidden_card_overrides_desc,
     add_hidden_card_override as add_hidden_card_override_repo,
     delete_hidden_card_override,
+    delete_analytics_snapshot,
 )
 
-from app import admin_required, update_lifted_config, load_user, sync_admin_permissions_for_session, clear_admin_permissions_from_session, db_call, SessionLocal
+from core import get_swap_entry_for_group
+from app import admin_required, update_lifted_config, load_user, sync_admin_permissions_for_session, clear_admin_permissions_from_session, db_call, admitted_db_session, release_request_db_session, get_db_pool_status
 
 admin = Blueprint('admin', __name__, static_folder='static')
 
@@ -41,16 +55,55 @@ def parse_email_csv(value):
         normalized = normalized.replace(delimiter, ",")
     return [email.strip() for email in normalized.split(",") if email.strip()]
 
+def parse_log_filters(args):
+    try:
+        return {
+            "log_type": args.get("log_type") or None,
+            "user_email": (args.get("user") or "").strip().lower() or None,
+            "since": datetime.fromisoformat(args["since"]) if args.get("since") else None,
+            "until": datetime.fromisoformat(args["until"]) if args.get("until") else None,
+        }
+    except ValueError:
+        abort(400, "since and until must be ISO timestamps")
+
 @admin.route("/api/admin/logs")
 @login_required
 @admin_required(write_required=False)
 def logs_page():
-    logs = db_call(list_logs_desc)
-    recently_deleted_messages = db_call(list_recently_deleted_messages_desc)
+    try:
+        page = db_call(
+            list_logs_desc,
+            limit=request.args.get("limit", LOGS_PAGE_SIZE, type=int),
+            cursor=request.args.get("cursor"),
+            **parse_log_filters(request.args),
+        )
+    except ValueError:
+        abort(400, "Invalid cursor")
+
+    return jsonify({"logs": page["results"], "next_cursor": page["next_cursor"]})
 
+@admin.route("/api/admin/recently-deleted-messages")
+@login_required
+@admin_required(write_required=False)
+def recently_deleted_messages_page():
+    try:
+        page = db_call(
+            list_recently_deleted_messages_desc,
+            limit=request.args.get("limit", LOGS_PAGE_SIZE, type=int),
+            cursor=request.args.get("cursor"),
+        )
+    except ValueError:
+        abort(400, "Invalid cursor")
+
+    return jsonify({"recently_deleted_messages": page["results"], "next_cursor": page["next_cursor"]})
+
+@admin.route("/api/admin/logs/count")
+@login_required
+@admin_required(write_required=False)
+def logs_count():
     return jsonify({
-        "logs": logs,
-        "recently_deleted_messages": recently_deleted_messages
+        "logs": db_call(count_logs, **parse_log_filters(request.args)),
+        "recently_deleted_messages": db_call(count_recently_deleted_messages),
     })
 
 ### Message Groups
@@ -174,8 +227,13 @@ def save_google_slides_id(message_group):
 @login_required
 @admin_required(write_required=True)
 def update_form_message_group():
+    old_form_message_group = current_app.config["lifted_config"]["form_message_group"]
     current_app.config["lifted_config"]["form_message_group"] = request.form.get("form-message-group")
     update_lifted_config(current_app.config["lifted_config"])
+
+    # The old semester's analytics snapshot gets frozen once it's no longer active, so make sure it's recomputed one last time
+    if old_form_message_group and old_form_message_group != "none":
+        db_call(delete_analytics_snapshot, "_".join(old_form_message_group.split("_")[0:2]))
     return jsonify({"status": "Form message group updated successfully!"})
 
 @admin.post("/api/admin/save-rich-text/<message_group>/<type>")
@@ -282,19 +340,21 @@ def send_custom_email():
         next_progress = 5
         stats = helpers.get_lifted_stats()
 
+        # Look up every recipient and create all the open-tracking rows up front, then send without the database
+        campaign = db_call(helpers.prepare_custom_email_campaign, subject, to)
+        release_request_db_session()
+
         print(f"[custom-email] Starting individual send for {total} recipient(s)", flush=True)
 
-        for index, recipient in enumerate(to, start=1):
-            with SessionLocal() as db_session:
-                helpers.send_custom_email(
-                    subject=subject,
-                    raw_html_content=html,
-                    to=[recipient],
-                    cc=cc,
-                    bcc=bcc,
-                    db_session=db_session,
-                    stats=stats,
-                )
+        for index, prepared in enumerate(campaign, start=1):
+            helpers.send_prepared_custom_email(
+                prepared,
+                subject=subject,
+                raw_html_content=html,
+                cc=cc,
+                bcc=bcc,
+                stats=stats,
+            )
 
             percent_complete = (index * 100) // total
             while percent_complete >= next_progress:
@@ -409,6 +469,62 @@ def update_theme():
     update_lifted_config(current_app.config["lifted_config"])
     return jsonify({"status": "Theme updated successfully!"})
 
+@admin.post("/api/admin/bulk-swap-messages")
+@login_required
+@admin_required(write_required=True)
+def bulk_swap_messages():
+    request_data = request.get_json(silent=True) or {}
+    message_group = request_data.get("message_group", "")
+    # Accept NetIDs or full emails
+    recipient_emails = [
+        recipient.lower() if "@" in recipient else f"{recipient.lower()}@cornell.edu"
+        for recipient in parse_email_csv(request_data.get("recipients", ""))
+    ]
+
+    swap_entry = get_swap_entry_for_group(message_group)
+    if swap_entry is None or not swap_entry.get("to"):
+        return jsonify({"swapped": False, "error": "Swapping is not enabled for this message group."}), 400
+
+    if not recipient_emails:
+        return jsonify({"swapped": False, "error": "No recipients given."}), 400
+
+    result = db_call(swap_messages_for_recipients, recipient_emails, message_group, swap_entry["to"])
+    helpers.log(current_user.id, current_user.full_name, "INFO", None, f"Bulk swapped {len(recipient_emails)} recipient(s) from {message_group} to {swap_entry['to']}: {result}")
+
+    return jsonify({"swapped": True, **result})
+
+@admin.post("/api/admin/bulk-delete-messages")
+@login_required
+@admin_required(write_required=True)
+def bulk_delete_messages():
+    """Delete (and archive to recently_deleted_messages) every message matching all the
+    given filters: message_group, sender (NetID or email) and message_ids.
+    With dry_run, only report how many messages would be deleted."""
+    request_data = request.get_json(silent=True) or {}
+    message_group = (request_data.get("message_group") or "").strip() or None
+    sender = (request_data.get("sender") or "").strip().lower()
+    sender_email = (sender if "@" in sender else f"{sender}@cornell.edu") if sender else None
+
+    message_ids = request_data.get("message_ids")
+    if isinstance(message_ids, str):
+        message_ids = parse_email_csv(message_ids)
+    try:
+        message_ids = [int(message_id) for message_id in message_ids] if message_ids else None
+    except (TypeError, ValueError):
+        return jsonify({"deleted": False, "error": "Message IDs must be numbers."}), 400
+
+    if message_group is None and sender_email is None and message_ids is None:
+        return jsonify({"deleted": False, "error": "Give a message group, sender or message IDs."}), 400
+
+    filters = {"message_ids": message_ids, "message_group": message_group, "sender_email": sender_email}
+    if request_data.get("dry_run"):
+        return jsonify({"deleted": False, "matching_messages": db_call(count_messages_to_delete, **filters)})
+
+    deleted_messages = db_call(delete_messages, **filters)
+    helpers.log(current_user.id, current_user.full_name, "INFO", None, f"Bulk deleted {deleted_messages} message(s) matching {filters}")
+
+    return jsonify({"deleted": True, "deleted_messages": deleted_messages})
+
 @admin.route("/api/admin/delete-swap-pref/<id>")
 @login_required
 @admin_required(write_required=True)
@@ -431,15 +547,61 @@ def delete_swap_pref(id):
 def browse_messages():
     query = request.args.get("q")
     message_group = request.args.get("mg")
+    cursor = request.args.get("cursor")
 
-    if current_user.id != "rf377":
+    # Log the search once, not once per page
+    if current_user.id != "rf377" and not cursor:
         helpers.log(current_user.id, current_user.full_name, "INFO", None, f"Queried '{query}' for {message_group}")
 
-    results = db_call(browse_messages_repo, message_group, query)
+    # ?format=ndjson streams every match, one JSON object per line
+    if request.args.get("format") == "ndjson":
+        def generate():
+            with admitted_db_session(read_only=True) as db_session:
+                for message in iter_browse_messages(message_group, query, db_session):
+                    yield current_app.json.dumps(message) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    try:
+        page = db_call(
+            browse_messages_repo,
+            message_group,
+            query,
+            limit=request.args.get("limit", BROWSE_MESSAGES_PAGE_SIZE, type=int),
+            cursor=cursor,
+            with_estimate=request.args.get("estimate") == "true",
+        )
+    except ValueError:
+        abort(400, "Invalid cursor")
+
+    if len(page["results"]) == 0:
+        page["results"] = "none"
+
+    return jsonify(page)
+
+@admin.route("/api/admin/search-messages")
+@login_required
+@admin_required(write_required=False)
+def search_messages():
+    query = request.args.get("q", "").strip()
+    message_group = request.args.get("mg", "all")
+
+    if not query:
+        return jsonify({"results": "none"})
+
+    if current_user.id != "rf377":
+        helpers.log(current_user.id, current_user.full_name, "INFO", None, f"Searched message text for '{query}' in {message_group}")
+
+    results = db_call(
+        search_messages_repo,
+        query,
+        message_group,
+        limit=request.args.get("limit", SEARCH_MESSAGES_LIMIT, type=int),
+    )
 
     if len(results) == 0:
         return jsonify({"results": "none"})
-    
+
     return jsonify({"results": results})
 
 ### Process Cards
@@ -512,39 +674,47 @@ def process_all_cards(message_group):
     if not presentation_id:
         return jsonify({"status": "error", "message": "No Google Slides template found for this message group"}), 404
     
-    cards = db_call(get_cards_with_attachments, message_group)
-    
-    # Sort alphabetically by netid (letters then numbers) if requested
-    if request.args.get('alphabetical') == "true":
-        import re
-        def netid_sort_key(card):
-            email = card['recipient_email']
-            # Extract letters and numbers from email prefix (before @)
-            match = re.match(r'^([a-z]+)(\d+)', email)
-            if match:
-                letters, numbers = match.groups()
-                return (letters, int(numbers))
-            return (email, 0)  # fallback for non-standard format
-        cards = sorted(cards, key=netid_sort_key)
-    
-    if len(cards) == 0:
-        return jsonify({"status": "error", "message": "No cards found"}), 404
+    # Sorted alphabetically by netid (letters then numbers) in SQL if requested
+    order_by_netid = request.args.get('alphabetical') == "true"
+    should_process_pptx_pdf = True if request.args.get("pptx-pdf") == "true" else False
+
+    if should_process_pptx_pdf:
+        # The Slides pipeline makes several passes over the cards, so it needs them as a list
+        cards = db_call(get_cards_with_attachments, message_group, order_by_netid=order_by_netid)
+        if len(cards) == 0:
+            return jsonify({"status": "error", "message": "No cards found"}), 404
 
     output_filepath = "all_cards_output/" + message_group + datetime.now().strftime(" %m-%d-%Y at %H-%M-%S")
-    
-    should_process_pptx_pdf = True if request.args.get("pptx-pdf") == "true" else False
 
     with open(f"{output_filepath}.txt", "w") as file:
         file.write(f".csv{', .pptx, .pdf' if should_process_pptx_pdf == True else ''}\n0% starting")
-    
-    helpers.create_csv(cards, output_filepath)
 
     if should_process_pptx_pdf:
+        helpers.create_csv(cards, output_filepath)
+        release_request_db_session()
         import google_tools
-        google_tools.cards_to_pdf(presentation_id, [dict(card) for card in cards], output_filepath)
+        google_tools.cards_to_pdf(presentation_id, cards, output_filepath)
+    else:
+        # CSV only: stream the cards from a server-side cursor straight into the file
+        with admitted_db_session(read_only=True) as db_session:
+            card_count = helpers.create_csv(
+                iter_cards_with_attachments(message_group, db_session, order_by_netid=order_by_netid),
+                output_filepath,
+            )
+        if card_count == 0:
+            os.remove(f"{output_filepath}.txt")
+            return jsonify({"status": "error", "message": "No cards found"}), 404
     
     return jsonify({"status": "Processing started!"})
 
+### Metrics
+
+@admin.route("/api/admin/metrics")
+@login_required
+@admin_required(write_required=False)
+def get_metrics():
+    return jsonify({**metrics.snapshot(), "db_pool": get_db_pool_status()})
+
 ### Impersonation
 
 @admin.post("/api/admin/impersonate")
@@ -1,29 +1,310 @@
-from flask import Flask, session, abort, jsonify, request, send_file
+from flask import Flask, session, abort, jsonify, request, send_file, g, has_request_context
 from flask_login import LoginManager, UserMixin, login_user, current_user
 from flask_oidc import OpenIDConnect, signals
 from werkzeug.exceptions import HTTPException
 from waitress import serve
+from contextlib import contextmanager
 from functools import wraps
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError, OperationalError
 from sqlalchemy.orm import sessionmaker
 
 import json
 import sqlite3
 import os
+import signal
+import sys
+import threading
+import time
 import helpers
-from db.repositories import get_admin_by_email, upsert_user_from_oidc
+import metrics
+import notified_cache
+from db.repositories import admin_roster_cache, get_admin_roster, upsert_user_from_oidc
 
 load_dotenv()
 
 login_manager = LoginManager()
 
 database_url = os.environ.get("POSTGRES_URL")
-engine = create_engine(database_url, pool_pre_ping=True)
+
+# Pool settings; size + overflow bounds how many connections this process opens
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+
+engine_options = {
+    "pool_pre_ping": True,
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+}
+engine = create_engine(database_url, **engine_options)
 SessionLocal = sessionmaker(bind=engine)
 
+# Optional streaming replica for @read_only repository functions (see db_call).
+# Without one, everything goes to the primary.
+replica_database_url = os.environ.get("REPLICA_POSTGRES_URL")
+# A busy replica isn't waited on for long: reads that can't get in go to the primary
+REPLICA_POOL_TIMEOUT = float(os.environ.get("REPLICA_POOL_TIMEOUT", "1"))
+replica_engine = (
+    create_engine(replica_database_url, **{**engine_options, "pool_timeout": REPLICA_POOL_TIMEOUT})
+    if replica_database_url else None
+)
+ReadSessionLocal = sessionmaker(bind=replica_engine) if replica_engine is not None else SessionLocal
+
+# After a user writes, their reads stay on the primary this many seconds so replica lag doesn't hide their own writes
+READ_YOUR_WRITES_SECONDS = float(os.environ.get("READ_YOUR_WRITES_SECONDS", "10"))
+
+# Admission control: at most DB_ADMISSION_LIMIT requests hold a connection at
+# once (a couple are left for the write-behind flusher and other non-request
+# callers).  The rest queue for up to DB_ADMISSION_TIMEOUT seconds and then get
+# a 503, instead of all of waitress's threads piling up on the pool.
+DB_ADMISSION_LIMIT = int(os.environ.get("DB_ADMISSION_LIMIT", max(1, DB_POOL_SIZE + DB_MAX_OVERFLOW - 2)))
+DB_ADMISSION_TIMEOUT = float(os.environ.get("DB_ADMISSION_TIMEOUT", "5"))
+WAITRESS_THREADS = int(os.environ.get("WAITRESS_THREADS", "500"))
+db_admission = threading.BoundedSemaphore(DB_ADMISSION_LIMIT)
+
+# The replica's pool is admitted the same way, but requests that don't get in
+# within REPLICA_ADMISSION_TIMEOUT read from the primary (and its admission) instead
+REPLICA_ADMISSION_LIMIT = int(os.environ.get("REPLICA_ADMISSION_LIMIT", DB_ADMISSION_LIMIT))
+REPLICA_ADMISSION_TIMEOUT = float(os.environ.get("REPLICA_ADMISSION_TIMEOUT", "0.2"))
+replica_admission = threading.BoundedSemaphore(REPLICA_ADMISSION_LIMIT)
+
+SERVER_BUSY_MESSAGE = "The server is busy right now.  Please try again in a few seconds."
+
+# Set to false to go back to one session (and pool checkout) per db_call, e.g. to compare checkout metrics
+REQUEST_SCOPED_DB_SESSION = os.environ.get("REQUEST_SCOPED_DB_SESSION", "true").lower() != "false"
+
+
+@event.listens_for(engine, "checkout")
+def count_db_checkout(dbapi_connection, connection_record, connection_proxy):
+    if has_request_context():
+        g.db_checkouts = g.get("db_checkouts", 0) + 1
+
+
+if replica_engine is not None:
+    event.listen(replica_engine, "checkout", count_db_checkout)
+
+
+def admit_db_request():
+    """Wait for an admission slot, or shed the request with a 503.  Returns
+    when it was admitted; the caller releases db_admission when done."""
+    started = time.perf_counter()
+    if not db_admission.acquire(timeout=DB_ADMISSION_TIMEOUT):
+        metrics.increment("db_admission.shed")
+        abort(503, SERVER_BUSY_MESSAGE)
+    admitted = time.perf_counter()
+    metrics.observe("db_admission_wait_ms", (admitted - started) * 1000)
+    return admitted
+
+
+def admit_replica_request():
+    """Whether a replica admission slot came free in time; the caller releases
+    replica_admission if so, and reads from the primary if not."""
+    started = time.perf_counter()
+    if not replica_admission.acquire(timeout=REPLICA_ADMISSION_TIMEOUT):
+        metrics.increment("db_replica.shed")
+        return False
+    metrics.observe("db_replica_admission_wait_ms", (time.perf_counter() - started) * 1000)
+    return True
+
+
+def get_request_db_session():
+    """The session every db_call in the current request shares, opened on first use.
+
+    It is bound to one connection with an outer transaction, so the commits
+    inside repository functions don't end it; close_request_db_session commits
+    or rolls back the whole request at teardown.
+    """
+    if "db_session" not in g:
+        admitted = admit_db_request()
+        try:
+            connection = engine.connect()
+        except PoolTimeoutError:
+            db_admission.release()
+            metrics.increment("db_pool.timeouts")
+            abort(503, SERVER_BUSY_MESSAGE)
+        except Exception:
+            db_admission.release()
+            raise
+        metrics.observe("db_pool_wait_ms", (time.perf_counter() - admitted) * 1000)
+
+        connection.begin()
+        g.db_connection = connection
+        g.db_session = SessionLocal(bind=connection)
+    return g.db_session
+
+
+def release_request_db_session(exc=None):
+    """Finish the request's transaction and return its connection to the pool.
+
+    Call this before slow external work (Google Slides, email) so the request
+    doesn't hold a connection and row locks meanwhile; a later db_call opens a
+    new one.
+    """
+    replica_session = g.pop("db_replica_session", None)
+    if replica_session is not None:
+        try:
+            replica_session.close()
+        finally:
+            replica_admission.release()
+
+    db_session = g.pop("db_session", None)
+    connection = g.pop("db_connection", None)
+    if connection is None:
+        return
+
+    try:
+        db_session.close()
+        if exc is None:
+            connection.commit()
+        else:
+            connection.rollback()
+    finally:
+        connection.close()
+        db_admission.release()
+
+
+@contextmanager
+def admitted_db_session(read_only=False):
+    """A session for request code that can't go through db_call: after
+    release_request_db_session, or to stream a result.  It is admitted (or
+    sheds a 503) like the request's own session, and if the request still
+    has that one open it's reused rather than taking a second connection.
+    read_only sessions go to the replica when there is one.  Outside a
+    request it's a plain session.
+    """
+    if read_only and replica_engine is not None:
+        if not has_request_context():
+            with ReadSessionLocal() as db_session:
+                yield db_session
+            return
+        if admit_replica_request():
+            try:
+                with ReadSessionLocal() as db_session:
+                    try:
+                        db_session.connection()
+                    except (OperationalError, PoolTimeoutError):
+                        metrics.increment("db_replica.fallbacks")
+                    else:
+                        yield db_session
+                        return
+            finally:
+                replica_admission.release()
+
+    if not has_request_context():
+        with SessionLocal() as db_session:
+            yield db_session
+        return
+
+    if "db_session" in g:
+        yield g.db_session
+        return
+
+    admitted = admit_db_request()
+    try:
+        with SessionLocal() as db_session:
+            try:
+                db_session.connection()
+            except PoolTimeoutError:
+                metrics.increment("db_pool.timeouts")
+                abort(503, SERVER_BUSY_MESSAGE)
+            metrics.observe("db_pool_wait_ms", (time.perf_counter() - admitted) * 1000)
+            yield db_session
+    finally:
+        db_admission.release()
+
+
+def get_db_pool_status():
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "admission_limit": DB_ADMISSION_LIMIT,
+        "replica_admission_limit": REPLICA_ADMISSION_LIMIT if replica_engine is not None else None,
+    }
+
+
+def close_request_db_session(exc):
+    release_request_db_session(exc)
+    checkouts = g.get("db_checkouts", 0)
+    metrics.observe("db_checkouts_per_request", checkouts)
+    if request.endpoint:
+        metrics.observe(f"db_checkouts_per_request.{request.endpoint}", checkouts)
+
+
+def use_replica_for(repo_fn):
+    """Whether repo_fn can run on the replica: it must be @read_only, and the
+    current request and user must not have written recently."""
+    if replica_engine is None or not getattr(repo_fn, "read_only", False):
+        return False
+    if not has_request_context():
+        return True
+    return not g.get("db_wrote") and session.get("db_primary_until", 0) < time.time()
+
+
+def mark_db_write():
+    if replica_engine is None or not has_request_context():
+        return
+    g.db_wrote = True
+    if current_user.is_authenticated:
+        session["db_primary_until"] = time.time() + READ_YOUR_WRITES_SECONDS
+
+
+# replica_call's result when the replica is unreachable and the read should go to the primary instead
+REPLICA_FAILED = object()
+
+
+def replica_call(repo_fn, *args, **kwargs):
+    if has_request_context():
+        if "db_replica_session" not in g:
+            # Once shed, the rest of the request reads from the primary rather than waiting again
+            if g.get("db_replica_shed") or not admit_replica_request():
+                g.db_replica_shed = True
+                return REPLICA_FAILED
+            g.db_replica_session = ReadSessionLocal()
+        db_session = g.db_replica_session
+    else:
+        db_session = ReadSessionLocal()
+
+    try:
+        result = repo_fn(*args, db_session=db_session, **kwargs)
+        metrics.increment("db_replica.reads")
+        return result
+    except (OperationalError, PoolTimeoutError):
+        db_session.rollback()
+        metrics.increment("db_replica.fallbacks")
+        return REPLICA_FAILED
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        if not has_request_context():
+            db_session.close()
+
 
 def db_call(repo_fn, *args, **kwargs):
+    if use_replica_for(repo_fn):
+        result = replica_call(repo_fn, *args, **kwargs)
+        if result is not REPLICA_FAILED:
+            return result
+    elif not getattr(repo_fn, "read_only", False):
+        mark_db_write()
+
+    if REQUEST_SCOPED_DB_SESSION and has_request_context():
+        db_session = get_request_db_session()
+        try:
+            return repo_fn(*args, db_session=db_session, **kwargs)
+        except Exception:
+            # Leave the session usable for the error handler; this discards the request's writes so far
+            db_session.rollback()
+            raise
+
     with SessionLocal() as db_session:
         return repo_fn(*args, db_session=db_session, **kwargs)
 
@@ -46,6 +327,9 @@ def create_app():
 
     oidc = OpenIDConnect(app)
     login_manager.init_app(app)
+    app.teardown_request(close_request_db_session)
+    # Replica reads right after a change are only cached as long as the replica may lag
+    notified_cache.listener.start(engine, settle_seconds=READ_YOUR_WRITES_SECONDS if replica_engine is not None else 0)
 
     from core import core
     from admin import admin
@@ -121,8 +405,11 @@ def admin_required(write_required):
 
 def get_admin_permissions_for_netid(netid):
     email = f"{netid}@cornell.edu"
-    with SessionLocal() as db_session:
-        permissions = get_admin_by_email(db_session, email)
+    # Only touch the database (and take a connection) when the cached roster is stale
+    roster = admin_roster_cache.cached()
+    if roster is None:
+        roster = db_call(get_admin_roster)
+    permissions = roster.get(email)
 
     if permissions is None:
         return {
@@ -180,8 +467,10 @@ signals.after_authorize.connect(after_oidc_authorize)
 if __name__ == '__main__':
     app = create_app()
     after_setup(app)
+    # Exit normally on SIGTERM so atexit handlers (the write-behind flush) run
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     # app.run(host='127.0.0.1', debug=app.debug, ssl_context="adhoc")
     if app.debug:
         app.run(host='127.0.0.1', debug=app.debug, ssl_context=('cert.pem', 'key.pem'))
     else:
-        serve(app, host='0.0.0.0', port=5000, url_scheme='https', threads=500)
\ No newline at end of file
+        serve(app, host='0.0.0.0', port=5000, url_scheme='https', threads=WAITRESS_THREADS)
\ No newline at end of file
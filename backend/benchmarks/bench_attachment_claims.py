@@ -0,0 +1,194 @@
+"""Concurrent attachment picking: one counter row and four transactions vs sharded stock.
+
+Starts --pickers threads at once (500 by default, like attachment selection
+opening), each picking a random attachment and some of them changing their
+mind once.  "before" keeps each attachment's stock in one row and runs the
+old set_attachment flow (claim, get pref, update or create pref, restock: one
+commit each); "after" is set_attachment_pref with ATTACHMENT_STOCK_SHARDS
+shards.  Threads share a pool of --connections connections, as request
+threads do.  After each run it checks nothing was oversold: stock left plus
+prefs held must equal the starting stock, and no shard may go negative.
+A last "tight stock" run gives each attachment exactly enough for everyone
+who picks it, so shards run dry while others still have stock; nobody may
+be told it's sold out there (exits 1 if anyone is).
+
+Usage (from backend/, with BENCH_POSTGRES_URL set):
+    python -m benchmarks.bench_attachment_claims --pickers 500
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_message_ranks import percentile
+from benchmarks.seed import get_bench_engine, create_schema
+from db.models import Attachment, AttachmentPref, AttachmentStockShard
+from db.repositories import (
+    ATTACHMENT_STOCK_SHARDS,
+    _claim_attachment_stock,
+    _return_attachment_stock,
+    get_attachment_pref,
+    set_attachment_pref,
+    set_attachment_stock,
+)
+
+MESSAGE_GROUP = "bench_claims_p"
+ATTACHMENT_NAMES = ["Chocolate", "Flower", "Keychain"]
+
+
+def legacy_pick(recipient_email, attachment_id, db_session):
+    """set_attachment before the inventory rework: four separate commits."""
+    if not _claim_attachment_stock(attachment_id, db_session):
+        db_session.commit()
+        return False
+    db_session.commit()
+
+    previous = get_attachment_pref(recipient_email, MESSAGE_GROUP, db_session)
+    db_session.commit()
+
+    if previous:
+        db_session.execute(
+            update(AttachmentPref)
+            .where((AttachmentPref.recipient_email == recipient_email) & (AttachmentPref.message_group == MESSAGE_GROUP))
+            .values(attachment_id=attachment_id)
+        )
+        db_session.commit()
+        _return_attachment_stock(previous["attachment_id"], db_session)
+    else:
+        db_session.execute(insert(AttachmentPref).values(
+            recipient_email=recipient_email, message_group=MESSAGE_GROUP, attachment_id=attachment_id,
+        ))
+    db_session.commit()
+    return True
+
+
+def current_pick(recipient_email, attachment_id, db_session):
+    return set_attachment_pref(recipient_email, MESSAGE_GROUP, attachment_id, db_session)
+
+
+def reset(SessionLocal, stock, shards):
+    with SessionLocal() as db_session:
+        db_session.execute(delete(AttachmentPref).where(AttachmentPref.message_group == MESSAGE_GROUP))
+        old_ids = select(Attachment.id).where(Attachment.message_group == MESSAGE_GROUP)
+        db_session.execute(delete(AttachmentStockShard).where(AttachmentStockShard.attachment_id.in_(old_ids)))
+        db_session.execute(delete(Attachment).where(Attachment.message_group == MESSAGE_GROUP))
+        attachment_ids = db_session.execute(
+            insert(Attachment).returning(Attachment.id),
+            [{"message_group": MESSAGE_GROUP, "attachment": name} for name in ATTACHMENT_NAMES],
+        ).scalars().all()
+        db_session.commit()
+        for attachment_id in attachment_ids:
+            set_attachment_stock(attachment_id, stock, db_session, shards=shards)
+    return attachment_ids
+
+
+def make_plans(pickers, change_rate, seed):
+    """Which attachments (by index into ATTACHMENT_NAMES) each picker picks, in order."""
+    rng = random.Random(seed)
+    return [
+        [rng.randrange(len(ATTACHMENT_NAMES)) for _ in range(2 if rng.random() < change_rate else 1)]
+        for _ in range(pickers)
+    ]
+
+
+def run_pickers(pick, SessionLocal, attachment_ids, plans):
+    plans = [[attachment_ids[index] for index in plan] for plan in plans]
+    pickers = len(plans)
+    start = threading.Barrier(pickers + 1)
+    timings, errors, sold_out = [], [], []
+    lock = threading.Lock()
+
+    def picker(index, plan):
+        recipient_email = f"picker{index}@cornell.edu"
+        start.wait()
+        for attachment_id in plan:
+            started = time.perf_counter()
+            try:
+                with SessionLocal() as db_session:
+                    claimed = pick(recipient_email, attachment_id, db_session)
+            except Exception as error:
+                with lock:
+                    errors.append(repr(error))
+                continue
+            with lock:
+                timings.append((time.perf_counter() - started) * 1000)
+                if not claimed:
+                    sold_out.append(recipient_email)
+
+    threads = [threading.Thread(target=picker, args=(index, plan)) for index, plan in enumerate(plans)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, timings, errors, sold_out
+
+
+def check_stock(SessionLocal, attachment_ids, stock):
+    with SessionLocal() as db_session:
+        left = db_session.execute(
+            select(func.coalesce(func.sum(AttachmentStockShard.count), 0))
+            .where(AttachmentStockShard.attachment_id.in_(attachment_ids))
+        ).scalar_one()
+        negative = db_session.execute(
+            select(func.count())
+            .where(AttachmentStockShard.attachment_id.in_(attachment_ids) & (AttachmentStockShard.count < 0))
+        ).scalar_one()
+        held = db_session.execute(
+            select(func.count()).select_from(AttachmentPref).where(AttachmentPref.message_group == MESSAGE_GROUP)
+        ).scalar_one()
+    return left + held == stock * len(attachment_ids) and negative == 0, left, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pickers", type=int, default=500)
+    parser.add_argument("--connections", type=int, default=50, help="Pool size shared by the pickers (keep under max_connections)")
+    parser.add_argument("--stock", type=int, default=2000, help="Starting stock of each attachment; lower it to exercise selling out")
+    parser.add_argument("--change-rate", type=float, default=0.3, help="Share of pickers who switch attachments once")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    engine = get_bench_engine(pool_size=args.connections, max_overflow=0, pool_timeout=300)
+    create_schema(engine)
+    SessionLocal = sessionmaker(bind=engine)
+
+    plans = make_plans(args.pickers, args.change_rate, args.seed)
+    # Exactly enough of each attachment for everyone who might hold one at once,
+    # so shards run dry while others still have stock
+    tight_stock = max(sum(index in plan for plan in plans) for index in range(len(ATTACHMENT_NAMES)))
+    runs = (
+        ("before (1 row, 4 commits)", legacy_pick, 1, args.stock),
+        (f"after ({ATTACHMENT_STOCK_SHARDS} shards, 1 commit)", current_pick, ATTACHMENT_STOCK_SHARDS, args.stock),
+        ("after, tight stock", current_pick, ATTACHMENT_STOCK_SHARDS, tight_stock),
+    )
+    failed = False
+    for label, pick, shards, stock in runs:
+        attachment_ids = reset(SessionLocal, stock, shards)
+        elapsed, timings, errors, sold_out = run_pickers(pick, SessionLocal, attachment_ids, plans)
+        consistent, left, held = check_stock(SessionLocal, attachment_ids, stock)
+        print(
+            f"{label:30} {len(timings) / elapsed:8.0f} picks/s  "
+            f"p50={percentile(timings, 50):8.2f} ms  p99={percentile(timings, 99):8.2f} ms  "
+            f"n={len(timings)} sold_out={len(sold_out)} errors={len(errors)}  "
+            f"stock {'ok' if consistent else 'INCONSISTENT'} (left={left}, held={held})"
+        )
+        for error in errors[:3]:
+            print(f"    {error}")
+        failed = failed or not consistent
+        if stock == tight_stock and (sold_out or not left):
+            print("    FAILED: pickers were told it was sold out while stock was left")
+            failed = True
+
+    reset(SessionLocal, 0, 1)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
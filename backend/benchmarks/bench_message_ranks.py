@@ -0,0 +1,95 @@
+"""Rank lookup latency for /api/messages: full-table rank() windows vs message_group_ranks.
+
+Usage (from backend/, with BENCH_POSTGRES_URL set):
+    python -m benchmarks.bench_message_ranks --messages 100000
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.seed import get_bench_engine, create_schema, seed_messages
+from db.models import Message, MessageGroupRank
+from db.repositories import rows_to_dicts, _get_ranks_for_email, RANK_DIRECTION_RECEIVED, RANK_DIRECTION_SENT
+
+
+def legacy_ranks(target_email, db_session):
+    """The window-function lookup get_messages_payload used before message_group_ranks."""
+    ranks = []
+    for email_column in (Message.recipient_email, Message.sender_email):
+        stats = select(
+            Message.message_group.label("message_group"),
+            email_column.label("email"),
+            func.count().label("cnt")
+        ).group_by(Message.message_group, email_column).subquery()
+
+        ranking = select(
+            stats.c.message_group,
+            stats.c.email,
+            func.rank().over(partition_by=stats.c.message_group, order_by=stats.c.cnt.desc()).label("rank")
+        ).subquery()
+
+        ranks.append(rows_to_dicts(db_session.execute(
+            select(ranking.c.message_group, ranking.c.rank).where(ranking.c.email == target_email)
+        )))
+    return ranks
+
+
+def current_ranks(target_email, db_session):
+    return [
+        _get_ranks_for_email(target_email, RANK_DIRECTION_RECEIVED, db_session),
+        _get_ranks_for_email(target_email, RANK_DIRECTION_SENT, db_session),
+    ]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def time_lookups(lookup, emails, db_session):
+    samples = []
+    for email in emails:
+        started = time.perf_counter()
+        lookup(email, db_session)
+        samples.append((time.perf_counter() - started) * 1000)
+        db_session.rollback()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data already in BENCH_POSTGRES_URL")
+    args = parser.parse_args()
+
+    engine = get_bench_engine()
+    SessionLocal = sessionmaker(bind=engine)
+
+    with SessionLocal() as db_session:
+        if not args.skip_seed:
+            create_schema(engine)
+            print(f"Seeding {args.messages} messages...")
+            seed_messages(db_session, args.messages)
+
+        emails = db_session.execute(select(MessageGroupRank.email).distinct()).scalars().all()
+        emails = random.Random(1).sample(emails, min(args.lookups, len(emails)))
+
+        for label, lookup in (("before (rank() windows)", legacy_ranks), ("after (message_group_ranks)", current_ranks)):
+            lookup(emails[0], db_session)  # warm up
+            samples = time_lookups(lookup, emails, db_session)
+            print(f"{label:30} p50={percentile(samples, 50):8.2f} ms  p99={percentile(samples, 99):8.2f} ms  n={len(samples)}")
+
+        mismatches = sum(
+            [sorted(ranks, key=lambda row: row["message_group"]) for ranks in legacy_ranks(email, db_session)]
+            != [sorted(ranks, key=lambda row: row["message_group"]) for ranks in current_ranks(email, db_session)]
+            for email in emails
+        )
+        print(f"rank mismatches between old and new lookups: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Admin message search latency: ilike '%q%' scans vs the search indexes.
+
+Compares the two kinds of search admins run:
+  - NetID lookups on sender/recipient email: the old ilike '%q%' filter vs the
+    lower(email) prefix match browse_messages now uses
+  - words in message content or names: ilike '%word%' over message_content vs
+    search_messages (tsvector + GIN, ranked)
+
+Usage (from backend/, with BENCH_POSTGRES_URL set):
+    python -m benchmarks.bench_message_search --messages 200000
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import select, or_
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_message_ranks import percentile
+from benchmarks.seed import get_bench_engine, create_schema, seed_messages
+from db.models import Message
+from db.repositories import rows_to_dicts, browse_messages, search_messages, _browse_messages_stmt
+
+
+def legacy_netid_search(netid, db_session):
+    """The ilike filter browse_messages used before the prefix indexes."""
+    like_value = f"%{netid}%"
+    stmt = _browse_messages_stmt("all", None).where(
+        or_(Message.recipient_email.ilike(like_value), Message.sender_email.ilike(like_value))
+    )
+    return rows_to_dicts(db_session.execute(stmt.limit(200)))
+
+
+def current_netid_search(netid, db_session):
+    return browse_messages("all", netid, db_session)["results"]
+
+
+def legacy_content_search(word, db_session):
+    like_value = f"%{word}%"
+    stmt = _browse_messages_stmt("all", None).where(or_(
+        Message.message_content.ilike(like_value),
+        Message.sender_name.ilike(like_value),
+        Message.recipient_name.ilike(like_value),
+    ))
+    return rows_to_dicts(db_session.execute(stmt.limit(100)))
+
+
+def current_content_search(word, db_session):
+    return search_messages(word, "all", db_session)
+
+
+def time_searches(search, terms, db_session):
+    samples = []
+    for term in terms:
+        started = time.perf_counter()
+        search(term, db_session)
+        samples.append((time.perf_counter() - started) * 1000)
+        db_session.rollback()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--searches", type=int, default=100)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data already in BENCH_POSTGRES_URL")
+    args = parser.parse_args()
+
+    engine = get_bench_engine()
+    SessionLocal = sessionmaker(bind=engine)
+
+    with SessionLocal() as db_session:
+        if not args.skip_seed:
+            create_schema(engine)
+            print(f"Seeding {args.messages} messages...")
+            seed_messages(db_session, args.messages)
+
+        emails = db_session.execute(select(Message.sender_email).distinct()).scalars().all()
+        netids = [email.split("@")[0] for email in random.Random(1).sample(emails, min(args.searches, len(emails)))]
+
+        cases = (
+            ("NetID, before (ilike '%q%')", legacy_netid_search, netids),
+            ("NetID, after (prefix index)", current_netid_search, netids),
+            ("content, before (ilike '%q%')", legacy_content_search, netids),
+            ("content, after (tsvector GIN)", current_content_search, netids),
+        )
+        for label, search, terms in cases:
+            search(terms[0], db_session)  # warm up
+            samples = time_searches(search, terms, db_session)
+            print(f"{label:32} p50={percentile(samples, 50):8.2f} ms  p99={percentile(samples, 99):8.2f} ms  n={len(samples)}")
+
+        misses = sum(
+            {row["id"] for row in legacy_netid_search(netid, db_session)}
+            != {row["id"] for row in current_netid_search(netid, db_session)}
+            for netid in netids
+        )
+        print(f"NetID searches where old and new results differ: {misses}")
+
+
+if __name__ == "__main__":
+    main()
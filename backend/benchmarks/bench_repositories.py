@@ -0,0 +1,211 @@
+"""Latency of the repository functions, saved as JSON so versions can be compared.
+
+Times every function in check_query_plans.HOT_QUERIES plus the heavier admin
+and analytics reads against a seeded scratch database, cycling through a set of
+sample messages.  Writes happen in a transaction that is rolled back, so the
+dataset doesn't drift between runs.  Results (p50/p95/p99 per function, the
+git commit and the dataset size) go to benchmarks/results/<commit>.json.
+Pass --compare with an earlier results file to flag functions whose p50 got
+slower by more than --threshold.
+
+Usage (from backend/, with BENCH_POSTGRES_URL set):
+    python -m benchmarks.bench_repositories --messages 200000
+    python -m benchmarks.bench_repositories --skip-seed --compare benchmarks/results/abc1234.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from benchmarks.bench_message_ranks import percentile
+from benchmarks.check_query_plans import HOT_QUERIES
+from benchmarks.seed import get_bench_engine, create_schema, seed_dataset
+from db.models import Message
+from db.repositories import (
+    get_lifted_stats,
+    list_swap_prefs,
+    list_admins,
+    count_logs,
+    get_attachment_prefs_with_attachment,
+    iter_cards_with_attachments,
+    bulk_upsert_users,
+    insert_logs,
+    _compute_analytics_payload,
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+DATASET_TABLES = ["messages", "users", "attachment_prefs", "swap_prefs", "emails", "logs"]
+
+
+def _semester(message_group):
+    return "_".join(message_group.split("_")[0:2])
+
+
+BENCHMARKS = {
+    **HOT_QUERIES,
+    "get_lifted_stats": lambda db, s: get_lifted_stats(db),
+    "list_swap_prefs": lambda db, s: list_swap_prefs(db),
+    "list_admins": lambda db, s: list_admins(db),
+    "count_logs": lambda db, s: count_logs(db),
+    "get_attachment_prefs_with_attachment": lambda db, s: get_attachment_prefs_with_attachment(s["message_group"], db),
+    "iter_cards_with_attachments (netid order)": lambda db, s: sum(
+        1 for _ in iter_cards_with_attachments(s["message_group"], db, order_by_netid=True)
+    ),
+    "bulk_upsert_users (100)": lambda db, s: bulk_upsert_users(
+        [{"email": f"bench{i}@cornell.edu", "given_name": "Bench", "full_name": "Bench User", "affiliation": "student"} for i in range(100)],
+        db,
+    ),
+    "insert_logs (100)": lambda db, s: insert_logs(
+        [{
+            "log_timestamp": s["created_timestamp"],
+            "user_email": s["email"],
+            "user_name": "Bench",
+            "log_type": "INFO",
+            "error_code": None,
+            "log_content": "bench",
+        }] * 100,
+        db,
+    ),
+    "_compute_analytics_payload (semester)": lambda db, s: _compute_analytics_payload(_semester(s["message_group"]), db),
+    "_compute_analytics_payload (all)": lambda db, s: _compute_analytics_payload("all", db),
+}
+
+# Slow enough that a handful of runs is plenty
+HEAVY_BENCHMARKS = {
+    "get_cards_with_attachments",
+    "iter_cards_with_attachments (netid order)",
+    "_compute_analytics_payload (semester)",
+    "_compute_analytics_payload (all)",
+}
+
+
+def get_samples(connection, count):
+    return connection.execute(
+        select(
+            Message.id.label("card_id"),
+            Message.recipient_email.label("email"),
+            Message.message_group,
+            Message.created_timestamp,
+        ).order_by(func.random()).limit(count)
+    ).mappings().all()
+
+
+def time_benchmark(connection, call, samples, iterations):
+    timings = []
+    for i in range(iterations + 1):
+        sample = samples[i % len(samples)]
+        with connection.begin_nested() as savepoint:
+            with Session(bind=connection) as db_session:
+                started = time.perf_counter()
+                call(db_session, sample)
+                elapsed = (time.perf_counter() - started) * 1000
+            savepoint.rollback()
+        if i > 0:  # the first run only warms the cache
+            timings.append(elapsed)
+    return timings
+
+
+def summarize(timings):
+    return {
+        "n": len(timings),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def compare(results, baseline, threshold):
+    """Print p50 changes against baseline; returns the names that regressed."""
+    regressions = []
+    print(f"\nCompared with {baseline['commit']} ({baseline['created_at']}):")
+    for name, stats in results["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if before is None:
+            print(f"{name:44} new")
+            continue
+        change = (stats["p50_ms"] - before["p50_ms"]) / before["p50_ms"] if before["p50_ms"] else 0
+        # Sub-millisecond wobble isn't a regression
+        regressed = change > threshold and stats["p50_ms"] - before["p50_ms"] > 1
+        print(f"{name:44} {before['p50_ms']:9.2f} -> {stats['p50_ms']:9.2f} ms  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--semesters", type=int, default=6)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--samples", type=int, default=30, help="How many different messages/users to cycle through")
+    parser.add_argument("--only", action="append", help="Only run benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data already in BENCH_POSTGRES_URL")
+    parser.add_argument("--output", help="Where to write the results (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="p50 slowdown that counts as a regression (default 0.25 = 25%%)")
+    args = parser.parse_args()
+
+    engine = get_bench_engine()
+    if not args.skip_seed:
+        create_schema(engine)
+        print(f"Seeding {args.messages} messages over {args.semesters} semesters...")
+        with Session(bind=engine) as db_session:
+            seed_dataset(db_session, args.messages, args.semesters)
+
+    results = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "iterations": args.iterations,
+        "benchmarks": {},
+    }
+
+    with engine.connect() as connection:
+        results["postgres_version"] = connection.execute(text("show server_version")).scalar()
+        results["dataset"] = {
+            table: connection.execute(text(f"select count(*) from lifted.{table}")).scalar()
+            for table in DATASET_TABLES
+        }
+        samples = get_samples(connection, args.samples)
+        connection.rollback()
+
+        for name, call in BENCHMARKS.items():
+            if args.only and not any(part in name for part in args.only):
+                continue
+            iterations = max(3, args.iterations // 10) if name in HEAVY_BENCHMARKS else args.iterations
+            timings = time_benchmark(connection, call, samples, iterations)
+            connection.rollback()
+            stats = results["benchmarks"][name] = summarize(timings)
+            print(f"{name:44} p50={stats['p50_ms']:9.2f} ms  p95={stats['p95_ms']:9.2f} ms  p99={stats['p99_ms']:9.2f} ms  n={stats['n']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
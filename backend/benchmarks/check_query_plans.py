@@ -0,0 +1,203 @@
+"""Fail if a hot repository query falls back to a sequential scan.
+
+Runs each hot repository function against a seeded scratch database, captures
+the SQL it sends, and EXPLAINs every statement with enable_seqscan off.  With
+seq scans disabled the planner still picks one when no usable index exists,
+so any Seq Scan left in a plan means an index is missing.  Writes happen in a
+transaction that is rolled back.  Also checks that every index declared in
+db/models.py exists.
+
+Usage (from backend/, with BENCH_POSTGRES_URL set):
+    python -m benchmarks.check_query_plans
+"""
+import argparse
+import sys
+from datetime import timedelta
+
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import Session
+
+from benchmarks.seed import get_bench_engine, create_schema, seed_messages
+from db.models import Base, Message
+from db.repositories import (
+    get_messages_payload,
+    get_card_payload,
+    get_card_view_context,
+    get_user_by_uuid,
+    get_user_by_email,
+    upsert_user_by_email,
+    _load_admin_roster,
+    get_attachment_pref,
+    set_attachment_pref,
+    get_swap_pref,
+    list_attachments_for_message_group,
+    get_google_slides_presentation_id,
+    get_cards_with_attachments,
+    browse_messages,
+    search_messages,
+    list_logs_desc,
+    list_recently_deleted_messages_desc,
+    encode_keyset_cursor,
+    add_clicked_quick_link_counts,
+    add_email_open_counts,
+    insert_message,
+    update_message_by_id,
+    update_messages_group_for_recipient,
+    swap_messages_for_recipients,
+    delete_message_by_id,
+    delete_messages,
+    count_messages_to_delete,
+)
+
+SAMPLE_UUID = "00000000-0000-0000-0000-000000000000"
+
+HOT_QUERIES = {
+    "get_messages_payload": lambda db, s: get_messages_payload(db, s["email"], s["message_group"]),
+    "get_card_payload": lambda db, s: get_card_payload(db, s["card_id"], s["email"]),
+    "get_card_view_context": lambda db, s: get_card_view_context(s["card_id"], s["email"], db),
+    "get_user_by_uuid": lambda db, s: get_user_by_uuid(db, SAMPLE_UUID),
+    "get_user_by_email": lambda db, s: get_user_by_email(db, s["email"]),
+    "upsert_user_by_email": lambda db, s: upsert_user_by_email(s["email"], "Plan", "Plan Check", "student", db),
+    "_load_admin_roster": lambda db, s: _load_admin_roster(db),
+    "get_attachment_pref": lambda db, s: get_attachment_pref(s["email"], s["message_group"], db),
+    "set_attachment_pref": lambda db, s: set_attachment_pref(s["email"], s["message_group"], 1, db),
+    "get_swap_pref": lambda db, s: get_swap_pref(s["email"], s["message_group"], db),
+    "list_attachments_for_message_group": lambda db, s: list_attachments_for_message_group(s["message_group"], db),
+    "get_google_slides_presentation_id": lambda db, s: get_google_slides_presentation_id(s["message_group"], db),
+    "get_cards_with_attachments": lambda db, s: get_cards_with_attachments(s["message_group"], db),
+    "browse_messages": lambda db, s: browse_messages(s["message_group"], None, db, limit=50),
+    "browse_messages (all, next page)": lambda db, s: browse_messages(
+        "all", None, db, limit=50, cursor=encode_keyset_cursor(s["created_timestamp"], s["card_id"])
+    ),
+    "browse_messages (email search)": lambda db, s: browse_messages("all", s["email"][1:5], db),
+    "search_messages": lambda db, s: search_messages(s["email"].split("@")[0], "all", db),
+    "list_logs_desc": lambda db, s: list_logs_desc(db),
+    "list_logs_desc (type + time range)": lambda db, s: list_logs_desc(
+        db, log_type="ERROR", since=s["created_timestamp"], until=s["created_timestamp"] + timedelta(days=1)
+    ),
+    "list_logs_desc (user)": lambda db, s: list_logs_desc(db, user_email=s["email"]),
+    "list_recently_deleted_messages_desc": lambda db, s: list_recently_deleted_messages_desc(db),
+    "add_clicked_quick_link_counts": lambda db, s: add_clicked_quick_link_counts({SAMPLE_UUID: 2}, db),
+    "add_email_open_counts": lambda db, s: add_email_open_counts({1: 3, 2: 1}, db),
+    "insert_message": lambda db, s: insert_message({
+        "created_timestamp": s["created_timestamp"],
+        "message_group": s["message_group"],
+        "sender_email": s["email"],
+        "sender_name": "Plan Check",
+        "recipient_email": s["email"],
+        "recipient_name": "Plan Check",
+        "message_content": "plan check",
+    }, db),
+    "update_message_by_id": lambda db, s: update_message_by_id(s["card_id"], {"message_group": s["message_group"]}, db),
+    "update_messages_group_for_recipient": lambda db, s: update_messages_group_for_recipient(s["email"], s["message_group"], "plan_check", db),
+    "swap_messages_for_recipients": lambda db, s: swap_messages_for_recipients([s["email"]], s["message_group"], "plan_check", db),
+    "delete_message_by_id": lambda db, s: delete_message_by_id(s["card_id"], db),
+    "count_messages_to_delete": lambda db, s: count_messages_to_delete(db, sender_email=s["email"], message_group=s["message_group"]),
+    "delete_messages": lambda db, s: delete_messages(db, sender_email=s["email"], message_group=s["message_group"]),
+}
+
+# Only indexable with migration 12's trigram indexes, which need the pg_trgm extension
+NEEDS_PG_TRGM = {"browse_messages (email search)"}
+
+EXPLAINABLE_PREFIXES = ("select", "insert", "update", "delete", "with")
+
+
+def capture_statements(connection, call):
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().lower().startswith(EXPLAINABLE_PREFIXES):
+            captured.append((statement, parameters))
+
+    event.listen(connection, "before_cursor_execute", before_cursor_execute)
+    try:
+        call()
+    finally:
+        event.remove(connection, "before_cursor_execute", before_cursor_execute)
+    return captured
+
+
+def find_seq_scans(plan):
+    scans = []
+    if plan.get("Node Type") == "Seq Scan":
+        scans.append(f'{plan.get("Schema", "?")}.{plan.get("Relation Name", "?")}')
+    for child in plan.get("Plans", []):
+        scans.extend(find_seq_scans(child))
+    return scans
+
+
+def check_hot_queries(connection, sample):
+    failures = {}
+    has_pg_trgm = connection.execute(
+        text("select exists (select 1 from pg_extension where extname = 'pg_trgm')")
+    ).scalar()
+
+    for name, call in HOT_QUERIES.items():
+        if name in NEEDS_PG_TRGM and not has_pg_trgm:
+            print(f"{name:38} skipped (pg_trgm isn't installed)")
+            continue
+
+        with connection.begin_nested():
+            with Session(bind=connection) as db_session:
+                statements = capture_statements(connection, lambda: call(db_session, sample))
+
+            seq_scans = []
+            for statement, parameters in statements:
+                explained = connection.exec_driver_sql("explain (format json, verbose) " + statement, parameters).scalar()
+                seq_scans.extend(find_seq_scans(explained[0]["Plan"]))
+
+        status = "ok" if not seq_scans else "SEQ SCAN on " + ", ".join(sorted(set(seq_scans)))
+        print(f"{name:38} {len(statements)} statement(s)  {status}")
+        if seq_scans:
+            failures[name] = seq_scans
+
+    return failures
+
+
+def check_declared_indexes(engine):
+    inspector = inspect(engine)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name, schema=table.schema)}
+        missing.extend(f"{table.schema}.{index.name}" for index in table.indexes if index.name not in existing)
+    for index_name in missing:
+        print(f"declared index missing from database: {index_name}")
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data already in BENCH_POSTGRES_URL")
+    args = parser.parse_args()
+
+    engine = get_bench_engine()
+    create_schema(engine)
+
+    if not args.skip_seed:
+        with Session(bind=engine) as db_session:
+            seed_messages(db_session, args.messages)
+
+    missing_indexes = check_declared_indexes(engine)
+
+    with engine.connect() as connection:
+        sample = connection.execute(
+            select(
+                Message.id.label("card_id"),
+                Message.recipient_email.label("email"),
+                Message.message_group,
+                Message.created_timestamp,
+            ).limit(1)
+        ).mappings().one()
+
+        connection.execute(text("set local enable_seqscan = off"))
+        failures = check_hot_queries(connection, sample)
+        connection.rollback()
+
+    if failures or missing_indexes:
+        sys.exit(1)
+    print("All hot queries use indexes.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Synthetic Lifted data for benchmarks.
+
+Everything here TRUNCATES the tables it seeds, so it only ever connects to
+BENCH_POSTGRES_URL (a scratch database), never POSTGRES_URL.
+
+seed_messages only fills messages (plus the rank and stat counters);
+seed_dataset fills every table the repository functions read.  To seed a
+database by hand (from backend/):
+    python -m benchmarks.seed --messages 200000 --semesters 6
+"""
+import argparse
+import itertools
+import os
+import random
+import string
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, func, insert, select, text
+from sqlalchemy.orm import Session
+
+from db.migrations import apply_migrations
+from db.models import Base, Message, LiftedUser, Attachment, AttachmentStockShard, AttachmentPref, SwapPref, Emails, Log
+from db.partitions import semester_message_groups
+from db.repositories import rebuild_message_group_ranks, reconcile_lifted_stats, stock_shard_rows
+
+DEFAULT_MESSAGE_GROUPS = ["sp_26_e", "sp_26_p", "fa_25_e", "fa_25_p", "sp_25_e", "sp_25_p"]
+ATTACHMENT_NAMES = ["Chocolate", "Flower", "Keychain"]
+LOG_TYPES = ["INFO"] * 90 + ["ERROR"] * 8 + ["WARNING"] * 2
+AFFILIATIONS = ["student"] * 8 + ["staff", "faculty"]
+
+WORDS = (
+    "thank you so much for being an amazing friend and always making me laugh "
+    "cornell would not be the same without you i appreciate every late night in "
+    "the library and every walk up libe slope you are the best ta ever happy lifted day"
+).split()
+
+
+def get_bench_engine(**engine_options):
+    load_dotenv()
+    database_url = os.environ.get("BENCH_POSTGRES_URL")
+    if not database_url:
+        raise SystemExit("Set BENCH_POSTGRES_URL to a scratch Postgres database")
+    if database_url == os.environ.get("POSTGRES_URL"):
+        raise SystemExit("BENCH_POSTGRES_URL must not point at the production database")
+    return create_engine(database_url, **engine_options)
+
+
+def create_schema(engine):
+    with engine.begin() as conn:
+        conn.execute(text("create schema if not exists lifted"))
+    Base.metadata.create_all(engine)
+    apply_migrations(engine, log=lambda line: None)
+
+
+def _make_netids(count, rng):
+    netids = set()
+    while len(netids) < count:
+        letters = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 3)))
+        netids.add(f"{letters}{rng.randint(1, 9999)}")
+    return [f"{netid}@cornell.edu" for netid in sorted(netids)]
+
+
+def _power_law_picker(population, alpha, rng):
+    """Pick from population with Zipf-like weights: a few people send/receive a lot."""
+    cum_weights = list(itertools.accumulate(1 / (i + 1) ** alpha for i in range(len(population))))
+    shuffled = population[:]
+    rng.shuffle(shuffled)
+    return lambda k: rng.choices(shuffled, cum_weights=cum_weights, k=k)
+
+
+def recent_semesters(count, newest="sp_26"):
+    """The count semesters up to and including newest, newest first (sp_26, fa_25, sp_25, ...)."""
+    term, year = newest.split("_")
+    year = int(year)
+    semesters = []
+    for _ in range(count):
+        semesters.append(f"{term}_{year:02d}")
+        term, year = ("fa", year - 1) if term == "sp" else ("sp", year)
+    return semesters
+
+
+def lifted_day(message_group):
+    """Roughly when a group's Lifted Day falls: late April in spring, early December in fall."""
+    term, year = message_group.split("_")[0:2]
+    return datetime(2000 + int(year), 4, 25) if term == "sp" else datetime(2000 + int(year), 12, 5)
+
+
+def _sent_at(message_group, rng):
+    # The form is open for a few weeks, and most messages arrive in the last few days
+    return lifted_day(message_group) - timedelta(minutes=min(rng.expovariate(1 / (4 * 24 * 60)), 30 * 24 * 60))
+
+
+def seed_messages(db_session, message_count, message_groups=DEFAULT_MESSAGE_GROUPS, seed=0, batch_size=5000, people=None):
+    rng = random.Random(seed)
+    people = people or _make_netids(max(message_count // 4, 10), rng)
+    pick_senders = _power_law_picker(people, 1.1, rng)
+    pick_recipients = _power_law_picker(people, 0.9, rng)
+
+    db_session.execute(text("truncate lifted.messages, lifted.message_group_ranks restart identity"))
+
+    for batch_start in range(0, message_count, batch_size):
+        size = min(batch_size, message_count - batch_start)
+        senders = pick_senders(size)
+        recipients = pick_recipients(size)
+        groups = rng.choices(message_groups, k=size)
+        rows = [
+            {
+                "created_timestamp": _sent_at(groups[i], rng),
+                "message_group": groups[i],
+                "sender_email": senders[i],
+                "sender_name": senders[i].split("@")[0],
+                "recipient_email": recipients[i],
+                "recipient_name": recipients[i].split("@")[0],
+                "message_content": " ".join(rng.choices(WORDS, k=rng.randint(10, 120)) + [f"love, {senders[i].split('@')[0]}"]),
+            }
+            for i in range(size)
+        ]
+        db_session.execute(insert(Message), rows)
+
+    db_session.commit()
+    rebuild_message_group_ranks(db_session)
+    reconcile_lifted_stats(db_session)
+    db_session.execute(text("analyze lifted.messages"))
+    db_session.execute(text("analyze lifted.message_group_ranks"))
+    db_session.commit()
+
+
+def seed_dataset(db_session, message_count, semesters=6, log_count=None, email_count=None, seed=0, batch_size=5000):
+    """Seed messages across several semesters plus the users, attachments,
+    attachment/swap prefs, emails and logs that go with them.  Returns the row
+    count of each table."""
+    rng = random.Random(seed)
+    people = _make_netids(max(message_count // 4, 10), rng)
+    semester_list = recent_semesters(semesters)
+    message_groups = [group for semester in semester_list for group in semester_message_groups(semester)]
+
+    seed_messages(db_session, message_count, message_groups, seed=seed, batch_size=batch_size, people=people)
+
+    db_session.execute(text(
+        "truncate lifted.users, lifted.attachments, lifted.attachment_stock_shards, lifted.attachment_prefs, lifted.swap_prefs, "
+        "lifted.emails, lifted.logs restart identity"
+    ))
+
+    now = datetime(2026, 5, 1)
+    _insert_batches(db_session, insert(LiftedUser), [
+        {
+            "email": email,
+            "given_name": email.split("@")[0],
+            "full_name": email.split("@")[0].upper(),
+            "affiliation": rng.choice(AFFILIATIONS),
+            "clicked_quick_link_count": int(rng.paretovariate(1.5)) - 1,
+            "updated_at": now - timedelta(days=rng.randint(0, 900)),
+            "is_admin": index < 5,
+            "admin_write_perm": index < 2,
+        }
+        for index, email in enumerate(people)
+    ], batch_size)
+
+    for semester in semester_list:
+        physical_group, elifted_group = semester_message_groups(semester)
+        attachment_ids = db_session.execute(
+            insert(Attachment).returning(Attachment.id),
+            [{"message_group": physical_group, "attachment": name} for name in ATTACHMENT_NAMES],
+        ).scalars().all()
+        db_session.execute(insert(AttachmentStockShard), [
+            row for attachment_id in attachment_ids for row in stock_shard_rows(attachment_id, rng.randint(100, 2000))
+        ])
+
+        recipients = db_session.execute(
+            select(Message.recipient_email).where(Message.message_group == physical_group).distinct()
+        ).scalars().all()
+        # About a third of physical recipients pick an attachment, and one in ten swap to eLifted
+        _insert_batches(db_session, insert(AttachmentPref), [
+            {"recipient_email": recipient, "message_group": physical_group, "attachment_id": rng.choice(attachment_ids)}
+            for recipient in recipients if rng.random() < 0.3
+        ], batch_size)
+        _insert_batches(db_session, insert(SwapPref), [
+            {"recipient_email": recipient, "event": semester, "message_group_from": physical_group, "message_group_to": elifted_group}
+            for recipient in recipients if rng.random() < 0.1
+        ], batch_size)
+
+    pick_recipients = _power_law_picker(people, 0.9, rng)
+    email_count = message_count // 2 if email_count is None else email_count
+    recipients = pick_recipients(email_count)
+    _insert_batches(db_session, insert(Emails), [
+        {
+            "created_at": _sent_at(rng.choice(message_groups), rng),
+            "to_email": recipients[i],
+            "subject": "You've been Lifted!",
+            "open_count": min(int(rng.expovariate(0.7)), 20),
+        }
+        for i in range(email_count)
+    ], batch_size)
+
+    pick_users = _power_law_picker(people, 1.0, rng)
+    log_count = message_count if log_count is None else log_count
+    users = pick_users(log_count)
+    _insert_batches(db_session, insert(Log), [
+        {
+            "log_timestamp": _sent_at(rng.choice(message_groups), rng),
+            "user_email": users[i],
+            "user_name": users[i].split("@")[0].upper(),
+            "log_type": log_type,
+            "error_code": "500" if log_type == "ERROR" else None,
+            "log_content": f"{'Sent a message' if log_type == 'INFO' else 'Something went wrong'} ({i})",
+        }
+        for i, log_type in enumerate(rng.choices(LOG_TYPES, k=log_count))
+    ], batch_size)
+
+    db_session.commit()
+    tables = ["messages", "users", "attachments", "attachment_stock_shards", "attachment_prefs", "swap_prefs", "emails", "logs"]
+    for table in tables:
+        db_session.execute(text(f"analyze lifted.{table}"))
+    db_session.commit()
+
+    return {
+        table: db_session.execute(select(func.count()).select_from(text(f"lifted.{table}"))).scalar_one()
+        for table in tables
+    }
+
+
+def _insert_batches(db_session, stmt, rows, batch_size):
+    for batch_start in range(0, len(rows), batch_size):
+        db_session.execute(stmt, rows[batch_start:batch_start + batch_size])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed BENCH_POSTGRES_URL with synthetic Lifted data (truncates it first)")
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--semesters", type=int, default=6)
+    parser.add_argument("--logs", type=int, help="Default: one per message")
+    parser.add_argument("--emails", type=int, help="Default: one per two messages")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    engine = get_bench_engine()
+    create_schema(engine)
+    with Session(bind=engine) as db_session:
+        counts = seed_dataset(db_session, args.messages, args.semesters, args.logs, args.emails, args.seed)
+    for table, count in counts.items():
+        print(f"{table:18} {count:>10} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,29 +10,23 @@ from db.repositories import (
     get_messages_payload,
     get_user_by_uuid,
     get_card_payload,
-    claim_attachment,
-    return_attachment,
+    get_card_view_context,
     get_analytics_payload,
+    get_stored_analytics_payload,
     get_attachment_pref as get_attachment_pref_repo,
     list_attachments_for_message_group,
-    update_attachment_pref,
-    create_attachment_pref,
+    set_attachment_pref,
     get_attachment_pref_by_id,
-    delete_attachment_pref_by_id,
-    get_google_slides_presentation_id,
+    delete_attachment_pref as delete_attachment_pref_repo,
     update_message_by_id,
     delete_message_by_id,
-    insert_recently_deleted_message,
     get_swap_pref,
     insert_message,
-    update_messages_group_for_recipient,
-    create_swap_pref,
+    swap_messages_for_recipients,
     upsert_user_by_email,
-    record_email_open,
-    increment_clicked_quick_link_count,
 )
 
-from app import get_admin_permissions_for_netid, db_call
+from app import get_admin_permissions_for_netid, db_call, release_request_db_session
 import json
 import uuid
 
@@ -157,7 +151,7 @@ def email_open():
     # )
 
     if not should_ignore_tracking_for_user_agent(request_info["user_agent"]):
-        db_call(record_email_open, email_open_id)
+        helpers.count_email_open(email_open_id)
 
     transparent_gif = (
         b"GIF89a"
@@ -182,6 +176,15 @@ def email_open():
     return response
 
 
+def get_active_analytics_semesters():
+    lifted_config = current_app.config["lifted_config"]
+    active_message_groups = [lifted_config["form_message_group"], lifted_config["attachment_message_group"]]
+    return tuple(
+        "_".join(message_group.split("_")[0:2])
+        for message_group in active_message_groups
+        if message_group and message_group != "none"
+    )
+
 def get_swap_entry_for_group(message_group):
     swapping = current_app.config["lifted_config"].get("swapping", [])
     for entry in swapping:
@@ -225,7 +228,7 @@ def get_messages():
     request_user_agent = request.headers.get("User-Agent", "")
 
     if requested_user_uuid and not should_ignore_tracking_for_user_agent(request_user_agent):
-        db_call(increment_clicked_quick_link_count, requested_user_uuid)
+        helpers.count_quick_link_click(requested_user_uuid)
 
     if current_user.is_authenticated:
         clear_preview_context_session()
@@ -256,48 +259,42 @@ def get_messages():
     hidden_card_overrides = data['hidden_card_overrides']
     attachment_prefs = data['attachment_prefs']
 
-    events = set(["_".join(message_group.split("_")[0:2]) for message_group in current_app.config["lifted_config"]["message_group_list_map"].keys()])
-
-    # Order events: year descending, then fa before sp for same year
-    def event_sort_key(event):
-        season, year = event.split("_")
-        season_order = {"fa": 0, "sp": 1}
-        return (-int(year), season_order.get(season, 2))
-
-    events = sorted(events, key=event_sort_key)
+    layout = helpers.get_message_group_layout(tuple(current_app.config["lifted_config"]["message_group_list_map"].keys()))
 
     if limited_view:
-        events = events[:1]  # Show only the most recent event for limited view
+        layout = layout[:1]  # Show only the most recent event for limited view
 
-    output = []
-    for event in events:
-        build = {}
+    # Bucket everything by message group once, so each group below is a dict lookup
+    received_cards_by_group = helpers.process_cards_to_dict(received_cards)
+    sent_cards_by_group = helpers.process_cards_to_dict(sent_cards)
+    received_rank_by_group = helpers.process_ranks_to_dict(received_ranks)
+    sent_rank_by_group = helpers.process_ranks_to_dict(sent_ranks)
+    attachment_pref_by_group = helpers.process_attachment_prefs_to_dict(attachment_prefs)
+    hidden_cards = set(current_app.config["lifted_config"]["hidden_cards"])
+    hidden_card_overrides = set(hidden_card_overrides)
 
-        build["year"] = int(event.split("_")[1])
-        build["year_name"] = int(str(20) + str(build["year"]))
-        build["season"] = event.split("_")[0]
-        build["season_name"] = "Fall" if build["season"] == "fa" else "Spring"
-        build["event"] = event
+    output = []
+    for event in layout:
+        build = {key: value for key, value in event.items() if key != "types"}
 
         build["types"] = []
-        for message_group in current_app.config["lifted_config"]["message_group_list_map"].keys():
-            if event in message_group:
-                received_cards_in_current_message_group = [card for card in received_cards if card["message_group"] == message_group]
-                sent_cards_in_current_message_group = [card for card in sent_cards if card["message_group"] == message_group]
-
-                build["types"].append({
-                    "message_group": message_group,
-                    "type": message_group.split("_")[2],
-                    "type_name": "eLifted" if "e" in message_group else "Physical Lifted",
-                    "hide_cards": False if message_group not in current_app.config["lifted_config"]["hidden_cards"] or message_group in hidden_card_overrides else True,
-                    "received_count": len(received_cards_in_current_message_group),
-                    "sent_count": len(sent_cards_in_current_message_group),
-                    "received_card_ids": [card["id"] for card in received_cards_in_current_message_group],
-                    "sent_card_ids": [card["id"] for card in sent_cards_in_current_message_group],
-                    "received_rank": next((item["rank"] for item in received_ranks if item["message_group"] == message_group), None),
-                    "sent_rank": next((item["rank"] for item in sent_ranks if item["message_group"] == message_group), None),
-                    "chosen_attachment": next(({"id": pref["attachment_id"], "attachment_name": pref["attachment"]} for pref in attachment_prefs if pref["message_group"] == message_group), None)
-                })
+        for message_group_type in event["types"]:
+            message_group = message_group_type["message_group"]
+            received_cards_in_current_message_group = received_cards_by_group.get(message_group, [])
+            sent_cards_in_current_message_group = sent_cards_by_group.get(message_group, [])
+            attachment_pref = attachment_pref_by_group.get(message_group)
+
+            build["types"].append({
+                **message_group_type,
+                "hide_cards": message_group in hidden_cards and message_group not in hidden_card_overrides,
+                "received_count": len(received_cards_in_current_message_group),
+                "sent_count": len(sent_cards_in_current_message_group),
+                "received_card_ids": [card["id"] for card in received_cards_in_current_message_group],
+                "sent_card_ids": [card["id"] for card in sent_cards_in_current_message_group],
+                "received_rank": received_rank_by_group.get(message_group),
+                "sent_rank": sent_rank_by_group.get(message_group),
+                "chosen_attachment": {"id": attachment_pref["attachment_id"], "attachment_name": attachment_pref["attachment"]} if attachment_pref else None,
+            })
 
         output.append(build)
 
@@ -329,30 +326,12 @@ def set_attachment():
     attachment_id = request.form["id"]
     message_group = current_app.config["lifted_config"]["attachment_message_group"]
 
-    # 2. Try to CLAIM the attachment atomically
-    claim_success = db_call(claim_attachment, attachment_id)
+    # Claim one from stock, record the pref and restock any previous pick, all in one transaction
+    claim_success = db_call(set_attachment_pref, target_email, message_group, attachment_id)
 
-    # claim_response.data will be True if successful, False if count was 0
     if not claim_success:
         return f"Sorry, there are no more of this attachment left :("
 
-    # 3. Check for existing preference (to swap)
-    prev_attachment = db_call(get_attachment_pref_repo, target_email, message_group)
-
-    if prev_attachment:
-        # 4A. SWAP: Update existing preference
-        db_call(update_attachment_pref, target_email, message_group, attachment_id)
-
-        # 4B. RESTOCK: Return the old attachment to inventory
-        old_attachment_id = prev_attachment["attachment_id"]
-        db_call(return_attachment, old_attachment_id)
-
-    else:
-        # 5. INSERT: New preference
-        config_msg_group = current_app.config["lifted_config"]["attachment_message_group"]
-        
-        db_call(create_attachment_pref, target_email, config_msg_group, attachment_id)
-
     return jsonify({"status": "success"})
 
 @core.route("/api/delete-attachment-pref/<id>")
@@ -364,8 +343,12 @@ def delete_attachment_pref(id):
         abort(404, "Attachment preference DNE")
 
     if attachment_pref["recipient_email"] == target_email or current_user.admin_write_perm:
-        db_call(return_attachment, attachment_pref["attachment_id"])
-        db_call(delete_attachment_pref_by_id, id)
+        # Restocks only if this request is the one that deleted it
+        db_call(
+            delete_attachment_pref_repo,
+            id,
+            recipient_email=None if current_user.admin_write_perm else target_email,
+        )
 
         return jsonify({"status": "success"})
 
@@ -420,7 +403,19 @@ def get_card_json(id):
 @core.route("/api/get-card-pdf/<id>")
 @login_required
 def get_card_pdf(id):
-    card, hidden_card_overrides = get_card(id)
+    override_template = request.args.get("override-template", False)
+
+    # One query for the card, the viewer's override, and the template's presentation id and attachments
+    context = db_call(
+        get_card_view_context,
+        card_id=id,
+        viewer_email=current_user.email,
+        template_message_group=override_template or None,
+    )
+    card = context["card"]
+    hidden_card_overrides = context["overrides"]
+    if card is None:
+        abort(404, "Card DNE")
     
     # note: THE LOGIC HERE IS SLIGHTLY DIFFERENT THAN FOR HTML, since we don't want anyone downloading a PDF before its unhidden
     if current_user.is_admin == False:
@@ -431,12 +426,11 @@ def get_card_pdf(id):
         elif card["message_group"] in current_app.config["lifted_config"]["hidden_cards"] and card["message_group"] not in hidden_card_overrides:
             abort(401, "Hidden Card")
 
-    override_template = request.args.get("override-template", False)
     message_group = override_template if override_template else card['message_group']
 
-    # Get the Google Slides presentation ID for this message group
-    presentation_id = db_call(get_google_slides_presentation_id, message_group)
-    
+    # The Google Slides presentation ID for this message group
+    presentation_id = context["presentation_id"]
+
     if not presentation_id:
         abort(404, "No Google Slides template found for this message group")
     
@@ -444,8 +438,8 @@ def get_card_pdf(id):
     is_test_card = id in ["12870", "16193"]
     
     if is_test_card and override_template:
-        # Fetch all attachments for this message group
-        attachments = db_call(list_attachments_for_message_group, message_group)
+        # All attachments for this message group
+        attachments = context["attachments"]
         
         # Create test cards for default + each attachment
         test_cards = []
@@ -468,11 +462,13 @@ def get_card_pdf(id):
         filepath = os.path.join("single_card_output", message_group, f"test_{id}")
         download_name = f"Test Card {id} - All Templates"
         
+        release_request_db_session()
         google_tools.cards_to_pdf(
             presentation_id=presentation_id,
             cards=test_cards,
             output_filepath=filepath,
-            message_group=message_group  # Use the override template's message_group
+            message_group=message_group,  # Use the override template's message_group
+            attachments=attachments,
         )
         
         return send_file(filepath + ".pdf", download_name=download_name, mimetype='application/pdf')
@@ -486,10 +482,13 @@ def get_card_pdf(id):
         return send_file(filepath + ".pdf", download_name=download_name, mimetype='application/pdf')
 
     # Generate PDF using Google Slides
+    release_request_db_session()
     google_tools.cards_to_pdf(
         presentation_id=presentation_id,
         cards=[dict(card)],  # Pass as single-item list
-        output_filepath=filepath
+        output_filepath=filepath,
+        # Slides are mapped by the card's own group's attachments, which context only has without a template override
+        attachments=None if override_template else context["attachments"],
     )
 
     return send_file(filepath + ".pdf", download_name=download_name, mimetype='application/pdf')
@@ -545,6 +544,7 @@ def edit_message(id):
         })
         
         if send_ybl_email:
+            release_request_db_session()
             helpers.send_email(message_group=message_group, type="recipient", to=[recipient_email])
     else:
         message_group = current_app.config["lifted_config"]["form_message_group"]
@@ -569,7 +569,6 @@ def delete_message(id):
     check_if_can_edit_or_delete(card)
 
     db_call(delete_message_by_id, id)
-    db_call(insert_recently_deleted_message, card)
 
     return jsonify({"deleted": True})
 
@@ -641,6 +640,8 @@ def send_message():
             "message_content": message_content,
         })
 
+        # Save the message before talking to Postmark, and don't hold a connection while we do
+        release_request_db_session()
         helpers.send_email(
             message_group=message_group,
             type="recipient",
@@ -753,15 +754,9 @@ def swap_messages():
     if not swap_from or not swap_to:
         return jsonify({"swapped": False, "error": "Invalid swapping configuration."}), 400
 
-    # Delete attachment pref if there is one
-    attachment_pref = db_call(get_attachment_pref_repo, target_email, swap_from)
-    if attachment_pref:
-        db_call(return_attachment, attachment_pref["attachment_id"])
-        db_call(delete_attachment_pref_by_id, attachment_pref["id"])
+    # Returns any attachment, moves the messages and records the swap pref in one transaction
+    db_call(swap_messages_for_recipients, [target_email], swap_from, swap_to)
 
-    db_call(update_messages_group_for_recipient, target_email, swap_from, swap_to)
-    db_call(create_swap_pref, target_email, swap_from, swap_to)
-    
     return jsonify({"swapped": True})
 
 @core.get("/api/analytics")
@@ -770,5 +765,12 @@ def get_analytics():
     # return jsonify("success")
     """Get analytics data for Lifted messages"""
     semester = request.args.get("semester", "all")
-    analytics_data = db_call(get_analytics_payload, semester)
+    active_semesters = get_active_analytics_semesters()
+    # Usually served by the replica; only an expired snapshot needs the primary to refresh it
+    try:
+        analytics_data = db_call(get_stored_analytics_payload, semester, active_semesters=active_semesters)
+        if analytics_data is None:
+            analytics_data = db_call(get_analytics_payload, semester, active_semesters=active_semesters)
+    except LookupError:
+        abort(404, "Semester DNE")
     return jsonify(analytics_data)
@@ -0,0 +1,265 @@
+"""Versioned schema changes for the lifted schema.
+
+Migrations run once each, in version order, and are recorded in
+lifted.schema_migrations.  Append new ones to MIGRATIONS; never edit one that
+has already shipped.
+
+Index-only migrations are marked concurrent: their steps run outside a
+transaction with CREATE INDEX CONCURRENTLY so building them doesn't block
+message writes.  Every step is written to be safe to re-run if a deploy is
+interrupted halfway.
+"""
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from db.models import MessageGroupRank, LiftedStatCounter, AnalyticsSnapshot, AttachmentStockShard, SchemaMigration, MESSAGE_SEARCH_VECTOR_SQL
+from db.partitions import is_partitioned, list_partitions, partition_messages_table
+from db.repositories import rebuild_message_group_ranks, reconcile_lifted_stats, stock_shard_rows
+
+
+class Migration:
+    def __init__(self, version, description, steps, concurrent=False):
+        self.version = version
+        self.description = description
+        self.steps = steps
+        self.concurrent = concurrent
+
+
+def _drop_invalid_index(connection, name):
+    # A failed CONCURRENTLY build leaves an invalid index behind that IF NOT EXISTS would skip
+    is_invalid = connection.execute(
+        text("select not indisvalid from pg_index where indexrelid = to_regclass(:name)"),
+        {"name": f"lifted.{name}"},
+    ).scalar()
+    if is_invalid:
+        connection.execute(text(f"drop index concurrently lifted.{name}"))
+
+
+def create_index(name, table, columns, unique=False, using="btree", where=None):
+    def step(connection):
+        if is_partitioned(connection, table):
+            _create_partitioned_index(connection, name, table, columns, unique, using, where)
+            return
+
+        _drop_invalid_index(connection, name)
+        connection.execute(text(
+            f"create {'unique ' if unique else ''}index concurrently if not exists {name} "
+            f"on lifted.{table} using {using} ({columns}){f' where {where}' if where else ''}"
+        ))
+    return step
+
+
+def _create_partitioned_index(connection, name, table, columns, unique, using, where=None):
+    """CONCURRENTLY doesn't work on a partitioned table, so create the index ON
+    ONLY the parent, build it concurrently on each partition and attach those;
+    the parent index becomes valid once every partition has one."""
+    unique_sql = "unique " if unique else ""
+    where_sql = f" where {where}" if where else ""
+    connection.execute(text(f"create {unique_sql}index if not exists {name} on only lifted.{table} using {using} ({columns}){where_sql}"))
+
+    for partition in list_partitions(connection, table):
+        partition_index = f"{name}_{partition['name'].removeprefix(table + '_')}"[:63]
+        _drop_invalid_index(connection, partition_index)
+        connection.execute(text(
+            f"create {unique_sql}index concurrently if not exists {partition_index} "
+            f"on lifted.{partition['name']} using {using} ({columns}){where_sql}"
+        ))
+        connection.execute(text(f"alter index lifted.{name} attach partition lifted.{partition_index}"))
+
+
+def analyze(*tables):
+    return "; ".join(f"analyze lifted.{table}" for table in tables)
+
+
+def _create_message_group_ranks(connection):
+    MessageGroupRank.__table__.create(connection, checkfirst=True)
+
+
+def _backfill_message_group_ranks(connection):
+    with Session(bind=connection) as db_session:
+        rebuild_message_group_ranks(db_session)
+
+
+def _create_lifted_stat_counters(connection):
+    LiftedStatCounter.__table__.create(connection, checkfirst=True)
+
+
+def _backfill_lifted_stat_counters(connection):
+    with Session(bind=connection) as db_session:
+        reconcile_lifted_stats(db_session)
+
+
+def _create_analytics_snapshots(connection):
+    AnalyticsSnapshot.__table__.create(connection, checkfirst=True)
+
+
+def _create_attachment_stock_shards(connection):
+    AttachmentStockShard.__table__.create(connection, checkfirst=True)
+
+
+def _move_attachment_counts_to_shards(connection):
+    has_count_column = connection.execute(text(
+        "select exists (select 1 from information_schema.columns "
+        "where table_schema = 'lifted' and table_name = 'attachments' and column_name = 'count')"
+    )).scalar()
+    if not has_count_column:
+        return
+
+    counts = connection.execute(text(
+        "select id, count from lifted.attachments a "
+        "where not exists (select 1 from lifted.attachment_stock_shards s where s.attachment_id = a.id)"
+    )).all()
+    rows = [row for attachment_id, count in counts for row in stock_shard_rows(attachment_id, max(count, 0))]
+    if rows:
+        connection.execute(AttachmentStockShard.__table__.insert(), rows)
+    connection.execute(text("alter table lifted.attachments drop column count"))
+
+
+def _has_pg_trgm(connection):
+    return connection.execute(text(
+        "select exists (select 1 from pg_available_extensions where name = 'pg_trgm')"
+    )).scalar()
+
+
+def if_pg_trgm(step):
+    """Run step only where the pg_trgm extension can be installed."""
+    def guarded(connection):
+        if _has_pg_trgm(connection):
+            _run_step(step, connection)
+    return guarded
+
+
+def _check_no_duplicate_user_emails(connection):
+    duplicates = connection.execute(text(
+        "select email from lifted.users group by email having count(*) > 1 order by email limit 20"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(
+            "lifted.users has more than one row for these emails; merge them before migrating: "
+            + ", ".join(duplicates)
+        )
+
+
+MIGRATIONS = [
+    Migration(1, "Per-group send/receive rank counters", [
+        _create_message_group_ranks,
+        _backfill_message_group_ranks,
+    ]),
+    Migration(2, "Secondary indexes for the hot repository queries", [
+        create_index("ix_messages_recipient_email_message_group", "messages", "recipient_email, message_group"),
+        create_index("ix_messages_sender_email_message_group", "messages", "sender_email, message_group"),
+        create_index("ix_messages_message_group_created_timestamp", "messages", "message_group, created_timestamp"),
+        create_index("ix_users_email", "users", "email"),
+        create_index("ix_hidden_card_overrides_recipient_email_message_group", "hidden_card_overrides", "recipient_email, message_group"),
+        create_index("ix_attachments_message_group", "attachments", "message_group"),
+        create_index("ix_attachment_prefs_recipient_email_message_group", "attachment_prefs", "recipient_email, message_group"),
+        create_index("ix_google_slides_ids_message_group", "google_slides_ids", "message_group"),
+        create_index("ix_swap_prefs_recipient_email_event", "swap_prefs", "recipient_email, event"),
+        analyze("messages", "users", "hidden_card_overrides", "attachments", "attachment_prefs", "google_slides_ids", "swap_prefs"),
+    ], concurrent=True),
+    Migration(3, "Running counters for get_lifted_stats", [
+        _create_lifted_stat_counters,
+        _backfill_lifted_stat_counters,
+    ]),
+    Migration(4, "Stored per-semester analytics snapshots", [
+        _create_analytics_snapshots,
+    ]),
+    Migration(5, "Keyset indexes for paging through messages", [
+        create_index("ix_messages_message_group_created_timestamp_id", "messages", "message_group, created_timestamp, id"),
+        create_index("ix_messages_created_timestamp_id", "messages", "created_timestamp, id"),
+        "drop index concurrently if exists lifted.ix_messages_message_group_created_timestamp",
+        analyze("messages"),
+    ], concurrent=True),
+    # Rewrites lifted.messages under an exclusive lock; a few seconds at Lifted's size
+    Migration(6, "Generated full-text search column on messages", [
+        f"alter table lifted.messages add column if not exists search_vector tsvector "
+        f"generated always as ({MESSAGE_SEARCH_VECTOR_SQL}) stored",
+    ]),
+    Migration(7, "Search indexes for admin message search", [
+        create_index("ix_messages_search_vector", "messages", "search_vector", using="gin"),
+        create_index("ix_messages_recipient_email_pattern", "messages", "lower(recipient_email) text_pattern_ops"),
+        create_index("ix_messages_sender_email_pattern", "messages", "lower(sender_email) text_pattern_ops"),
+        analyze("messages"),
+    ], concurrent=True),
+    Migration(8, "Keyset and filter indexes for the admin logs page", [
+        create_index("ix_logs_log_timestamp_id", "logs", "log_timestamp, id"),
+        create_index("ix_logs_log_type_log_timestamp_id", "logs", "log_type, log_timestamp, id"),
+        create_index("ix_logs_user_email_log_timestamp_id", "logs", "user_email, log_timestamp, id"),
+        create_index("ix_recently_deleted_messages_deleted_timestamp_id", "recently_deleted_messages", "deleted_timestamp, id"),
+        analyze("logs", "recently_deleted_messages"),
+    ], concurrent=True),
+    Migration(9, "Unique users.email so user upserts can use ON CONFLICT", [
+        _check_no_duplicate_user_emails,
+        create_index("uq_users_email", "users", "email", unique=True),
+        "drop index concurrently if exists lifted.ix_users_email",
+    ], concurrent=True),
+    # Copies lifted.messages under an exclusive lock; run it while the form is closed
+    Migration(10, "Partition messages by message group", [
+        partition_messages_table,
+    ]),
+    Migration(11, "Sharded attachment stock counters", [
+        _create_attachment_stock_shards,
+        _move_attachment_counts_to_shards,
+        analyze("attachment_stock_shards"),
+    ]),
+    # Not declared in db/models.py, since they need an extension some servers don't have
+    Migration(12, "Trigram indexes for substring email search", [
+        if_pg_trgm("create extension if not exists pg_trgm"),
+        if_pg_trgm(create_index("ix_messages_recipient_email_trgm", "messages", "lower(recipient_email) gin_trgm_ops", using="gin")),
+        if_pg_trgm(create_index("ix_messages_sender_email_trgm", "messages", "lower(sender_email) gin_trgm_ops", using="gin")),
+        analyze("messages"),
+    ], concurrent=True),
+    Migration(13, "Partial index on users for the admin roster", [
+        create_index("ix_users_admins", "users", "email, is_admin, admin_write_perm", where="is_admin or admin_write_perm"),
+        analyze("users"),
+    ], concurrent=True),
+]
+
+
+def _run_step(step, connection):
+    if callable(step):
+        step(connection)
+    else:
+        connection.execute(text(step))
+
+
+def get_applied_versions(engine):
+    with engine.begin() as connection:
+        SchemaMigration.__table__.create(connection, checkfirst=True)
+        return set(connection.execute(text("select version from lifted.schema_migrations")).scalars())
+
+
+def get_pending_migrations(engine):
+    applied_versions = get_applied_versions(engine)
+    return [migration for migration in MIGRATIONS if migration.version not in applied_versions]
+
+
+def apply_migrations(engine, log=print):
+    """Apply every pending migration in order. Returns the versions applied."""
+    applied = []
+
+    for migration in get_pending_migrations(engine):
+        log(f"Applying migration {migration.version}: {migration.description}")
+
+        if migration.concurrent:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                for step in migration.steps:
+                    _run_step(step, connection)
+            with engine.begin() as connection:
+                _record_migration(migration, connection)
+        else:
+            with engine.begin() as connection:
+                for step in migration.steps:
+                    _run_step(step, connection)
+                _record_migration(migration, connection)
+
+        applied.append(migration.version)
+
+    return applied
+
+
+def _record_migration(migration, connection):
+    connection.execute(
+        text("insert into lifted.schema_migrations (version, description) values (:version, :description)"),
+        {"version": migration.version, "description": migration.description},
+    )
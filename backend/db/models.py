@@ -1,23 +1,87 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import Text, Boolean, Integer, DateTime, text
+from sqlalchemy import Text, Boolean, Integer, BigInteger, DateTime, Index, JSON, Computed, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 
 
 class Base(DeclarativeBase):
     pass
 
 
+# Secondary indexes are declared on the models below so they stay next to the
+# columns they cover; db/migrations.py is what creates them in production.
+
+
+MESSAGE_SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(sender_name, '') || ' ' || coalesce(recipient_name, '')), 'A') || "
+    "setweight(to_tsvector('english', message_content), 'B')"
+)
+
+
 class Message(Base):
+    """Migration 10 turns this into a table LIST-partitioned by message_group:
+    closed semesters are moved into their own partitions by
+    `manage.py archive-semester` (see db/partitions.py) and everything else lives
+    in lifted.messages_default.  Partitioned tables need the partition key in
+    the primary key, hence (id, message_group)."""
     __tablename__ = "messages"
-    __table_args__ = {"schema": "lifted"}
-
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    __table_args__ = (
+        Index("ix_messages_recipient_email_message_group", "recipient_email", "message_group"),
+        Index("ix_messages_sender_email_message_group", "sender_email", "message_group"),
+        Index("ix_messages_message_group_created_timestamp_id", "message_group", "created_timestamp", "id"),
+        Index("ix_messages_created_timestamp_id", "created_timestamp", "id"),
+        Index("ix_messages_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_messages_recipient_email_pattern", text("lower(recipient_email) text_pattern_ops")),
+        Index("ix_messages_sender_email_pattern", text("lower(sender_email) text_pattern_ops")),
+        {"schema": "lifted"},
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     created_timestamp: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
-    message_group: Mapped[str] = mapped_column(Text, nullable=False)
+    message_group: Mapped[str] = mapped_column(Text, primary_key=True)
     sender_email: Mapped[str] = mapped_column(Text, nullable=False)
     sender_name: Mapped[str | None] = mapped_column(Text, nullable=True)
     recipient_email: Mapped[str] = mapped_column(Text, nullable=False)
     recipient_name: Mapped[str | None] = mapped_column(Text, nullable=True)
     message_content: Mapped[str] = mapped_column(Text, nullable=False)
+    # Names weigh more than the message body when ranking search results
+    search_vector: Mapped[str] = mapped_column(TSVECTOR, Computed(MESSAGE_SEARCH_VECTOR_SQL, persisted=True))
+
+
+class MessageGroupRank(Base):
+    """Per-group message counts for each sender/recipient, kept in sync by the
+    message write paths in db/repositories.py so ranks are an index lookup."""
+    __tablename__ = "message_group_ranks"
+    __table_args__ = (
+        Index("ix_message_group_ranks_group_direction_count", "message_group", "direction", "message_count"),
+        {"schema": "lifted"},
+    )
+
+    email: Mapped[str] = mapped_column(Text, primary_key=True)
+    direction: Mapped[str] = mapped_column(Text, primary_key=True)
+    message_group: Mapped[str] = mapped_column(Text, primary_key=True)
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+class LiftedStatCounter(Base):
+    """Running totals behind get_lifted_stats.  Each stat is split across a few
+    shard rows so concurrent message writes don't queue on one row lock; the
+    value of a stat is the sum of its shards."""
+    __tablename__ = "lifted_stat_counters"
+    __table_args__ = {"schema": "lifted"}
+
+    name: Mapped[str] = mapped_column(Text, primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    value: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
+class AnalyticsSnapshot(Base):
+    """Stored /api/analytics payloads, one per semester (plus "all")."""
+    __tablename__ = "analytics_snapshots"
+    __table_args__ = {"schema": "lifted"}
+
+    semester: Mapped[str] = mapped_column(Text, primary_key=True)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    refreshed_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), nullable=False)
 
 
 class Emails(Base):
@@ -33,7 +97,12 @@ class Emails(Base):
 
 class LiftedUser(Base):
     __tablename__ = "users"
-    __table_args__ = {"schema": "lifted"}
+    __table_args__ = (
+        Index("uq_users_email", "email", unique=True),
+        # Just the admins, for _load_admin_roster
+        Index("ix_users_admins", "email", "is_admin", "admin_write_perm", postgresql_where=text("is_admin or admin_write_perm")),
+        {"schema": "lifted"},
+    )
 
     id: Mapped[str] = mapped_column(Text, primary_key=True, server_default=text("gen_random_uuid()::text"))
     email: Mapped[str] = mapped_column(Text, primary_key=True)
@@ -48,7 +117,10 @@ class LiftedUser(Base):
 
 class HiddenCardOverride(Base):
     __tablename__ = "hidden_card_overrides"
-    __table_args__ = {"schema": "lifted"}
+    __table_args__ = (
+        Index("ix_hidden_card_overrides_recipient_email_message_group", "recipient_email", "message_group"),
+        {"schema": "lifted"},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     recipient_email: Mapped[str] = mapped_column(Text, nullable=False)
@@ -56,18 +128,36 @@ class HiddenCardOverride(Base):
 
 
 class Attachment(Base):
+    """An attachment recipients can pick; how many are left is in attachment_stock_shards."""
     __tablename__ = "attachments"
-    __table_args__ = {"schema": "lifted"}
+    __table_args__ = (
+        Index("ix_attachments_message_group", "message_group"),
+        {"schema": "lifted"},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     message_group: Mapped[str] = mapped_column(Text, nullable=False)
     attachment: Mapped[str] = mapped_column(Text, nullable=False)
+
+
+class AttachmentStockShard(Base):
+    """How many of each attachment are left.  The stock is split across a few
+    shard rows so concurrent pickers claim different rows instead of queueing
+    on one row lock; an attachment's stock is the sum of its shards."""
+    __tablename__ = "attachment_stock_shards"
+    __table_args__ = {"schema": "lifted"}
+
+    attachment_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
     count: Mapped[int] = mapped_column(Integer, nullable=False)
 
 
 class AttachmentPref(Base):
     __tablename__ = "attachment_prefs"
-    __table_args__ = {"schema": "lifted"}
+    __table_args__ = (
+        Index("ix_attachment_prefs_recipient_email_message_group", "recipient_email", "message_group"),
+        {"schema": "lifted"},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     recipient_email: Mapped[str] = mapped_column(Text, nullable=False)
@@ -77,7 +167,10 @@ class AttachmentPref(Base):
 
 class GoogleSlidesId(Base):
     __tablename__ = "google_slides_ids"
-    __table_args__ = {"schema": "lifted"}
+    __table_args__ = (
+        Index("ix_google_slides_ids_message_group", "message_group"),
+        {"schema": "lifted"},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     message_group: Mapped[str] = mapped_column(Text, nullable=False)
@@ -86,7 +179,10 @@ class GoogleSlidesId(Base):
 
 class SwapPref(Base):
     __tablename__ = "swap_prefs"
-    __table_args__ = {"schema": "lifted"}
+    __table_args__ = (
+        Index("ix_swap_prefs_recipient_email_event", "recipient_email", "event"),
+        {"schema": "lifted"},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     recipient_email: Mapped[str] = mapped_column(Text, nullable=False)
@@ -97,7 +193,10 @@ class SwapPref(Base):
 
 class RecentlyDeletedMessage(Base):
     __tablename__ = "recently_deleted_messages"
-    __table_args__ = {"schema": "lifted"}
+    __table_args__ = (
+        Index("ix_recently_deleted_messages_deleted_timestamp_id", "deleted_timestamp", "id"),
+        {"schema": "lifted"},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     created_timestamp: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
@@ -112,7 +211,12 @@ class RecentlyDeletedMessage(Base):
 
 class Log(Base):
     __tablename__ = "logs"
-    __table_args__ = {"schema": "lifted"}
+    __table_args__ = (
+        Index("ix_logs_log_timestamp_id", "log_timestamp", "id"),
+        Index("ix_logs_log_type_log_timestamp_id", "log_type", "log_timestamp", "id"),
+        Index("ix_logs_user_email_log_timestamp_id", "user_email", "log_timestamp", "id"),
+        {"schema": "lifted"},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     log_timestamp: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
@@ -123,6 +227,15 @@ class Log(Base):
     log_content: Mapped[str] = mapped_column(Text, nullable=False)
 
 
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    __table_args__ = {"schema": "lifted"}
+
+    version: Mapped[int] = mapped_column(Integer, primary_key=True)
+    description: Mapped[str] = mapped_column(Text, nullable=False)
+    applied_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=text("now()"))
+
+
 class CpTap(Base):
     __tablename__ = "cp_taps"
     __table_args__ = {"schema": "lifted"}
@@ -0,0 +1,126 @@
+"""Partitions of lifted.messages (see migration 10 in db/migrations.py).
+
+lifted.messages is LIST-partitioned by message_group.  Each archived semester
+gets its own partition, lifted.messages_<semester>, holding its physical and
+eLifted groups; every other group lives in lifted.messages_default.  Reads
+and writes keep going through lifted.messages, so archived cards are still
+served, edited and deleted as usual; queries filtered to the current groups
+are pruned to the default partition, which stays small.
+"""
+import re
+
+from sqlalchemy import text
+
+from db.models import Message
+
+DEFAULT_PARTITION = "messages_default"
+SEMESTER_PATTERN = re.compile(r"^[a-z]+_\d{2}$")
+
+# Everything except the generated search_vector, which partitions compute themselves
+_MESSAGE_COLUMNS = ", ".join(column.name for column in Message.__table__.columns if column.computed is None)
+
+
+def semester_message_groups(semester):
+    return [f"{semester}_p", f"{semester}_e"]
+
+
+def partition_name(semester):
+    if not SEMESTER_PATTERN.match(semester):
+        raise ValueError(f"Not a semester: {semester!r} (expected something like sp_25)")
+    return f"messages_{semester}"
+
+
+def is_partitioned(connection, table="messages"):
+    return bool(connection.execute(
+        text("select relkind = 'p' from pg_class where oid = to_regclass(:table)"),
+        {"table": f"lifted.{table}"},
+    ).scalar())
+
+
+def list_partitions(connection, table="messages"):
+    """[{name, bound, estimated_rows}] for each partition of lifted.<table>, by name."""
+    return connection.execute(text(
+        "select c.relname as name, pg_get_expr(c.relpartbound, c.oid) as bound, c.reltuples::bigint as estimated_rows "
+        "from pg_inherits i join pg_class c on c.oid = i.inhrelid "
+        "where i.inhparent = to_regclass(:table) "
+        "order by c.relname"
+    ), {"table": f"lifted.{table}"}).mappings().all()
+
+
+def partition_messages_table(connection):
+    """Rebuild a plain lifted.messages as a partitioned table with everything in
+    the default partition.  Copies every row under an exclusive lock, so run it
+    (via `manage.py migrate`) when nobody is sending messages."""
+    if is_partitioned(connection):
+        connection.execute(text(
+            f"create table if not exists lifted.{DEFAULT_PARTITION} partition of lifted.messages default"
+        ))
+        return
+
+    connection.execute(text("lock table lifted.messages in access exclusive mode"))
+    connection.execute(text("alter table lifted.messages rename to messages_unpartitioned"))
+    connection.execute(text(
+        "create table lifted.messages "
+        "(like lifted.messages_unpartitioned including defaults including generated including identity) "
+        "partition by list (message_group)"
+    ))
+    connection.execute(text(f"create table lifted.{DEFAULT_PARTITION} partition of lifted.messages default"))
+    connection.execute(text(
+        f"insert into lifted.messages ({_MESSAGE_COLUMNS}) "
+        f"select {_MESSAGE_COLUMNS} from lifted.messages_unpartitioned"
+    ))
+
+    # Keep handing out the same ids: a serial's sequence moves over to the new
+    # table, an identity column's new sequence continues after the copied rows
+    is_identity = connection.execute(text(
+        "select attidentity <> '' from pg_attribute "
+        "where attrelid = 'lifted.messages_unpartitioned'::regclass and attname = 'id'"
+    )).scalar()
+    if is_identity:
+        connection.execute(text(
+            "select setval(pg_get_serial_sequence('lifted.messages', 'id'), "
+            "coalesce((select max(id) from lifted.messages), 0) + 1, false)"
+        ))
+    else:
+        sequence = connection.execute(text("select pg_get_serial_sequence('lifted.messages_unpartitioned', 'id')")).scalar()
+        if sequence:
+            connection.execute(text(f"alter sequence {sequence} owned by lifted.messages.id"))
+
+    connection.execute(text("drop table lifted.messages_unpartitioned"))
+    connection.execute(text("alter table lifted.messages add primary key (id, message_group)"))
+    for index in sorted(Message.__table__.indexes, key=lambda index: index.name):
+        index.create(connection)
+    connection.execute(text("analyze lifted.messages"))
+
+
+def archive_semester(semester, connection):
+    """Move a semester's messages out of the default partition into their own.
+    Returns how many messages moved.  Run it inside a transaction: the default
+    partition is locked while its rows are moved and it is re-checked on attach."""
+    name = partition_name(semester)
+    message_groups = semester_message_groups(semester)
+    if any(partition["name"] == name for partition in list_partitions(connection)):
+        raise ValueError(f"{semester} is already archived in lifted.{name}")
+
+    connection.execute(text(
+        f"create table lifted.{name} (like lifted.messages including defaults including generated)"
+    ))
+    moved = connection.execute(text(
+        f"with moved as ("
+        f"  delete from lifted.{DEFAULT_PARTITION} where message_group = any(:message_groups) returning {_MESSAGE_COLUMNS}"
+        f") "
+        f"insert into lifted.{name} ({_MESSAGE_COLUMNS}) select {_MESSAGE_COLUMNS} from moved"
+    ), {"message_groups": message_groups}).rowcount
+
+    # Safe to inline: partition_name only accepts names like sp_25.  Matching the
+    # partition bound with a constraint up front lets ATTACH skip scanning the new partition
+    values_sql = ", ".join(f"'{group}'" for group in message_groups)
+    connection.execute(text(
+        f"alter table lifted.{name} add constraint {name}_bound "
+        f"check (message_group is not null and message_group in ({values_sql}))"
+    ))
+    connection.execute(text(f"alter table lifted.messages attach partition lifted.{name} for values in ({values_sql})"))
+    connection.execute(text(f"alter table lifted.{name} drop constraint {name}_bound"))
+    connection.execute(text(f"analyze lifted.{name}"))
+    connection.execute(text(f"analyze lifted.{DEFAULT_PARTITION}"))
+    return moved
@@ -1,12 +1,23 @@
+import base64
+import html
 import json
-from datetime import datetime, timezone
-from sqlalchemy import select, func, distinct, update, text, insert, delete, or_
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, func, distinct, update, text, insert, delete, or_, literal, tuple_, union_all, values, column, Text, Integer, exists, true
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as pg_insert
+from sqlalchemy.orm import aliased
+from notified_cache import NotifiedCache, notify
 from db.models import (
     Emails,
     Message,
+    MessageGroupRank,
+    LiftedStatCounter,
+    AnalyticsSnapshot,
     LiftedUser,
     HiddenCardOverride,
     Attachment,
+    AttachmentStockShard,
     AttachmentPref,
     GoogleSlidesId,
     SwapPref,
@@ -16,28 +27,156 @@ from db.models import (
 )
 
 
+RANK_DIRECTION_RECEIVED = "received"
+RANK_DIRECTION_SENT = "sent"
+STAT_COUNTER_SHARDS = 8
+ATTACHMENT_STOCK_SHARDS = 16
+ANALYTICS_SNAPSHOT_MAX_AGE = timedelta(minutes=10)
+ADMIN_ROSTER_CACHE_TTL_SECONDS = 60
+BROWSE_MESSAGES_PAGE_SIZE = 200
+LOGS_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+SEARCH_MESSAGES_LIMIT = 100
+# ts_headline marks matches with these, then the headline is escaped and they become <mark> tags
+_HEADLINE_START, _HEADLINE_STOP = "\x02", "\x03"
+
+
+def read_only(fn):
+    """Mark a repository function that never writes, so db_call may run it on the read replica."""
+    fn.read_only = True
+    return fn
+
+
 def rows_to_dicts(result):
     return [dict(row) for row in result.mappings().all()]
 
 
-def get_admin_by_email(db_session, email):
-    """Get admin permissions for a user by email.
-    Returns dict with is_admin and admin_write_perm, or None if user doesn't exist."""
-    user = db_session.execute(
-        select(LiftedUser.is_admin, LiftedUser.admin_write_perm)
-        .where(LiftedUser.email == email)
-        .limit(1)
-    ).mappings().first()
-    
-    if user is None:
-        return None
-    
-    return {
-        "is_admin": user["is_admin"],
-        "admin_write_perm": user["admin_write_perm"]
-    }
+def _add_message_count_deltas(deltas, messages, sign):
+    for message in messages:
+        deltas[(message["message_group"], message["recipient_email"], RANK_DIRECTION_RECEIVED)] += sign
+        deltas[(message["message_group"], message["sender_email"], RANK_DIRECTION_SENT)] += sign
+    return deltas
+
+
+def _get_rank_participants(email_directions, db_session):
+    return set(db_session.execute(
+        select(MessageGroupRank.email, MessageGroupRank.direction)
+        .where(tuple_(MessageGroupRank.email, MessageGroupRank.direction).in_(email_directions))
+        .distinct()
+    ).tuples().all())
+
+
+def _lock_rank_participants(email_directions, db_session):
+    """Serialize transactions that touch the same (email, direction) until they
+    commit.  Otherwise two first messages to someone could both see no rank
+    row yet and both count them as a new unique recipient (and two deletes
+    of their last messages both miss the decrement).  Volatile functions run
+    after ORDER BY, so the locks are taken in sorted order."""
+    keys = values(column("key", Text), name="rank_lock_keys").data(
+        [(f"message_count:{email}:{direction}",) for email, direction in email_directions]
+    )
+    db_session.execute(
+        select(func.pg_advisory_xact_lock(func.hashtext(keys.c.key))).order_by(keys.c.key)
+    ).all()
+
+
+def _apply_message_count_deltas(deltas, db_session):
+    """Apply {(message_group, email, direction): delta} to message_group_ranks and
+    the lifted stat counters. Runs inside the caller's transaction; the caller commits."""
+    rows = [
+        {"message_group": message_group, "email": email, "direction": direction, "message_count": delta}
+        for (message_group, email, direction), delta in sorted(deltas.items())
+        if delta
+    ]
+    if not rows:
+        return
+
+    email_directions = sorted({(row["email"], row["direction"]) for row in rows})
+    _lock_rank_participants(email_directions, db_session)
+    participants_before = _get_rank_participants(email_directions, db_session)
+
+    # Rows are sorted so concurrent writers lock counters in the same order
+    upsert = pg_insert(MessageGroupRank).values(rows)
+    db_session.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[MessageGroupRank.email, MessageGroupRank.direction, MessageGroupRank.message_group],
+            set_={"message_count": MessageGroupRank.message_count + upsert.excluded.message_count},
+        )
+    )
+    db_session.execute(
+        delete(MessageGroupRank)
+        .where(
+            tuple_(MessageGroupRank.email, MessageGroupRank.direction, MessageGroupRank.message_group)
+            .in_([(row["email"], row["direction"], row["message_group"]) for row in rows])
+        )
+        .where(MessageGroupRank.message_count <= 0)
+    )
+
+    participants_after = _get_rank_participants(email_directions, db_session)
+
+    def participant_delta(direction):
+        return (
+            sum(1 for _, d in participants_after if d == direction)
+            - sum(1 for _, d in participants_before if d == direction)
+        )
+
+    _apply_stat_counter_deltas({
+        "total_received": sum(row["message_count"] for row in rows if row["direction"] == RANK_DIRECTION_RECEIVED),
+        "unique_received": participant_delta(RANK_DIRECTION_RECEIVED),
+        "unique_sent": participant_delta(RANK_DIRECTION_SENT),
+    }, db_session)
+
+
+def _apply_stat_counter_deltas(stat_deltas, db_session):
+    shard = random.randrange(STAT_COUNTER_SHARDS)
+    rows = [
+        {"name": name, "shard": shard, "value": delta}
+        for name, delta in sorted(stat_deltas.items())
+        if delta
+    ]
+    if not rows:
+        return
+
+    upsert = pg_insert(LiftedStatCounter).values(rows)
+    db_session.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[LiftedStatCounter.name, LiftedStatCounter.shard],
+            set_={"value": LiftedStatCounter.value + upsert.excluded.value},
+        )
+    )
 
 
+def rebuild_message_group_ranks(db_session):
+    """Recompute message_group_ranks from scratch (backfill or repair after drift)."""
+    # Block message writes for the duration so no delta lands between the delete and the insert
+    db_session.execute(text("lock table lifted.messages in share mode"))
+    db_session.execute(delete(MessageGroupRank))
+
+    received = select(
+        Message.message_group,
+        Message.recipient_email,
+        literal(RANK_DIRECTION_RECEIVED),
+        func.count(),
+    ).group_by(Message.message_group, Message.recipient_email)
+
+    sent = select(
+        Message.message_group,
+        Message.sender_email,
+        literal(RANK_DIRECTION_SENT),
+        func.count(),
+    ).group_by(Message.message_group, Message.sender_email)
+
+    result = db_session.execute(
+        insert(MessageGroupRank).from_select(
+            ["message_group", "email", "direction", "message_count"],
+            union_all(received, sent),
+        )
+    )
+    db_session.commit()
+    return result.rowcount
+
+
+@read_only
 def get_user_by_uuid(db_session, user_uuid):
     user = db_session.execute(
         select(
@@ -55,6 +194,7 @@ def get_user_by_uuid(db_session, user_uuid):
     return dict(user) if user is not None else None
 
 
+@read_only
 def get_user_by_email(db_session, email):
     normalized_email = (email or "").strip().lower()
     if not normalized_email:
@@ -76,77 +216,116 @@ def get_user_by_email(db_session, email):
     return dict(user) if user is not None else None
 
 
-def increment_clicked_quick_link_count(user_uuid, db_session):
-    if not user_uuid:
-        return False
+@read_only
+def get_users_by_emails(emails, db_session):
+    """{email: user} for whichever of emails have a users row, in one query."""
+    normalized_emails = {(email or "").strip().lower() for email in emails} - {""}
+    if not normalized_emails:
+        return {}
+
+    users = db_session.execute(
+        select(
+            LiftedUser.id,
+            LiftedUser.email,
+            LiftedUser.given_name,
+            LiftedUser.full_name,
+            LiftedUser.affiliation,
+            LiftedUser.updated_at,
+        )
+        .where(LiftedUser.email.in_(sorted(normalized_emails)))
+    ).mappings().all()
+
+    return {user["email"]: dict(user) for user in users}
 
+
+def add_clicked_quick_link_counts(click_counts, db_session):
+    """Add {user_uuid: clicks} to users.clicked_quick_link_count in one UPDATE ... FROM (VALUES ...)."""
+    if not click_counts:
+        return 0
+
+    clicks = values(column("id", Text), column("clicks", Integer), name="clicks").data(sorted(click_counts.items()))
     result = db_session.execute(
         update(LiftedUser)
-        .where(LiftedUser.id == user_uuid)
-        .values(clicked_quick_link_count=func.coalesce(LiftedUser.clicked_quick_link_count, 0) + 1)
+        .where(LiftedUser.id == clicks.c.id)
+        .values(clicked_quick_link_count=func.coalesce(LiftedUser.clicked_quick_link_count, 0) + clicks.c.clicks)
     )
     db_session.commit()
-    return result.rowcount > 0
+    return result.rowcount
+
+
+def _upsert_lifted_users_stmt(rows):
+    stmt = pg_insert(LiftedUser).values(rows)
+    # Blank profile fields never overwrite what we already know about someone
+    return stmt.on_conflict_do_update(
+        index_elements=[LiftedUser.email],
+        set_={
+            "given_name": func.coalesce(stmt.excluded.given_name, LiftedUser.given_name),
+            "full_name": func.coalesce(stmt.excluded.full_name, LiftedUser.full_name),
+            "affiliation": func.coalesce(stmt.excluded.affiliation, LiftedUser.affiliation),
+            "clicked_quick_link_count": func.coalesce(LiftedUser.clicked_quick_link_count, 0),
+            "updated_at": stmt.excluded.updated_at,
+        },
+    ).returning(
+        LiftedUser.id,
+        LiftedUser.email,
+        LiftedUser.given_name,
+        LiftedUser.full_name,
+        LiftedUser.affiliation,
+        LiftedUser.updated_at,
+    )
+
+
+def _lifted_user_row(email, given_name, full_name, affiliation, now_utc):
+    return {
+        "email": email,
+        "given_name": given_name or None,
+        "full_name": full_name or None,
+        "affiliation": affiliation or None,
+        "clicked_quick_link_count": 0,
+        "updated_at": now_utc,
+    }
 
 
 def _upsert_lifted_user(email, given_name, full_name, affiliation, db_session):
     normalized_email = (email or "").strip().lower()
-    now_utc = datetime.now(timezone.utc)
-
     if not normalized_email:
         return None
 
-    existing_user = db_session.execute(
-        select(
-            LiftedUser.id,
-            LiftedUser.given_name,
-            LiftedUser.full_name,
-            LiftedUser.affiliation,
-        )
-        .where(LiftedUser.email == normalized_email)
-        .limit(1)
-    ).mappings().first()
+    row = _lifted_user_row(normalized_email, given_name, full_name, affiliation, datetime.now(timezone.utc))
+    user = db_session.execute(_upsert_lifted_users_stmt([row])).mappings().one()
+    db_session.commit()
+    return dict(user)
 
-    resolved_given_name = given_name or (existing_user["given_name"] if existing_user else None)
-    resolved_full_name = full_name or (existing_user["full_name"] if existing_user else None)
-    resolved_affiliation = affiliation or (existing_user["affiliation"] if existing_user else None)
 
-    if existing_user is not None:
-        db_session.execute(
-            update(LiftedUser)
-            .where(LiftedUser.email == normalized_email)
-            .values(
-                given_name=resolved_given_name,
-                full_name=resolved_full_name,
-                affiliation=resolved_affiliation,
-                clicked_quick_link_count=func.coalesce(LiftedUser.clicked_quick_link_count, 0),
-                updated_at=now_utc
-            )
+def bulk_upsert_users(users, db_session):
+    """Upsert many users (dicts with email, given_name, full_name, affiliation) in one statement.
+
+    For entries with the same email, later non-blank values win; blanks are
+    filled from earlier entries for that email.
+    Returns the stored users, ordered by email.
+    """
+    now_utc = datetime.now(timezone.utc)
+    rows_by_email = {}
+    for user in users:
+        normalized_email = (user.get("email") or "").strip().lower()
+        if not normalized_email:
+            continue
+        row = _lifted_user_row(
+            normalized_email, user.get("given_name"), user.get("full_name"), user.get("affiliation"), now_utc
         )
-        user_uuid = existing_user["id"]
-    else:
-        user_uuid = db_session.execute(
-            insert(LiftedUser)
-            .values(
-                email=normalized_email,
-                given_name=resolved_given_name,
-                full_name=resolved_full_name,
-                affiliation=resolved_affiliation,
-                clicked_quick_link_count=0,
-                updated_at=now_utc,
-            )
-            .returning(LiftedUser.id)
-        ).scalar_one()
+        previous = rows_by_email.get(normalized_email)
+        if previous is not None:
+            row = {key: value if value is not None else previous[key] for key, value in row.items()}
+        rows_by_email[normalized_email] = row
 
+    if not rows_by_email:
+        return []
+
+    # ON CONFLICT can't touch a row twice in one statement, hence the dedupe; sorting keeps lock order stable
+    rows = [rows_by_email[email] for email in sorted(rows_by_email)]
+    upserted = rows_to_dicts(db_session.execute(_upsert_lifted_users_stmt(rows)))
     db_session.commit()
-    return {
-        "id": user_uuid,
-        "email": normalized_email,
-        "given_name": resolved_given_name,
-        "full_name": resolved_full_name,
-        "affiliation": resolved_affiliation,
-        "updated_at": now_utc,
-    }
+    return sorted(upserted, key=lambda user: user["email"])
 
 
 def upsert_user_from_oidc(oidc_profile, db_session):
@@ -171,7 +350,27 @@ def upsert_user_by_email(email, given_name, full_name, affiliation, db_session):
     return _upsert_lifted_user(email, given_name, full_name, affiliation, db_session)
 
 
+@read_only
 def get_lifted_stats(db_session):
+    counters = dict(db_session.execute(
+        select(LiftedStatCounter.name, func.sum(LiftedStatCounter.value))
+        .group_by(LiftedStatCounter.name)
+    ).tuples().all())
+
+    return {
+        "total_received": int(counters.get("total_received") or 0),
+        "unique_received": int(counters.get("unique_received") or 0),
+        "unique_sent": int(counters.get("unique_sent") or 0)
+    }
+
+
+def reconcile_lifted_stats(db_session):
+    """Reset the stat counters to exact counts over all messages.
+    Returns the exact stats and how far the running counters had drifted."""
+    # Block message writes so no delta lands between the count and the reset
+    db_session.execute(text("lock table lifted.messages in share mode"))
+    running_stats = get_lifted_stats(db_session)
+
     total_received, unique_received, unique_sent = db_session.execute(
         select(
             func.count().label("total_received"),
@@ -180,13 +379,50 @@ def get_lifted_stats(db_session):
         ).select_from(Message)
     ).one()
 
-    return {
+    exact_stats = {
         "total_received": int(total_received or 0),
         "unique_received": int(unique_received or 0),
         "unique_sent": int(unique_sent or 0)
     }
 
+    db_session.execute(delete(LiftedStatCounter))
+    db_session.execute(
+        insert(LiftedStatCounter),
+        [{"name": name, "shard": 0, "value": value} for name, value in exact_stats.items()],
+    )
+    db_session.commit()
+
+    return {
+        "stats": exact_stats,
+        "drift": {name: running_stats[name] - value for name, value in exact_stats.items()},
+    }
+
+
+def _get_ranks_for_email(email, direction, db_session):
+    # Same result as rank() over (partition by message_group order by count desc),
+    # but counted from the maintained counters instead of aggregating all messages
+    peer = aliased(MessageGroupRank)
+    higher_count = (
+        select(func.count())
+        .where(
+            (peer.message_group == MessageGroupRank.message_group)
+            & (peer.direction == MessageGroupRank.direction)
+            & (peer.message_count > MessageGroupRank.message_count)
+        )
+        .scalar_subquery()
+    )
+
+    return rows_to_dicts(db_session.execute(
+        select(MessageGroupRank.message_group, (higher_count + 1).label("rank"))
+        .where(
+            (MessageGroupRank.email == email)
+            & (MessageGroupRank.direction == direction)
+            & (MessageGroupRank.message_count > 0)
+        )
+    ))
 
+
+@read_only
 def get_messages_payload(db_session, target_email, message_group_filter):
     received_cards = rows_to_dicts(db_session.execute(
         select(Message.id, Message.message_group)
@@ -198,53 +434,13 @@ def get_messages_payload(db_session, target_email, message_group_filter):
         .where(Message.sender_email == target_email)
     ))
 
-    recv_stats = select(
-        Message.message_group.label("message_group"),
-        Message.recipient_email.label("recipient_email"),
-        func.count().label("cnt")
-    ).group_by(Message.message_group, Message.recipient_email).subquery()
-
-    recv_ranking = select(
-        recv_stats.c.message_group,
-        recv_stats.c.recipient_email,
-        func.rank().over(
-            partition_by=recv_stats.c.message_group,
-            order_by=recv_stats.c.cnt.desc()
-        ).label("rank")
-    ).subquery()
-
-    received_ranks = rows_to_dicts(db_session.execute(
-        select(recv_ranking.c.message_group, recv_ranking.c.rank)
-        .where(recv_ranking.c.recipient_email == target_email)
-    ))
+    received_ranks = _get_ranks_for_email(target_email, RANK_DIRECTION_RECEIVED, db_session)
+    sent_ranks = _get_ranks_for_email(target_email, RANK_DIRECTION_SENT, db_session)
 
-    sent_stats = select(
-        Message.message_group.label("message_group"),
-        Message.sender_email.label("sender_email"),
-        func.count().label("cnt")
-    ).group_by(Message.message_group, Message.sender_email).subquery()
-
-    sent_ranking = select(
-        sent_stats.c.message_group,
-        sent_stats.c.sender_email,
-        func.rank().over(
-            partition_by=sent_stats.c.message_group,
-            order_by=sent_stats.c.cnt.desc()
-        ).label("rank")
-    ).subquery()
-
-    sent_ranks = rows_to_dicts(db_session.execute(
-        select(sent_ranking.c.message_group, sent_ranking.c.rank)
-        .where(sent_ranking.c.sender_email == target_email)
-    ))
-
-    hidden_card_overrides = db_session.execute(
-        select(HiddenCardOverride.message_group)
-        .where(HiddenCardOverride.recipient_email == target_email)
-    ).scalars().all()
+    hidden_card_overrides = get_hidden_card_overrides(target_email, db_session)
 
     attachments = rows_to_dicts(db_session.execute(
-        select(Attachment.id, Attachment.message_group, Attachment.attachment, Attachment.count)
+        select(Attachment.id, Attachment.message_group, Attachment.attachment, _attachment_stock(Attachment.id).label("count"))
         .where(Attachment.message_group == message_group_filter)
         .order_by(Attachment.id.desc())
     ))
@@ -272,6 +468,7 @@ def get_messages_payload(db_session, target_email, message_group_filter):
     }
 
 
+@read_only
 def get_card_payload(db_session, card_id, lookup_email):
     try:
         card_id_int = int(card_id)
@@ -303,10 +500,7 @@ def get_card_payload(db_session, card_id, lookup_email):
             .limit(1)
         ).mappings().first()
 
-    overrides = db_session.execute(
-        select(HiddenCardOverride.message_group)
-        .where(HiddenCardOverride.recipient_email == lookup_email)
-    ).scalars().all()
+    overrides = get_hidden_card_overrides(lookup_email, db_session)
 
     return {
         "card": dict(card) if card is not None else None,
@@ -314,38 +508,246 @@ def get_card_payload(db_session, card_id, lookup_email):
     }
 
 
-def claim_attachment(row_id, db_session):
+@read_only
+def get_card_view_context(card_id, viewer_email, db_session, template_message_group=None):
+    """Everything a card download needs, in one query: the card and its
+    attachment, whether viewer_email has an override for the card's group, and
+    the Slides presentation id and attachments of template_message_group
+    (the card's own group by default).  card is None if the card doesn't exist."""
     try:
-        row_id_int = int(row_id)
+        card_id_int = int(card_id)
     except (TypeError, ValueError):
-        return False
+        return {"card": None, "overrides": [], "presentation_id": None, "attachments": []}
 
-    result = db_session.execute(
-        update(Attachment)
-        .where((Attachment.id == row_id_int) & (Attachment.count > 0))
-        .values(count=Attachment.count - 1)
+    card = (
+        select(
+            Message.id,
+            Message.created_timestamp,
+            Message.message_group,
+            Message.sender_email,
+            Message.sender_name,
+            Message.recipient_email,
+            Message.recipient_name,
+            Message.message_content,
+            AttachmentPref.attachment_id,
+            Attachment.attachment,
+        )
+        .outerjoin(
+            AttachmentPref,
+            (Message.recipient_email == AttachmentPref.recipient_email)
+            & (Message.message_group == AttachmentPref.message_group),
+        )
+        .outerjoin(Attachment, AttachmentPref.attachment_id == Attachment.id)
+        .where(Message.id == card_id_int)
+        .limit(1)
+        .cte("card")
     )
+    template_group = func.coalesce(literal(template_message_group, Text), card.c.message_group)
+    template_attachment = aliased(Attachment)
+
+    row = db_session.execute(
+        select(
+            card,
+            exists()
+            .where(HiddenCardOverride.recipient_email == viewer_email)
+            .where(HiddenCardOverride.message_group == card.c.message_group)
+            .label("has_override"),
+            select(GoogleSlidesId.presentation_id)
+            .where(GoogleSlidesId.message_group == template_group)
+            .limit(1)
+            .scalar_subquery()
+            .label("presentation_id"),
+            select(func.coalesce(
+                func.json_agg(aggregate_order_by(
+                    func.json_build_object(
+                        "id", template_attachment.id,
+                        "message_group", template_attachment.message_group,
+                        "attachment", template_attachment.attachment,
+                        "count", _attachment_stock(template_attachment.id),
+                    ),
+                    template_attachment.id.desc(),
+                )),
+                text("'[]'::json"),
+            ))
+            .where(template_attachment.message_group == template_group)
+            .scalar_subquery()
+            .label("attachments"),
+        )
+    ).mappings().first()
+
+    if row is None:
+        return {"card": None, "overrides": [], "presentation_id": None, "attachments": []}
+
+    context = dict(row)
+    has_override = context.pop("has_override")
+    presentation_id = context.pop("presentation_id")
+    attachments = context.pop("attachments")
+    return {
+        # Same shape as get_card_payload's overrides, limited to the card's group
+        "card": context,
+        "overrides": [context["message_group"]] if has_override else [],
+        "presentation_id": presentation_id,
+        "attachments": attachments,
+    }
+
+
+def _attachment_stock(attachment_id):
+    """Scalar subquery: how many of the attachment are left (the sum of its shards)."""
+    return (
+        select(func.coalesce(func.sum(AttachmentStockShard.count), 0))
+        .where(AttachmentStockShard.attachment_id == attachment_id)
+        .scalar_subquery()
+    )
+
+
+def stock_shard_rows(attachment_id, count, shards=ATTACHMENT_STOCK_SHARDS):
+    """attachment_stock_shards rows holding count of an attachment, split evenly over shards."""
+    return [
+        {"attachment_id": attachment_id, "shard": shard, "count": count // shards + (1 if shard < count % shards else 0)}
+        for shard in range(shards)
+    ]
+
+
+def _replace_attachment_stock(attachment_id, count, db_session, shards=ATTACHMENT_STOCK_SHARDS):
+    db_session.execute(delete(AttachmentStockShard).where(AttachmentStockShard.attachment_id == attachment_id))
+    db_session.execute(insert(AttachmentStockShard), stock_shard_rows(attachment_id, count, shards))
+
+
+def set_attachment_stock(attachment_id, count, db_session, shards=ATTACHMENT_STOCK_SHARDS):
+    """Set how many of an attachment are left, spread evenly over shards rows."""
+    _replace_attachment_stock(int(attachment_id), int(count), db_session, shards)
     db_session.commit()
+
+
+def _adjust_stock_shard(attachment_id, delta, db_session, skip_locked):
+    """Add delta to one shard of the attachment, starting from a random shard so
+    concurrent callers spread out.  Taking stock (delta < 0) only uses shards with
+    enough left.  With skip_locked, shards another transaction holds are passed
+    over instead of waited on.  Returns whether a shard was updated."""
+    start = random.randrange(ATTACHMENT_STOCK_SHARDS)
+    candidate = (
+        select(AttachmentStockShard.attachment_id, AttachmentStockShard.shard)
+        .where(AttachmentStockShard.attachment_id == attachment_id)
+        .where(AttachmentStockShard.count + delta >= 0)
+        .order_by((AttachmentStockShard.shard + ATTACHMENT_STOCK_SHARDS - start) % ATTACHMENT_STOCK_SHARDS)
+        .limit(1)
+        .with_for_update(skip_locked=skip_locked)
+        .cte("candidate")
+    )
+    result = db_session.execute(
+        update(AttachmentStockShard)
+        .where(AttachmentStockShard.attachment_id == candidate.c.attachment_id)
+        .where(AttachmentStockShard.shard == candidate.c.shard)
+        .values(count=AttachmentStockShard.count + delta)
+    )
     return result.rowcount > 0
 
 
-def return_attachment(row_id, db_session):
+def _claim_attachment_stock(attachment_id, db_session):
+    # Shards other pickers hold are skipped; only when every shard with stock
+    # is taken do we wait
+    if _adjust_stock_shard(attachment_id, -1, db_session, skip_locked=True):
+        return True
+    # After the wait Postgres re-checks the shard and drops it if it ran out,
+    # without trying the next one, so keep going until the stock really is gone.
+    # Each miss means someone else took one, so this ends within the stock.
+    while True:
+        if _adjust_stock_shard(attachment_id, -1, db_session, skip_locked=False):
+            return True
+        if not db_session.execute(select(_attachment_stock(attachment_id))).scalar_one():
+            return False
+
+
+def _return_attachment_stock(attachment_id, db_session, amount=1):
+    if _adjust_stock_shard(attachment_id, amount, db_session, skip_locked=True):
+        return
+    upsert = pg_insert(AttachmentStockShard).values(
+        attachment_id=attachment_id,
+        shard=random.randrange(ATTACHMENT_STOCK_SHARDS),
+        count=amount,
+    )
+    db_session.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[AttachmentStockShard.attachment_id, AttachmentStockShard.shard],
+            set_={"count": AttachmentStockShard.count + upsert.excluded.count},
+        )
+    )
+
+
+def set_attachment_pref(recipient_email, message_group, attachment_id, db_session):
+    """Give recipient_email attachment_id for message_group in one transaction:
+    claim one from stock, create or update their pref, and put the attachment
+    they had before back.  Returns False (changing nothing) if none are left."""
     try:
-        row_id_int = int(row_id)
+        attachment_id_int = int(attachment_id)
     except (TypeError, ValueError):
         return False
 
-    result = db_session.execute(
-        update(Attachment)
-        .where(Attachment.id == row_id_int)
-        .values(count=Attachment.count + 1)
-    )
+    # One pick per recipient at a time, so a double click can't claim twice
+    db_session.execute(select(func.pg_advisory_xact_lock(
+        func.hashtext(f"attachment_pref:{recipient_email}:{message_group}")
+    )))
+    previous = db_session.execute(
+        select(AttachmentPref.id, AttachmentPref.attachment_id)
+        .where(
+            (AttachmentPref.recipient_email == recipient_email)
+            & (AttachmentPref.message_group == message_group)
+        )
+        .limit(1)
+    ).first()
+
+    if previous is not None and previous.attachment_id == attachment_id_int:
+        db_session.commit()
+        return True
+
+    # Nothing is written before the claim, so a failed claim leaves nothing to undo
+    if not _claim_attachment_stock(attachment_id_int, db_session):
+        db_session.commit()
+        return False
+
+    if previous is None:
+        db_session.execute(
+            insert(AttachmentPref).values(
+                recipient_email=recipient_email,
+                message_group=message_group,
+                attachment_id=attachment_id_int,
+            )
+        )
+    else:
+        db_session.execute(
+            update(AttachmentPref)
+            .where(AttachmentPref.id == previous.id)
+            .values(attachment_id=attachment_id_int)
+        )
+        _return_attachment_stock(previous.attachment_id, db_session)
+
     db_session.commit()
-    return result.rowcount > 0
+    return True
 
 
-def get_cards_with_attachments(message_group, db_session):
-    return rows_to_dicts(db_session.execute(
+def delete_attachment_pref(pref_id, db_session, recipient_email=None):
+    """Delete an attachment pref and put its attachment back in stock, in one
+    transaction.  With recipient_email, only a pref of theirs is deleted.
+    Only a row this call actually deleted is restocked, so a repeat or
+    concurrent delete can't return the same attachment twice."""
+    try:
+        pref_id_int = int(pref_id)
+    except (TypeError, ValueError):
+        return False
+
+    stmt = delete(AttachmentPref).where(AttachmentPref.id == pref_id_int)
+    if recipient_email is not None:
+        stmt = stmt.where(AttachmentPref.recipient_email == recipient_email)
+    attachment_id = db_session.execute(stmt.returning(AttachmentPref.attachment_id)).scalar_one_or_none()
+
+    if attachment_id is not None:
+        _return_attachment_stock(attachment_id, db_session)
+    db_session.commit()
+    return attachment_id is not None
+
+
+def _cards_with_attachments_stmt(message_group, order_by_netid=False):
+    stmt = (
         select(
             Message.id,
             Message.created_timestamp,
@@ -365,9 +767,36 @@ def get_cards_with_attachments(message_group, db_session):
         )
         .outerjoin(Attachment, AttachmentPref.attachment_id == Attachment.id)
         .where(Message.message_group == message_group)
-    ))
+    )
+
+    if order_by_netid:
+        # NetID letters, then its number numerically (ab2 before ab10); emails that
+        # don't look like a NetID sort by the whole address
+        netid_letters = func.substring(Message.recipient_email, r"^([a-z]+)\d+")
+        netid_number = func.substring(Message.recipient_email, r"^[a-z]+(\d+)")
+        stmt = stmt.order_by(
+            func.coalesce(netid_letters, Message.recipient_email).collate("C"),
+            func.coalesce(netid_number.cast(Integer), 0),
+            Message.id,
+        )
+
+    return stmt
 
 
+@read_only
+def get_cards_with_attachments(message_group, db_session, order_by_netid=False):
+    return rows_to_dicts(db_session.execute(_cards_with_attachments_stmt(message_group, order_by_netid)))
+
+
+@read_only
+def iter_cards_with_attachments(message_group, db_session, order_by_netid=False, batch_size=1000):
+    """get_cards_with_attachments one card at a time, fetched from a server-side cursor."""
+    stmt = _cards_with_attachments_stmt(message_group, order_by_netid).execution_options(yield_per=batch_size)
+    for row in db_session.execute(stmt).mappings():
+        yield dict(row)
+
+
+@read_only
 def get_attachment_pref(recipient_email, message_group, db_session):
     row = db_session.execute(
         select(
@@ -385,6 +814,7 @@ def get_attachment_pref(recipient_email, message_group, db_session):
     return dict(row) if row else None
 
 
+@read_only
 def get_attachment_pref_by_id(pref_id, db_session):
     try:
         pref_id_int = int(pref_id)
@@ -402,46 +832,10 @@ def get_attachment_pref_by_id(pref_id, db_session):
     return dict(row) if row else None
 
 
-def create_attachment_pref(recipient_email, message_group, attachment_id, db_session):
-    db_session.execute(
-        insert(AttachmentPref).values(
-            recipient_email=recipient_email,
-            message_group=message_group,
-            attachment_id=int(attachment_id),
-        )
-    )
-    db_session.commit()
-
-
-def update_attachment_pref(recipient_email, message_group, attachment_id, db_session):
-    result = db_session.execute(
-        update(AttachmentPref)
-        .where(
-            (AttachmentPref.recipient_email == recipient_email)
-            & (AttachmentPref.message_group == message_group)
-        )
-        .values(attachment_id=int(attachment_id))
-    )
-    db_session.commit()
-    return result.rowcount > 0
-
-
-def delete_attachment_pref_by_id(pref_id, db_session):
-    try:
-        pref_id_int = int(pref_id)
-    except (TypeError, ValueError):
-        return False
-
-    result = db_session.execute(
-        delete(AttachmentPref).where(AttachmentPref.id == pref_id_int)
-    )
-    db_session.commit()
-    return result.rowcount > 0
-
-
+@read_only
 def list_attachments_for_message_group(message_group, db_session):
     return rows_to_dicts(db_session.execute(
-        select(Attachment.id, Attachment.message_group, Attachment.attachment, Attachment.count)
+        select(Attachment.id, Attachment.message_group, Attachment.attachment, _attachment_stock(Attachment.id).label("count"))
         .where(Attachment.message_group == message_group)
         .order_by(Attachment.id.desc())
     ))
@@ -456,21 +850,23 @@ def delete_attachment_by_id(attachment_id, db_session):
     result = db_session.execute(
         delete(Attachment).where(Attachment.id == attachment_id_int)
     )
+    db_session.execute(delete(AttachmentStockShard).where(AttachmentStockShard.attachment_id == attachment_id_int))
     db_session.commit()
     return result.rowcount > 0
 
 
 def create_attachment(message_group, attachment, count, db_session):
-    db_session.execute(
+    attachment_id = db_session.execute(
         insert(Attachment).values(
             message_group=message_group,
             attachment=attachment,
-            count=int(count),
-        )
-    )
+        ).returning(Attachment.id)
+    ).scalar_one()
+    _replace_attachment_stock(attachment_id, int(count), db_session)
     db_session.commit()
 
 
+@read_only
 def get_google_slides_presentation_id(message_group, db_session):
     return db_session.execute(
         select(GoogleSlidesId.presentation_id)
@@ -501,36 +897,101 @@ def upsert_google_slides_id(message_group, presentation_id, db_session):
 
 
 def update_message_by_id(card_id, values, db_session):
-    result = db_session.execute(
-        update(Message).where(Message.id == int(card_id)).values(**values)
-    )
-    db_session.commit()
-    return result.rowcount > 0
+    rank_columns = {"message_group", "sender_email", "recipient_email"}
+    if rank_columns.isdisjoint(values):
+        result = db_session.execute(
+            update(Message).where(Message.id == int(card_id)).values(**values)
+        )
+        db_session.commit()
+        return result.rowcount > 0
 
+    old_message = db_session.execute(
+        select(Message.message_group, Message.sender_email, Message.recipient_email)
+        .where(Message.id == int(card_id))
+        .with_for_update()
+    ).mappings().first()
 
-def delete_message_by_id(card_id, db_session):
-    result = db_session.execute(
-        delete(Message).where(Message.id == int(card_id))
-    )
+    if old_message is None:
+        db_session.commit()
+        return False
+
+    new_message = db_session.execute(
+        update(Message)
+        .where(Message.id == int(card_id))
+        .values(**values)
+        .returning(Message.message_group, Message.sender_email, Message.recipient_email)
+    ).mappings().one()
+
+    deltas = _add_message_count_deltas(defaultdict(int), [old_message], -1)
+    _apply_message_count_deltas(_add_message_count_deltas(deltas, [new_message], 1), db_session)
     db_session.commit()
-    return result.rowcount > 0
+    return True
 
 
-def insert_recently_deleted_message(card, db_session):
-    db_session.execute(
-        insert(RecentlyDeletedMessage).values(
-            created_timestamp=card["created_timestamp"],
-            message_group=card["message_group"],
-            sender_email=card["sender_email"],
-            sender_name=card.get("sender_name"),
-            recipient_email=card["recipient_email"],
-            recipient_name=card.get("recipient_name"),
-            message_content=card["message_content"],
-        )
+_ARCHIVED_MESSAGE_COLUMNS = (
+    "created_timestamp",
+    "message_group",
+    "sender_email",
+    "sender_name",
+    "recipient_email",
+    "recipient_name",
+    "message_content",
+)
+
+
+def _message_delete_filters(message_ids=None, message_group=None, sender_email=None):
+    filters = []
+    if message_ids is not None:
+        filters.append(Message.id.in_([int(message_id) for message_id in message_ids]))
+    if message_group:
+        filters.append(Message.message_group == message_group)
+    if sender_email:
+        filters.append(Message.sender_email == sender_email)
+    if not filters:
+        raise ValueError("At least one of message_ids, message_group or sender_email is required")
+    return filters
+
+
+def delete_messages(db_session, message_ids=None, message_group=None, sender_email=None):
+    """Move the messages matching every given filter into recently_deleted_messages.
+    The delete and the archive insert are one statement, so a message can't be
+    deleted without being archived.  Returns how many messages were deleted."""
+    deleted = (
+        delete(Message)
+        .where(*_message_delete_filters(message_ids, message_group, sender_email))
+        .returning(*(Message.__table__.c[name] for name in _ARCHIVED_MESSAGE_COLUMNS))
+        .cte("deleted_messages")
     )
+    archived_messages = db_session.execute(
+        insert(RecentlyDeletedMessage)
+        .from_select(
+            ["deleted_timestamp", *_ARCHIVED_MESSAGE_COLUMNS],
+            select(func.now(), *(deleted.c[name] for name in _ARCHIVED_MESSAGE_COLUMNS)),
+        )
+        .returning(
+            RecentlyDeletedMessage.message_group,
+            RecentlyDeletedMessage.sender_email,
+            RecentlyDeletedMessage.recipient_email,
+        )
+    ).mappings().all()
+    _apply_message_count_deltas(_add_message_count_deltas(defaultdict(int), archived_messages, -1), db_session)
     db_session.commit()
+    return len(archived_messages)
+
 
+@read_only
+def count_messages_to_delete(db_session, message_ids=None, message_group=None, sender_email=None):
+    """How many messages delete_messages would delete with the same filters."""
+    return db_session.execute(
+        select(func.count()).select_from(Message).where(*_message_delete_filters(message_ids, message_group, sender_email))
+    ).scalar_one()
+
+
+def delete_message_by_id(card_id, db_session):
+    return delete_messages(db_session, message_ids=[card_id]) > 0
 
+
+@read_only
 def get_swap_pref(recipient_email, message_group_from, db_session):
     row = db_session.execute(
         select(
@@ -548,6 +1009,7 @@ def get_swap_pref(recipient_email, message_group_from, db_session):
     return dict(row) if row else None
 
 
+@read_only
 def list_swap_prefs(db_session):
     return rows_to_dicts(db_session.execute(
         select(
@@ -597,21 +1059,154 @@ def delete_swap_pref_by_id(pref_id, db_session):
 
 
 def insert_message(values, db_session):
-    db_session.execute(insert(Message).values(**values))
+    inserted_message = db_session.execute(
+        insert(Message)
+        .values(**values)
+        .returning(Message.message_group, Message.sender_email, Message.recipient_email)
+    ).mappings().one()
+    _apply_message_count_deltas(_add_message_count_deltas(defaultdict(int), [inserted_message], 1), db_session)
     db_session.commit()
 
 
 def update_messages_group_for_recipient(recipient_email, swap_from, swap_to, db_session):
-    result = db_session.execute(
+    moved_messages = db_session.execute(
         update(Message)
         .where((Message.message_group == swap_from) & (Message.recipient_email == recipient_email))
         .values(message_group=swap_to)
+        .returning(Message.sender_email)
+    ).mappings().all()
+
+    deltas = defaultdict(int)
+    for moved_message in moved_messages:
+        for message_group, sign in ((swap_from, -1), (swap_to, 1)):
+            deltas[(message_group, recipient_email, RANK_DIRECTION_RECEIVED)] += sign
+            deltas[(message_group, moved_message["sender_email"], RANK_DIRECTION_SENT)] += sign
+    _apply_message_count_deltas(deltas, db_session)
+
+    db_session.commit()
+    return len(moved_messages)
+
+
+def swap_messages_for_recipients(recipient_emails, swap_from, swap_to, db_session):
+    """Move recipients' messages from swap_from to swap_to in one transaction.
+
+    For each recipient this returns their swap_from attachment to inventory,
+    deletes that attachment pref, moves their messages and records a swap
+    pref, all in a single statement. Returns how many messages were moved
+    and attachments returned.
+    """
+    recipient_emails = sorted(set(recipient_emails))
+    if not recipient_emails:
+        return {"moved_messages": 0, "returned_attachments": 0}
+
+    event = swap_from.rsplit('_', 1)[0]
+
+    deleted_prefs = (
+        delete(AttachmentPref)
+        .where(AttachmentPref.recipient_email.in_(recipient_emails) & (AttachmentPref.message_group == swap_from))
+        .returning(AttachmentPref.attachment_id)
+        .cte("deleted_prefs")
+    )
+    returned_counts = (
+        select(deleted_prefs.c.attachment_id, func.count().label("returned"))
+        .group_by(deleted_prefs.c.attachment_id)
+        .subquery("returned_counts")
+    )
+    returned_stock = pg_insert(AttachmentStockShard).from_select(
+        ["attachment_id", "shard", "count"],
+        select(returned_counts.c.attachment_id, literal(random.randrange(ATTACHMENT_STOCK_SHARDS)), returned_counts.c.returned),
+    )
+    returned_attachments = (
+        returned_stock.on_conflict_do_update(
+            index_elements=[AttachmentStockShard.attachment_id, AttachmentStockShard.shard],
+            set_={"count": AttachmentStockShard.count + returned_stock.excluded.count},
+        )
+        .returning(AttachmentStockShard.attachment_id)
+        .cte("returned_attachments")
+    )
+    moved_messages = (
+        update(Message)
+        .where((Message.message_group == swap_from) & Message.recipient_email.in_(recipient_emails))
+        .values(message_group=swap_to)
+        .returning(Message.recipient_email, Message.sender_email)
+        .cte("moved_messages")
+    )
+    updated_swap_prefs = (
+        update(SwapPref)
+        .where(SwapPref.recipient_email.in_(recipient_emails) & (SwapPref.event == event))
+        .values(message_group_from=swap_from, message_group_to=swap_to)
+        .returning(SwapPref.recipient_email)
+        .cte("updated_swap_prefs")
+    )
+    targets = values(column("recipient_email", Text), name="targets").data([(email,) for email in recipient_emails])
+    inserted_swap_prefs = (
+        insert(SwapPref)
+        .from_select(
+            ["recipient_email", "message_group_from", "message_group_to", "event"],
+            select(targets.c.recipient_email, literal(swap_from), literal(swap_to), literal(event)).where(
+                ~exists().where(updated_swap_prefs.c.recipient_email == targets.c.recipient_email)
+            ),
+        )
+        .returning(SwapPref.id)
+        .cte("inserted_swap_prefs")
     )
+
+    # Left join from a single row so the statement still reports returned attachments when no messages moved
+    one_row = select(literal(1).label("one")).subquery("one_row")
+    rows = db_session.execute(
+        select(
+            moved_messages.c.recipient_email,
+            moved_messages.c.sender_email,
+            select(func.count()).select_from(deleted_prefs).scalar_subquery().label("returned_attachments"),
+        )
+        .select_from(one_row.outerjoin(moved_messages, true()))
+        .add_cte(returned_attachments, inserted_swap_prefs)
+    ).mappings().all()
+    moved = [row for row in rows if row["recipient_email"] is not None]
+
+    deltas = defaultdict(int)
+    for moved_message in moved:
+        for message_group, sign in ((swap_from, -1), (swap_to, 1)):
+            deltas[(message_group, moved_message["recipient_email"], RANK_DIRECTION_RECEIVED)] += sign
+            deltas[(message_group, moved_message["sender_email"], RANK_DIRECTION_SENT)] += sign
+    _apply_message_count_deltas(deltas, db_session)
+
     db_session.commit()
-    return result.rowcount
+    return {"moved_messages": len(moved), "returned_attachments": rows[0]["returned_attachments"]}
+
 
+def encode_keyset_cursor(timestamp, row_id):
+    raw = f"{timestamp.isoformat()},{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
-def browse_messages(message_group, query, db_session):
+
+def decode_keyset_cursor(cursor):
+    """Inverse of encode_keyset_cursor. Raises ValueError on a malformed cursor."""
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    timestamp, row_id = raw.rsplit(",", 1)
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+
+def _keyset_page(stmt, timestamp_column, id_column, limit, cursor, db_session):
+    """One page of stmt, which must be ordered by (timestamp_column, id_column) descending.
+
+    Pass the returned next_cursor back as cursor to fetch the following page;
+    it is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        stmt = stmt.where(tuple_(timestamp_column, id_column) < tuple_(*decode_keyset_cursor(cursor)))
+
+    results = rows_to_dicts(db_session.execute(stmt.limit(limit + 1)))
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_keyset_cursor(results[-1][timestamp_column.key], results[-1][id_column.key])
+
+    return {"results": results, "next_cursor": next_cursor}
+
+
+def _browse_messages_stmt(message_group, query):
     stmt = select(
         Message.id,
         Message.created_timestamp,
@@ -621,125 +1216,245 @@ def browse_messages(message_group, query, db_session):
         Message.recipient_email,
         Message.recipient_name,
         Message.message_content,
-    ).order_by(Message.created_timestamp.desc())
+    ).order_by(Message.created_timestamp.desc(), Message.id.desc())
 
     if message_group != "all":
         stmt = stmt.where(Message.message_group == message_group)
 
     if query:
-        like_value = f"%{query}%"
-        stmt = stmt.where(
-            or_(Message.recipient_email.ilike(like_value), Message.sender_email.ilike(like_value))
-        )
+        # Anywhere in the email, like the old ilike; the trigram indexes from migration 12 serve it where pg_trgm exists
+        query = query.strip().lower()
+        stmt = stmt.where(or_(
+            func.lower(Message.recipient_email).contains(query, autoescape=True),
+            func.lower(Message.sender_email).contains(query, autoescape=True),
+        ))
 
-    return rows_to_dicts(db_session.execute(stmt))
+    return stmt
 
 
-def list_logs_desc(db_session):
-    return rows_to_dicts(db_session.execute(
-        select(
-            Log.id,
-            Log.log_timestamp,
-            Log.user_email,
-            Log.user_name,
-            Log.log_type,
-            Log.error_code,
-            Log.log_content,
-        ).order_by(Log.id.desc())
-    ))
+def _estimate_row_count(stmt, db_session):
+    # The planner's row estimate is free; an exact count(*) over every message isn't
+    compiled = stmt.compile(dialect=db_session.bind.dialect)
+    plan = db_session.connection().exec_driver_sql(
+        "explain (format json) " + str(compiled), compiled.params
+    ).scalar()
+    return int(plan[0]["Plan"]["Plan Rows"])
 
 
-def list_recently_deleted_messages_desc(db_session):
-    return rows_to_dicts(db_session.execute(
+@read_only
+def browse_messages(message_group, query, db_session, limit=BROWSE_MESSAGES_PAGE_SIZE, cursor=None, with_estimate=False):
+    """One page of messages, newest first, keyed on (created_timestamp, id)."""
+    stmt = _browse_messages_stmt(message_group, query)
+
+    page = {}
+    if with_estimate:
+        page["total_estimate"] = _estimate_row_count(stmt, db_session)
+
+    page.update(_keyset_page(stmt, Message.created_timestamp, Message.id, limit, cursor, db_session))
+    return page
+
+
+@read_only
+def iter_browse_messages(message_group, query, db_session, batch_size=1000):
+    """Every matching message, newest first, fetched from a server-side cursor."""
+    stmt = _browse_messages_stmt(message_group, query).execution_options(yield_per=batch_size)
+    for row in db_session.execute(stmt).mappings():
+        yield dict(row)
+
+
+def _highlight(headline):
+    return html.escape(headline).replace(_HEADLINE_START, "<mark>").replace(_HEADLINE_STOP, "</mark>")
+
+
+@read_only
+def search_messages(query, message_group, db_session, limit=SEARCH_MESSAGES_LIMIT):
+    """Full-text search over message content and sender/recipient names, best match first.
+
+    query uses web search syntax ("quoted phrases", -excluded, or). Each result
+    carries a rank and an HTML-escaped headline with matches wrapped in <mark>.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    tsquery = func.websearch_to_tsquery("english", query)
+    rank = func.ts_rank_cd(Message.search_vector, tsquery)
+
+    matches = select(Message.id, rank.label("rank")).where(Message.search_vector.op("@@")(tsquery))
+    if message_group != "all":
+        matches = matches.where(Message.message_group == message_group)
+    matches = matches.order_by(rank.desc(), Message.id.desc()).limit(limit).subquery()
+
+    # Headlines are slow to build, so only build them for the page being returned
+    results = rows_to_dicts(db_session.execute(
         select(
-            RecentlyDeletedMessage.id,
-            RecentlyDeletedMessage.created_timestamp,
-            RecentlyDeletedMessage.deleted_timestamp,
-            RecentlyDeletedMessage.message_group,
-            RecentlyDeletedMessage.sender_email,
-            RecentlyDeletedMessage.sender_name,
-            RecentlyDeletedMessage.recipient_email,
-            RecentlyDeletedMessage.recipient_name,
-            RecentlyDeletedMessage.message_content,
-        ).order_by(RecentlyDeletedMessage.id.desc())
+            Message.id,
+            Message.created_timestamp,
+            Message.message_group,
+            Message.sender_email,
+            Message.sender_name,
+            Message.recipient_email,
+            Message.recipient_name,
+            Message.message_content,
+            matches.c.rank,
+            func.ts_headline(
+                "english",
+                Message.message_content,
+                tsquery,
+                f"StartSel={_HEADLINE_START}, StopSel={_HEADLINE_STOP}, MaxFragments=3",
+            ).label("headline"),
+        )
+        .join(matches, matches.c.id == Message.id)
+        .order_by(matches.c.rank.desc(), Message.id.desc())
     ))
 
+    for result in results:
+        result["headline"] = _highlight(result["headline"])
+    return results
 
-def insert_log(user_email, user_name, log_type, error_code, log_content, db_session):
-    db_session.execute(
-        insert(Log).values(
-            user_email=user_email,
-            user_name=user_name,
-            log_type=log_type,
-            error_code=error_code,
-            log_content=log_content,
-        )
+
+def _log_filters(log_type=None, user_email=None, since=None, until=None):
+    filters = []
+    if log_type:
+        filters.append(Log.log_type == log_type)
+    if user_email:
+        filters.append(Log.user_email == user_email)
+    if since:
+        filters.append(Log.log_timestamp >= since)
+    if until:
+        filters.append(Log.log_timestamp < until)
+    return filters
+
+
+@read_only
+def list_logs_desc(db_session, limit=LOGS_PAGE_SIZE, cursor=None, log_type=None, user_email=None, since=None, until=None):
+    """One page of logs, newest first, optionally filtered by type, user and [since, until)."""
+    stmt = select(
+        Log.id,
+        Log.log_timestamp,
+        Log.user_email,
+        Log.user_name,
+        Log.log_type,
+        Log.error_code,
+        Log.log_content,
+    ).where(*_log_filters(log_type, user_email, since, until)).order_by(Log.log_timestamp.desc(), Log.id.desc())
+
+    return _keyset_page(stmt, Log.log_timestamp, Log.id, limit, cursor, db_session)
+
+
+@read_only
+def count_logs(db_session, log_type=None, user_email=None, since=None, until=None):
+    return db_session.execute(
+        select(func.count()).select_from(Log).where(*_log_filters(log_type, user_email, since, until))
+    ).scalar_one()
+
+
+@read_only
+def list_recently_deleted_messages_desc(db_session, limit=LOGS_PAGE_SIZE, cursor=None):
+    """One page of recently deleted messages, most recently deleted first."""
+    stmt = select(
+        RecentlyDeletedMessage.id,
+        RecentlyDeletedMessage.created_timestamp,
+        RecentlyDeletedMessage.deleted_timestamp,
+        RecentlyDeletedMessage.message_group,
+        RecentlyDeletedMessage.sender_email,
+        RecentlyDeletedMessage.sender_name,
+        RecentlyDeletedMessage.recipient_email,
+        RecentlyDeletedMessage.recipient_name,
+        RecentlyDeletedMessage.message_content,
+    ).order_by(RecentlyDeletedMessage.deleted_timestamp.desc(), RecentlyDeletedMessage.id.desc())
+
+    return _keyset_page(
+        stmt, RecentlyDeletedMessage.deleted_timestamp, RecentlyDeletedMessage.id, limit, cursor, db_session
     )
-    db_session.commit()
 
 
-def record_email_open(email_open_id, db_session):
-    if email_open_id is None:
-        return None
+@read_only
+def count_recently_deleted_messages(db_session):
+    return db_session.execute(select(func.count()).select_from(RecentlyDeletedMessage)).scalar_one()
 
-    try:
-        email_open_id_int = int(email_open_id)
-    except (TypeError, ValueError):
-        return None
 
-    existing_open = db_session.execute(
-        select(
-            Emails.id,
-            Emails.open_count,
-        )
-        .where(Emails.id == email_open_id_int)
-        .limit(1)
-    ).mappings().first()
+def insert_logs(logs, db_session):
+    """Insert many log rows (dicts of Log columns) with one multi-row INSERT."""
+    if not logs:
+        return 0
 
-    if existing_open is None:
-        return None
+    db_session.execute(insert(Log), logs)
+    db_session.commit()
+    return len(logs)
 
-    open_count = int(existing_open["open_count"] or 0) + 1
 
-    db_session.execute(
+def add_email_open_counts(open_counts, db_session):
+    """Add {email_open_id: opens} to emails.open_count in one UPDATE ... FROM (VALUES ...)."""
+    if not open_counts:
+        return 0
+
+    opens = values(column("id", Integer), column("opens", Integer), name="opens").data(sorted(open_counts.items()))
+    result = db_session.execute(
         update(Emails)
-        .where(Emails.id == existing_open["id"])
-        .values(open_count=open_count)
+        .where(Emails.id == opens.c.id)
+        .values(open_count=Emails.open_count + opens.c.opens)
     )
-
     db_session.commit()
-    return {
-        "id": email_open_id_int,
-        "open_count": open_count,
-    }
+    return result.rowcount
 
 
 def create_email_open_record(to_email, subject, db_session):
-    normalized_email = (to_email or "").strip().lower()
+    records = create_email_open_records([to_email], subject, db_session)
+    return records[0] if records else None
+
+
+def create_email_open_records(to_emails, subject, db_session):
+    """One open-tracking row per address in to_emails, inserted with a single
+    INSERT ... RETURNING.  Returns [{id, to_email, subject}] in to_emails order,
+    skipping blank addresses; [] if the subject is blank."""
+    normalized_emails = [email for email in ((email or "").strip().lower() for email in to_emails) if email]
     normalized_subject = (subject or "").strip()
 
-    if not normalized_email or not normalized_subject:
-        return None
+    if not normalized_emails or not normalized_subject:
+        return []
 
-    inserted_open = db_session.execute(
+    now_utc = datetime.now(timezone.utc)
+    inserted = db_session.execute(
         insert(Emails)
-        .values(
-            created_at=datetime.now(timezone.utc),
-            to_email=normalized_email,
-            subject=normalized_subject,
-            open_count=0,
-        )
-        .returning(Emails.id)
-    ).scalar_one()
+        .values([
+            {"created_at": now_utc, "to_email": email, "subject": normalized_subject, "open_count": 0}
+            for email in normalized_emails
+        ])
+        .returning(Emails.id, Emails.to_email)
+    ).all()
     db_session.commit()
 
+    # RETURNING order isn't guaranteed, so hand the ids back out by address
+    ids_by_email = defaultdict(list)
+    for open_id, email in sorted(inserted):
+        ids_by_email[email].append(int(open_id))
+    for ids in ids_by_email.values():
+        ids.reverse()
+
+    return [
+        {"id": ids_by_email[email].pop(), "to_email": email, "subject": normalized_subject}
+        for email in normalized_emails
+    ]
+
+
+def _load_admin_roster(db_session):
     return {
-        "id": int(inserted_open),
-        "to_email": normalized_email,
-        "subject": normalized_subject,
+        row.email: {"is_admin": bool(row.is_admin), "admin_write_perm": bool(row.admin_write_perm)}
+        for row in db_session.execute(
+            select(LiftedUser.email, LiftedUser.is_admin, LiftedUser.admin_write_perm)
+            .where((LiftedUser.is_admin == True) | (LiftedUser.admin_write_perm == True))
+        )
     }
 
 
+admin_roster_cache = NotifiedCache("admin_roster", _load_admin_roster, ttl=ADMIN_ROSTER_CACHE_TTL_SECONDS)
+
+
+@read_only
+def get_admin_roster(db_session):
+    """{email: {is_admin, admin_write_perm}} for every admin, cached (see admin_roster_cache)."""
+    return admin_roster_cache.get(db_session)
+
+
+@read_only
 def list_admins(db_session):
     """List all admin users with their permissions."""
     return rows_to_dicts(db_session.execute(
@@ -780,6 +1495,7 @@ def add_admin(email, write_perm, db_session):
             user.clicked_quick_link_count = 0
         user.updated_at = now_utc
     
+    notify(admin_roster_cache, db_session)
     db_session.commit()
 
 
@@ -795,10 +1511,31 @@ def delete_admin(email, db_session):
     user.is_admin = False
     user.admin_write_perm = False
     user.updated_at = datetime.now(timezone.utc)
+    notify(admin_roster_cache, db_session)
     db_session.commit()
     return True
 
 
+def _load_hidden_card_overrides(db_session):
+    # The whole table: admins add overrides by hand, so it stays small
+    overrides = defaultdict(list)
+    for recipient_email, message_group in db_session.execute(
+        select(HiddenCardOverride.recipient_email, HiddenCardOverride.message_group)
+    ):
+        overrides[recipient_email].append(message_group)
+    return dict(overrides)
+
+
+hidden_card_overrides_cache = NotifiedCache("hidden_card_overrides", _load_hidden_card_overrides)
+
+
+@read_only
+def get_hidden_card_overrides(recipient_email, db_session):
+    """Message groups whose hidden cards recipient_email can see anyway."""
+    return list(hidden_card_overrides_cache.get(db_session).get(recipient_email, ()))
+
+
+@read_only
 def list_hidden_card_overrides_desc(db_session):
     return rows_to_dicts(db_session.execute(
         select(
@@ -816,6 +1553,7 @@ def add_hidden_card_override(recipient_email, message_group, db_session):
             message_group=message_group,
         )
     )
+    notify(hidden_card_overrides_cache, db_session)
     db_session.commit()
 
 
@@ -823,10 +1561,12 @@ def delete_hidden_card_override(override_id, db_session):
     result = db_session.execute(
         delete(HiddenCardOverride).where(HiddenCardOverride.id == int(override_id))
     )
+    notify(hidden_card_overrides_cache, db_session)
     db_session.commit()
     return result.rowcount > 0
 
 
+@read_only
 def get_cp_tap_by_netid(netid, db_session):
     row = db_session.execute(
         select(
@@ -847,6 +1587,7 @@ def get_cp_tap_by_netid(netid, db_session):
     return dict(row) if row else None
 
 
+@read_only
 def list_cp_taps(db_session):
     return rows_to_dicts(db_session.execute(
         select(
@@ -885,6 +1626,7 @@ def delete_cp_tap(netid, db_session):
     return result.rowcount > 0
 
 
+@read_only
 def get_attachment_prefs_with_attachment(message_group, db_session):
     return rows_to_dicts(db_session.execute(
         select(
@@ -899,7 +1641,7 @@ def get_attachment_prefs_with_attachment(message_group, db_session):
     ))
 
 
-def get_analytics_payload(semester_param, db_session):
+def _compute_analytics_payload(semester_param, db_session):
     analytics_sql = text("""
 with base_messages as (
         select * from lifted.messages
@@ -1053,3 +1795,110 @@ with base_messages as (
     if isinstance(result, str):
         return json.loads(result)
     return result
+
+
+def refresh_analytics_snapshot(semester_param, db_session):
+    payload = _compute_analytics_payload(semester_param, db_session)
+    refreshed_at = datetime.now(timezone.utc)
+
+    upsert = pg_insert(AnalyticsSnapshot).values(
+        semester=semester_param,
+        payload=payload,
+        refreshed_at=refreshed_at,
+    )
+    db_session.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[AnalyticsSnapshot.semester],
+            set_={"payload": upsert.excluded.payload, "refreshed_at": upsert.excluded.refreshed_at},
+        )
+    )
+    db_session.commit()
+
+    return {**payload, "snapshot_refreshed_at": refreshed_at}
+
+
+def delete_analytics_snapshot(semester_param, db_session):
+    result = db_session.execute(
+        delete(AnalyticsSnapshot).where(AnalyticsSnapshot.semester == semester_param)
+    )
+    db_session.commit()
+    return result.rowcount > 0
+
+
+def _load_analytics_snapshots(semester_param, db_session):
+    return {
+        row["semester"]: row
+        for row in db_session.execute(
+            select(AnalyticsSnapshot.semester, AnalyticsSnapshot.payload, AnalyticsSnapshot.refreshed_at)
+            .where(AnalyticsSnapshot.semester.in_([semester_param, "all"]))
+        ).mappings().all()
+    }
+
+
+def _analytics_snapshot_payload(semester_param, snapshots):
+    snapshot = snapshots[semester_param]
+    payload = {**snapshot["payload"], "snapshot_refreshed_at": snapshot["refreshed_at"]}
+
+    # A closed semester's snapshot predates later semesters, so borrow the list from "all"
+    if "all" in snapshots and semester_param != "all":
+        payload["available_semesters"] = snapshots["all"]["payload"]["available_semesters"]
+
+    return payload
+
+
+@read_only
+def get_stored_analytics_payload(semester_param, db_session, active_semesters=()):
+    """Serve analytics from the stored snapshot.
+    Closed semesters never change, so their snapshot is served until someone runs
+    `manage.py refresh-analytics`.  "all" and the active semesters are fully
+    recomputed (not incrementally) once their snapshot is older than
+    ANALYTICS_SNAPSHOT_MAX_AGE; returns None for a missing or expired snapshot,
+    which get_analytics_payload then refreshes.  Raises LookupError for a
+    semester with no messages that isn't active either."""
+    snapshots = _load_analytics_snapshots(semester_param, db_session)
+
+    # The endpoint is public, so only semesters that actually exist get computed and stored
+    if semester_param != "all" and semester_param not in active_semesters:
+        if "all" not in snapshots:
+            return None
+        known_semesters = {semester["value"] for semester in snapshots["all"]["payload"]["available_semesters"]}
+        if semester_param not in known_semesters:
+            raise LookupError(semester_param)
+
+    snapshot = snapshots.get(semester_param)
+    is_frozen = semester_param != "all" and semester_param not in active_semesters
+    is_fresh = snapshot is not None and (
+        is_frozen or datetime.now(timezone.utc) - snapshot["refreshed_at"] < ANALYTICS_SNAPSHOT_MAX_AGE
+    )
+    if not is_fresh:
+        return None
+
+    return _analytics_snapshot_payload(semester_param, snapshots)
+
+
+def get_analytics_payload(semester_param, db_session, active_semesters=()):
+    """get_stored_analytics_payload, refreshing the snapshot on the primary if it has expired."""
+    payload = get_stored_analytics_payload(semester_param, db_session, active_semesters)
+    if payload is not None:
+        return payload
+
+    # A semester is checked against the "all" snapshot's list, so build that first if there isn't one
+    if semester_param not in ("all", *active_semesters) and "all" not in _load_analytics_snapshots("all", db_session):
+        get_analytics_payload("all", db_session, active_semesters)
+        return get_analytics_payload(semester_param, db_session, active_semesters)
+
+    refresh_lock_key = func.hashtext("analytics_snapshot:" + semester_param)
+    snapshots = _load_analytics_snapshots(semester_param, db_session)
+    if semester_param not in snapshots:
+        # Nothing to serve meanwhile, so wait for whoever is computing it and use theirs
+        db_session.execute(select(func.pg_advisory_xact_lock(refresh_lock_key)))
+        snapshots = _load_analytics_snapshots(semester_param, db_session)
+        if semester_param not in snapshots:
+            return refresh_analytics_snapshot(semester_param, db_session)
+        return _analytics_snapshot_payload(semester_param, snapshots)
+
+    # Only one worker recomputes an expired snapshot; the rest keep serving the old one
+    if db_session.execute(select(func.pg_try_advisory_xact_lock(refresh_lock_key))).scalar():
+        return refresh_analytics_snapshot(semester_param, db_session)
+
+    return _analytics_snapshot_payload(semester_param, snapshots)
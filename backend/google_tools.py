@@ -7,7 +7,7 @@ import os
 import math
 from db.repositories import list_attachments_for_message_group
 
-from app import SessionLocal
+from app import admitted_db_session
 
 SCOPES = [
     "https://www.googleapis.com/auth/presentations",
@@ -253,7 +253,7 @@ def _apply_card_replacements(presentation_id, slide_id, card, slides_client, inc
 # PUBLIC FUNCTIONS
 # ---------------------------
 
-def cards_to_pdf(presentation_id, cards, output_filepath, message_group=None):
+def cards_to_pdf(presentation_id, cards, output_filepath, message_group=None, attachments=None):
     """Generate PDF from one or more cards using Google Slides template.
     
     Supports multiple slides in template for different attachments:
@@ -268,6 +268,7 @@ def cards_to_pdf(presentation_id, cards, output_filepath, message_group=None):
         cards: List of one or more card dicts
         output_filepath: Local path to save PDF (without .pdf extension)
         message_group: Override message group for attachment lookup (defaults to cards[0].message_group)
+        attachments: That message group's attachments, newest first, if the caller already has them
     
     Returns:
         The presentation ID if multiple cards (not deleted), None if single card (trashed)
@@ -290,8 +291,9 @@ def cards_to_pdf(presentation_id, cards, output_filepath, message_group=None):
         message_group = cards[0].get("message_group")
     
     # Get attachments for this message group to build slide mapping
-    with SessionLocal() as db_session:
-        attachments = list_attachments_for_message_group(message_group, db_session)
+    if attachments is None:
+        with admitted_db_session(read_only=True) as db_session:
+            attachments = list_attachments_for_message_group(message_group, db_session)
     
     # Build attachment_id -> slide_index mapping
     # Slide indices are 0-based: slide 0 = default, slide 1+ = attachments
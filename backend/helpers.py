@@ -1,23 +1,62 @@
 import csv
+import functools
 import os
+import uuid
 from urllib.parse import quote_plus
-from datetime import datetime
+from datetime import datetime, timezone
 from flask import current_app
 from postmarker.core import PostmarkClient
-from app import SessionLocal
+import write_behind
+from app import SessionLocal, db_call
 from db.repositories import get_lifted_stats as get_lifted_stats_repo
-from db.repositories import insert_log, create_email_open_record, get_user_by_email
+from db.repositories import insert_logs, add_email_open_counts, add_clicked_quick_link_counts, create_email_open_record, create_email_open_records, get_user_by_email, get_users_by_emails
+
+def _write_logs(logs):
+    with SessionLocal() as db_session:
+        insert_logs(logs, db_session)
+
+log_sink = write_behind.QueueSink("logs", _write_logs, max_size=int(os.environ.get("LOG_QUEUE_SIZE", "10000")))
 
 def log(user_email, user_name, log_type, error_code, log_content):
+    # Written in the background in batches; timestamped now so batching doesn't shift log times
+    log_sink.put({
+        "log_timestamp": datetime.now(timezone.utc),
+        "user_email": user_email,
+        "user_name": user_name,
+        "log_type": log_type,
+        "error_code": error_code,
+        "log_content": log_content,
+    })
+
+def _write_email_open_counts(open_counts):
     with SessionLocal() as db_session:
-        insert_log(
-            user_email=user_email,
-            user_name=user_name,
-            log_type=log_type,
-            error_code=error_code,
-            log_content=log_content,
-            db_session=db_session,
-        )
+        add_email_open_counts(open_counts, db_session)
+
+email_open_counter = write_behind.CounterSink("email_opens", _write_email_open_counts)
+
+# emails.id is an int4; anything outside it can't be a real email and would only crowd out real opens
+MAX_EMAIL_OPEN_ID = 2**31 - 1
+
+def count_email_open(email_open_id):
+    # Pixel hits are coalesced per email and flushed in the background, so the pixel never waits on the database
+    try:
+        email_open_id = int(email_open_id)
+    except (TypeError, ValueError):
+        return
+    if 0 < email_open_id <= MAX_EMAIL_OPEN_ID:
+        email_open_counter.add(email_open_id)
+
+def _write_quick_link_click_counts(click_counts):
+    with SessionLocal() as db_session:
+        add_clicked_quick_link_counts(click_counts, db_session)
+
+quick_link_click_counter = write_behind.CounterSink("quick_link_clicks", _write_quick_link_click_counts)
+
+def count_quick_link_click(user_uuid):
+    try:
+        quick_link_click_counter.add(str(uuid.UUID(user_uuid)))
+    except (TypeError, ValueError, AttributeError):
+        pass
 
 def process_cards_to_dict(cards):
     dict = {}
@@ -42,24 +81,69 @@ def process_attachment_prefs_to_dict(attachment_prefs):
     dict = {}
 
     for attachment_pref in attachment_prefs:
-        dict[attachment_pref["message_group"]] = attachment_pref
+        # First one wins if a group somehow has two
+        dict.setdefault(attachment_pref["message_group"], attachment_pref)
 
     return dict
 
+@functools.lru_cache(maxsize=16)
+def get_message_group_layout(message_groups):
+    """The events on /api/messages for a tuple of message groups (the keys of
+    lifted_config's message_group_list_map): newest year first, fall before
+    spring, each with its message groups.  Cached, so it's only rebuilt when
+    the configured groups change."""
+    def event_sort_key(event):
+        season, year = event.split("_")
+        season_order = {"fa": 0, "sp": 1}
+        return (-int(year), season_order.get(season, 2))
+
+    events = sorted({"_".join(message_group.split("_")[0:2]) for message_group in message_groups}, key=event_sort_key)
+
+    layout = []
+    for event in events:
+        season, year = event.split("_")
+        layout.append({
+            "year": int(year),
+            "year_name": int(str(20) + year),
+            "season": season,
+            "season_name": "Fall" if season == "fa" else "Spring",
+            "event": event,
+            "types": tuple(
+                {
+                    "message_group": message_group,
+                    "type": message_group.split("_")[2],
+                    "type_name": "eLifted" if "e" in message_group else "Physical Lifted",
+                }
+                for message_group in message_groups if event in message_group
+            ),
+        })
+    return tuple(layout)
+
 def create_csv(cards, output_path):
-    fieldnames = list(cards[0].keys())
+    """Write cards (a list, or an iterator such as iter_cards_with_attachments) to output_path.csv.
+    Returns the number of cards written; no file is created if there are none."""
+    cards = iter(cards)
+    first_card = next(cards, None)
+    if first_card is None:
+        return 0
+
     with open(output_path + ".csv", 'w', newline="", encoding="utf-8") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction="ignore")
+        writer = csv.DictWriter(csvfile, fieldnames=list(first_card.keys()), extrasaction="ignore")
 
         writer.writeheader()
-        writer.writerows(cards)
+        writer.writerow(first_card)
+        card_count = 1
+        for card in cards:
+            writer.writerow(card)
+            card_count += 1
+
+    return card_count
 
 def get_lifted_stats(db_session=None):
     if db_session is not None:
         return get_lifted_stats_repo(db_session)
 
-    with SessionLocal() as local_db_session:
-        return get_lifted_stats_repo(local_db_session)
+    return db_call(get_lifted_stats_repo)
 
 def normalize_rich_text_html(html_content):
     return html_content.replace("<p><br></p>", "<p>&nbsp;</p>").replace("<p></p>", "<p>&nbsp;</p>")
@@ -231,6 +315,11 @@ def _replace_user_tokens(raw_html_content, user=None):
     return rendered_html.replace("{{name}}", given_name)
 
 
+def _email_open_tracking_url(email_open_id):
+    encoded_open_id = quote_plus(str(email_open_id))
+    return f"https://cornelllifted.com/api/email-open?email_open_id={encoded_open_id}"
+
+
 def _tracking_url_for_email(subject, user=None, db_session=None):
     user_email = (user or {}).get("email")
     if not user_email:
@@ -239,14 +328,12 @@ def _tracking_url_for_email(subject, user=None, db_session=None):
     if db_session is not None:
         email_open_record = create_email_open_record(user_email, subject, db_session)
     else:
-        with SessionLocal() as local_db_session:
-            email_open_record = create_email_open_record(user_email, subject, local_db_session)
+        email_open_record = db_call(create_email_open_record, user_email, subject)
 
     if not email_open_record:
         return None
 
-    encoded_open_id = quote_plus(str(email_open_record["id"]))
-    return f"https://cornelllifted.com/api/email-open?email_open_id={encoded_open_id}"
+    return _email_open_tracking_url(email_open_record["id"])
 
 
 def build_email_html(subject, raw_html_content, message_group=None, user=None, db_session=None, stats=None):
@@ -265,13 +352,10 @@ def _resolve_custom_email_user(to, user=None, db_session=None):
     if db_session is not None:
         return get_user_by_email(db_session, to[0])
 
-    with SessionLocal() as local_db_session:
-        return get_user_by_email(local_db_session, to[0])
+    return db_call(get_user_by_email, email=to[0])
 
 
 def send_custom_email(subject, raw_html_content, to, cc=None, bcc=None, message_group=None, user=None, db_session=None, stats=None):
-    token = os.getenv("SENDGRID_KEY")
-
     resolved_user = _resolve_custom_email_user(to, user=user, db_session=db_session)
     html_content = build_email_html(
         subject=subject,
@@ -282,6 +366,42 @@ def send_custom_email(subject, raw_html_content, to, cc=None, bcc=None, message_
         stats=stats,
     )
 
+    _send_custom_email_html(subject, html_content, to, cc=cc, bcc=bcc)
+
+
+def prepare_custom_email_campaign(subject, recipients, db_session):
+    """Everything needed to send subject to each recipient individually, from
+    one user lookup and one INSERT of all the open-tracking rows:
+    [{recipient, user, tracking_url}] in recipients order.  Recipients without
+    a users row get no user (so "there" for {{name}}) and no tracking."""
+    users = get_users_by_emails(recipients, db_session=db_session)
+    recipient_users = [users.get(recipient.strip().lower()) for recipient in recipients]
+    email_open_records = iter(create_email_open_records(
+        [user["email"] for user in recipient_users if user is not None],
+        subject,
+        db_session,
+    ))
+
+    campaign = []
+    for recipient, user in zip(recipients, recipient_users):
+        email_open_record = next(email_open_records, None) if user is not None else None
+        campaign.append({
+            "recipient": recipient,
+            "user": user,
+            "tracking_url": _email_open_tracking_url(email_open_record["id"]) if email_open_record else None,
+        })
+    return campaign
+
+
+def send_prepared_custom_email(prepared, subject, raw_html_content, cc=None, bcc=None, stats=None):
+    """Send one entry of prepare_custom_email_campaign; doesn't touch the database."""
+    rendered_raw_html = _replace_user_tokens(raw_html_content, user=prepared["user"])
+    html_content = process_html_for_email(rendered_raw_html, tracking_url=prepared["tracking_url"], stats=stats)
+    _send_custom_email_html(subject, html_content, [prepared["recipient"]], cc=cc, bcc=bcc)
+
+
+def _send_custom_email_html(subject, html_content, to, cc=None, bcc=None):
+    token = os.getenv("SENDGRID_KEY")
     postmark = PostmarkClient(server_token=token)
     payload = {
         "From": "Cornell Lifted <hello@cornelllifted.com>",
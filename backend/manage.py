@@ -0,0 +1,129 @@
+"""Maintenance commands for the Lifted database.
+
+Usage (from backend/):
+    python manage.py migrate [--status]
+    python manage.py rebuild-ranks
+    python manage.py reconcile-stats
+    python manage.py refresh-analytics [--semester sp_25]
+    python manage.py archive-semester [--semester sp_25] [--list]
+"""
+import argparse
+import json
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.migrations import MIGRATIONS, apply_migrations, get_applied_versions
+from db.models import MessageGroupRank
+from db.partitions import archive_semester as archive_semester_partition, is_partitioned, list_partitions
+from db.repositories import rebuild_message_group_ranks, reconcile_lifted_stats, refresh_analytics_snapshot
+
+
+def migrate(engine, SessionLocal, args):
+    if args.status:
+        applied_versions = get_applied_versions(engine)
+        for migration in MIGRATIONS:
+            status = "applied" if migration.version in applied_versions else "pending"
+            print(f"{migration.version:>4}  {status:8}  {migration.description}")
+        return
+
+    applied = apply_migrations(engine)
+    print(f"Applied {len(applied)} migration(s)" if applied else "Schema is up to date")
+
+
+def rebuild_ranks(engine, SessionLocal, args):
+    MessageGroupRank.__table__.create(engine, checkfirst=True)
+    with SessionLocal() as db_session:
+        row_count = rebuild_message_group_ranks(db_session)
+    print(f"Rebuilt message_group_ranks ({row_count} rows)")
+
+
+def reconcile_stats(engine, SessionLocal, args):
+    with SessionLocal() as db_session:
+        result = reconcile_lifted_stats(db_session)
+    print(f"Lifted stats: {result['stats']} (running counters had drifted by {result['drift']})")
+
+
+def refresh_analytics(engine, SessionLocal, args):
+    with SessionLocal() as db_session:
+        if args.semester:
+            semesters = args.semester
+        else:
+            all_time = refresh_analytics_snapshot("all", db_session)
+            print("Refreshed analytics snapshot for all")
+            semesters = [semester["value"] for semester in all_time["available_semesters"]]
+
+        for semester in semesters:
+            refresh_analytics_snapshot(semester, db_session)
+            print(f"Refreshed analytics snapshot for {semester}")
+
+
+def get_active_semesters():
+    with open("lifted_config.json", "r") as file:
+        lifted_config = json.load(file)
+    active_message_groups = [lifted_config["form_message_group"], lifted_config["attachment_message_group"]]
+    return {
+        "_".join(message_group.split("_")[0:2])
+        for message_group in active_message_groups
+        if message_group and message_group != "none"
+    }
+
+
+def archive_semester(engine, SessionLocal, args):
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            raise SystemExit("lifted.messages isn't partitioned yet; run `python manage.py migrate` first")
+
+        if args.list or not args.semester:
+            for partition in list_partitions(connection):
+                print(f"{partition['name']:24} ~{partition['estimated_rows']:>8} rows  {partition['bound']}")
+            return
+
+    active_semesters = get_active_semesters()
+    for semester in args.semester:
+        if semester in active_semesters:
+            raise SystemExit(f"{semester} is still active in lifted_config.json; archive it once it's closed")
+
+        # One transaction per semester, so a failure leaves earlier ones archived
+        try:
+            with engine.begin() as connection:
+                moved = archive_semester_partition(semester, connection)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print(f"Archived {semester}: moved {moved} message(s) to its own partition")
+
+
+COMMANDS = {
+    "migrate": migrate,
+    "rebuild-ranks": rebuild_ranks,
+    "reconcile-stats": reconcile_stats,
+    "refresh-analytics": refresh_analytics,
+    "archive-semester": archive_semester,
+}
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Lifted database maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="Apply pending schema migrations")
+    migrate_parser.add_argument("--status", action="store_true", help="List migrations without applying them")
+    subparsers.add_parser("rebuild-ranks", help="Backfill the per-group send/receive rank counters")
+    subparsers.add_parser("reconcile-stats", help="Reset the lifted stats counters to exact counts (run nightly from cron)")
+    refresh_parser = subparsers.add_parser("refresh-analytics", help="Recompute stored analytics snapshots")
+    refresh_parser.add_argument("--semester", action="append", help="Semester to refresh, e.g. sp_25 or all (repeatable; default: every semester)")
+    archive_parser = subparsers.add_parser("archive-semester", help="Move a closed semester's messages into their own partition")
+    archive_parser.add_argument("--semester", action="append", help="Semester to archive, e.g. sp_25 (repeatable)")
+    archive_parser.add_argument("--list", action="store_true", help="List the messages partitions instead")
+    args = parser.parse_args()
+
+    engine = create_engine(os.environ["POSTGRES_URL"], pool_pre_ping=True)
+    SessionLocal = sessionmaker(bind=engine)
+    COMMANDS[args.command](engine, SessionLocal, args)
+
+
+if __name__ == "__main__":
+    main()
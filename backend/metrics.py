@@ -0,0 +1,40 @@
+"""In-process counters for the admin metrics endpoint.
+
+Each worker process keeps its own numbers; they reset on restart.
+"""
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_observations = {}
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, value):
+    """Record one sample of name (e.g. a per-request count) for count/mean/max reporting."""
+    with _lock:
+        stats = _observations.setdefault(name, {"count": 0, "sum": 0, "max": 0})
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["max"] = max(stats["max"], value)
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "observations": {
+                name: {**stats, "mean": stats["sum"] / stats["count"]}
+                for name, stats in _observations.items()
+            },
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _observations.clear()
@@ -0,0 +1,182 @@
+"""In-process caches kept coherent across worker processes with LISTEN/NOTIFY.
+
+A writer calls notify(cache, db_session) in the transaction that changes the
+cached table.  Postgres delivers the notification when that transaction
+commits, and the listener thread in every process (started by create_app)
+drops its copy.  A cache without a ttl is only served while its process is
+listening; without a listener (CLI, benchmarks) or while it reconnects, get()
+just runs the query, so a missed notification can't leave a process serving
+stale data.  A cache with a ttl is also dropped that many seconds after it's
+loaded, and is served even while not listening since that bounds how stale it gets.
+"""
+import logging
+import os
+import select
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy import select as sql_select
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# How often the listener checks its connection is alive, and waits before reconnecting
+LISTEN_POLL_INTERVAL = float(os.environ.get("CACHE_LISTEN_POLL_INTERVAL", "30"))
+LISTEN_RETRY_INTERVAL = float(os.environ.get("CACHE_LISTEN_RETRY_INTERVAL", "5"))
+
+
+class Listener:
+    """A thread holding one connection that LISTENs on every registered cache's channel."""
+
+    def __init__(self):
+        self._caches = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.engine = None
+        self.settle_seconds = 0
+        self.listening = False
+
+    def register(self, cache):
+        with self._lock:
+            self._caches[cache.channel] = cache
+
+    def start(self, engine, settle_seconds=0):
+        """Listen through engine (the primary).  settle_seconds is how far a
+        replica can lag: reads just after a change are only cached that long."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.engine = engine
+            self.settle_seconds = settle_seconds
+            self._thread = threading.Thread(target=self._run, name="cache-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _invalidate_all(self):
+        with self._lock:
+            caches = list(self._caches.values())
+        for cache in caches:
+            cache.invalidate()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            connection = None
+            try:
+                # Detached so it doesn't count against (or get recycled by) the pool
+                connection = self.engine.raw_connection()
+                connection.detach()
+                self._listen(connection.dbapi_connection)
+            except Exception:
+                metrics.increment("cache.listener.errors")
+                logger.exception("Cache listener lost its connection")
+            finally:
+                self.listening = False
+                self._invalidate_all()
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+            self._stopping.wait(LISTEN_RETRY_INTERVAL)
+
+    def _listen(self, dbapi_connection):
+        dbapi_connection.autocommit = True
+        with self._lock:
+            channels = list(self._caches)
+        with dbapi_connection.cursor() as cursor:
+            for channel in channels:
+                cursor.execute(f"listen {channel}")
+
+        # Anything cached before LISTEN took effect may have missed a change
+        self._invalidate_all()
+        self.listening = True
+        while not self._stopping.is_set():
+            if select.select([dbapi_connection], [], [], LISTEN_POLL_INTERVAL) == ([], [], []):
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute("select 1")
+                continue
+            dbapi_connection.poll()
+            while dbapi_connection.notifies:
+                notification = dbapi_connection.notifies.pop(0)
+                cache = self._caches.get(notification.channel)
+                if cache is not None:
+                    cache.invalidate(self.settle_seconds)
+
+
+listener = Listener()
+
+
+class NotifiedCache:
+    """One value loaded by load(db_session), dropped whenever a notification
+    arrives on lifted_cache_<name> (and after ttl seconds, if given)."""
+
+    def __init__(self, name, load, ttl=None, listener=listener):
+        self.name = name
+        self.channel = f"lifted_cache_{name}"
+        self.load = load
+        self.ttl = ttl
+        self.listener = listener
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires_at = 0
+        self._settle_until = 0
+        self._generation = 0
+        self.listener.register(self)
+
+    def _servable(self):
+        return self.listener.listening or self.ttl is not None
+
+    def cached(self):
+        """The cached value if there's a fresh one, else None.  Never touches the database."""
+        if not self._servable():
+            return None
+        with self._lock:
+            if self._value is not None and time.monotonic() < self._expires_at:
+                metrics.increment(f"cache.{self.name}.hits")
+                return self._value
+        return None
+
+    def get(self, db_session):
+        value = self.cached()
+        if value is not None:
+            return value
+        if not self._servable():
+            metrics.increment(f"cache.{self.name}.bypassed")
+            return self.load(db_session)
+
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+
+        metrics.increment(f"cache.{self.name}.misses")
+        value = self.load(db_session)
+        with self._lock:
+            # Skip storing if a notification arrived while we were loading
+            if generation == self._generation:
+                self._value = value
+                # Right after a change a replica may not have it yet, so load again once it should
+                self._expires_at = self._settle_until if now < self._settle_until else float("inf")
+                if self.ttl is not None:
+                    self._expires_at = min(self._expires_at, now + self.ttl)
+        return value
+
+    def invalidate(self, settle_seconds=0):
+        with self._lock:
+            self._generation += 1
+            self._value = None
+            self._settle_until = max(self._settle_until, time.monotonic() + settle_seconds)
+        metrics.increment(f"cache.{self.name}.invalidations")
+
+
+def notify(cache, db_session):
+    """Invalidate cache in every process once db_session's transaction commits.
+    The caller still commits; this process's copy is dropped straight away."""
+    db_session.execute(sql_select(func.pg_notify(cache.channel, "")))
+    cache.invalidate()
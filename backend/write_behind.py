@@ -0,0 +1,163 @@
+"""Write-behind buffers drained by one shared background thread.
+
+Request threads hand writes to a sink and return immediately. The flusher
+thread writes everything buffered every WRITE_BEHIND_FLUSH_INTERVAL seconds,
+sooner when a sink asks for it, and once more when the process exits.
+Buffered writes are lost if the process is killed outright, so only use this
+for data that can tolerate that (logs, counters).
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+
+
+class Flusher:
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self._sinks = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def register(self, sink):
+        with self._lock:
+            self._sinks.append(sink)
+
+    def ensure_started(self):
+        # Started on first use so importing this module (CLI, benchmarks) doesn't spawn a thread
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None and not self._stopping.is_set():
+                self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def wake(self):
+        self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            sinks = list(self._sinks)
+        for sink in sinks:
+            try:
+                sink.flush()
+            except Exception:
+                metrics.increment(f"write_behind.{sink.name}.flush_errors")
+                logger.exception("Write-behind flush failed for %s", sink.name)
+
+    def stop(self, timeout=10):
+        """Stop the thread and write out whatever is still buffered."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+flusher = Flusher()
+
+
+class QueueSink:
+    """A bounded FIFO of rows, written in batches by write_batch(rows).
+
+    put() never blocks: when the queue is full the row is dropped and counted
+    in the write_behind.<name>.dropped metric.
+    """
+
+    def __init__(self, name, write_batch, max_size=10000, batch_size=500, flusher=flusher):
+        self.name = name
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flusher = flusher
+        self._queue = queue.Queue(maxsize=max_size)
+        flusher.register(self)
+
+    def put(self, row):
+        self.flusher.ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            metrics.increment(f"write_behind.{self.name}.dropped")
+            return False
+
+        metrics.increment(f"write_behind.{self.name}.enqueued")
+        if self._queue.qsize() >= self.batch_size:
+            self.flusher.wake()
+        return True
+
+    def flush(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+
+            try:
+                self.write_batch(batch)
+            except Exception:
+                metrics.increment(f"write_behind.{self.name}.dropped", len(batch))
+                raise
+            metrics.increment(f"write_behind.{self.name}.written", len(batch))
+            metrics.observe(f"write_behind.{self.name}.batch_size", len(batch))
+
+
+class CounterSink:
+    """Per-key increments coalesced in memory and written as one batch of totals.
+
+    add() never touches the database; write_counts({key: total}) runs on the
+    flusher thread with everything added since the last flush.
+    """
+
+    def __init__(self, name, write_counts, max_keys=100000, flusher=flusher):
+        self.name = name
+        self.write_counts = write_counts
+        self.max_keys = max_keys
+        self.flusher = flusher
+        self._lock = threading.Lock()
+        self._counts = {}
+        flusher.register(self)
+
+    def add(self, key, amount=1):
+        self.flusher.ensure_started()
+        with self._lock:
+            if key not in self._counts and len(self._counts) >= self.max_keys:
+                metrics.increment(f"write_behind.{self.name}.dropped", amount)
+                return False
+            self._counts[key] = self._counts.get(key, 0) + amount
+        metrics.increment(f"write_behind.{self.name}.increments", amount)
+        return True
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if not counts:
+            return
+
+        try:
+            self.write_counts(counts)
+        except Exception:
+            metrics.increment(f"write_behind.{self.name}.dropped", sum(counts.values()))
+            raise
+        metrics.increment(f"write_behind.{self.name}.rows_written", len(counts))
+        # One UPDATE per add() is what this replaces
+        metrics.increment(f"write_behind.{self.name}.writes_saved", sum(counts.values()) - len(counts))
@@ -23,6 +23,7 @@ export interface Message {
   recipient_name: string;
   message_content: string;
   attachment?: string;
+  headline?: string;
 }
 
 export default function BrowseMessagesSection() {
@@ -39,6 +40,15 @@ export default function BrowseMessagesSection() {
   const [confirmOpen, setConfirmOpen] = useState(false);
   const [deleteId, setDeleteId] = useState<number | null>(null);
   const [deleting, setDeleting] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [totalEstimate, setTotalEstimate] = useState<number | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [searchText, setSearchText] = useState(false);
+  const [bulkDeleteGroup, setBulkDeleteGroup] = useState("");
+  const [bulkDeleteSender, setBulkDeleteSender] = useState("");
+  const [bulkDeleteIds, setBulkDeleteIds] = useState("");
+  const [bulkDeleteMatches, setBulkDeleteMatches] = useState<number | null>(null);
+  const [bulkDeleteStatus, setBulkDeleteStatus] = useState("");
 
   // Initial fetch: set default message group
   useEffect(() => {
@@ -46,20 +56,43 @@ export default function BrowseMessagesSection() {
     setSelectedGroup("");
   }, []);
 
-  // Fetch messages
+  function browseUrl(cursor?: string | null) {
+    const params = new URLSearchParams({ q: query, mg: selectedGroup || "all" });
+    if (searchText) {
+      return `/api/admin/search-messages?${params.toString()}`;
+    }
+    if (cursor) {
+      params.set("cursor", cursor);
+    } else {
+      params.set("estimate", "true");
+    }
+    return `/api/admin/browse-messages?${params.toString()}`;
+  }
+
+  function updateStatus(loaded: Message[], hasMore: boolean, estimate: number | null) {
+    const uniqueSenders = new Set(loaded.map((m) => m.sender_email)).size;
+    const uniqueRecipients = new Set(loaded.map((m) => m.recipient_email)).size;
+    const shown = hasMore && estimate !== null ? `Showing ${loaded.length} of about ${estimate} result(s).` : `${loaded.length} result(s) found.`;
+    setStatus(`${shown} There are ${uniqueSenders} unique senders, and ${uniqueRecipients} unique recipients${hasMore ? " among the loaded results" : ""}.`);
+  }
+
+  // Fetch the first page of messages
   async function fetchMessages() {
     setLoading(true);
     setError(null);
     setStatus("Loading...");
     try {
-      const res = await fetch(`/api/admin/browse-messages?q=${encodeURIComponent(query)}&mg=${encodeURIComponent(selectedGroup || "all")}`);
+      const res = await fetch(browseUrl());
       const data = await res.json();
       if (data.results === "none") {
         setMessages([]);
+        setNextCursor(null);
         setStatus("No results found. Check your spelling or try typing in the exact NetID.");
       } else {
         setMessages(data.results);
-        setStatus(`${data.results.length} result(s) found. There are ${new Set(data.results.map((m: Message) => m.sender_email)).size} unique senders, and ${new Set(data.results.map((m: Message) => m.recipient_email)).size} unique recipients.`);
+        setNextCursor(data.next_cursor ?? null);
+        setTotalEstimate(data.total_estimate ?? null);
+        updateStatus(data.results, Boolean(data.next_cursor), data.total_estimate ?? null);
       }
     } catch (err) {
       setError("Failed to load messages");
@@ -68,13 +101,30 @@ export default function BrowseMessagesSection() {
     setLoading(false);
   }
 
+  // Append the next page of messages
+  async function fetchMoreMessages() {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const res = await fetch(browseUrl(nextCursor));
+      const data = await res.json();
+      const loaded = data.results === "none" ? messages : [...messages, ...data.results];
+      setMessages(loaded);
+      setNextCursor(data.next_cursor);
+      updateStatus(loaded, data.next_cursor !== null, totalEstimate);
+    } catch (err) {
+      setError("Failed to load more messages");
+    }
+    setLoadingMore(false);
+  }
+
   // Debounce query
   useEffect(() => {
     const timer = setTimeout(() => {
       if (selectedGroup) fetchMessages();
     }, 500);
     return () => clearTimeout(timer);
-  }, [query, selectedGroup]);
+  }, [query, selectedGroup, searchText]);
 
   const tableData = messages.map((msg) => ({
     tools: (
@@ -96,6 +146,7 @@ export default function BrowseMessagesSection() {
     sender_name: msg.sender_name,
     recipient_name: msg.recipient_name,
     message_content: msg.message_content,
+    headline: msg.headline,
     id: msg.id,
   }));
 
@@ -111,6 +162,10 @@ const columnDefs = [
   {
     headerName: "Message", field: "message_content", wrapText: true, minWidth: 500,
     autoHeight: true,
+    // Search headlines come back HTML-escaped from the server, with matches in <mark>
+    cellRenderer: (params: any) => params.data.headline
+      ? <span dangerouslySetInnerHTML={{ __html: params.data.headline }} />
+      : params.value,
   },
   { headerName: "ID", field: "id", maxWidth: 100 },
 ];
@@ -134,6 +189,38 @@ const columnDefs = [
     setDeleteId(null);
   }
 
+  async function handleBulkDelete(dryRun: boolean) {
+    setBulkDeleteStatus(dryRun ? "Counting..." : "Deleting...");
+    const res = await fetch("/api/admin/bulk-delete-messages", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        message_group: bulkDeleteGroup === "none" ? "" : bulkDeleteGroup,
+        sender: bulkDeleteSender,
+        message_ids: bulkDeleteIds,
+        dry_run: dryRun,
+      }),
+    });
+    const data = await res.json();
+    if (!res.ok) {
+      setBulkDeleteMatches(null);
+      setBulkDeleteStatus(data.error || "Bulk delete failed");
+    } else if (dryRun) {
+      setBulkDeleteMatches(data.matching_messages);
+      setBulkDeleteStatus(`${data.matching_messages} message(s) match.`);
+    } else {
+      setBulkDeleteMatches(null);
+      setBulkDeleteStatus(`Deleted ${data.deleted_messages} message(s).`);
+      if (selectedGroup) fetchMessages();
+    }
+  }
+
+  function updateBulkDeleteFilter(setter: (value: string) => void, value: string) {
+    // Make the admin preview again whenever the filters change
+    setter(value);
+    setBulkDeleteMatches(null);
+  }
+
   return (
     <section className="mb-8">
       <h5 className="font-bold text-lg mb-2">Browse Cards</h5>
@@ -150,6 +237,16 @@ const columnDefs = [
             onChange={e => setQuery(e.target.value)}
           />
         </div>
+        <div className="flex flex-col">
+          <label htmlFor="search-text-toggle" className="font-medium text-gray-700">Search message text and names</label>
+          <input
+            id="search-text-toggle"
+            type="checkbox"
+            className="mt-3 h-4 w-4"
+            checked={searchText}
+            onChange={e => setSearchText(e.target.checked)}
+          />
+        </div>
         <div className="flex flex-col">
           <label htmlFor="message-group" className="font-medium text-gray-700">Filter by Message Group</label>
           <MessageGroupSelector
@@ -162,6 +259,11 @@ const columnDefs = [
         </div>
       </form>
       <div className="mb-2 text-cornell-blue font-semibold text-base">{status}</div>
+      {nextCursor && !loading && (
+        <button className="mb-4 px-3 py-1 rounded border border-gray-300 hover:bg-gray-100" onClick={fetchMoreMessages} disabled={loadingMore}>
+          {loadingMore ? "Loading..." : "Load more"}
+        </button>
+      )}
       {error && <div className="text-red-600 mb-4">{error}</div>}
       {loading ? (
         <Loading />
@@ -192,6 +294,59 @@ const columnDefs = [
         title="Delete message?"
         description="Are you sure you want to delete this message? This action cannot be undone."
       />
+      <h5 className="font-bold text-lg mt-6 mb-2">Bulk Delete</h5>
+      <p className="mb-4 text-gray-700">Delete every message matching all of the filters you fill in (choose None to match every message group), e.g. after a spam wave.  Deleted messages go to the recently deleted messages table.  Preview how many messages match before deleting.</p>
+      <div className="flex flex-col md:flex-row gap-4 items-start mb-4">
+        <div className="flex flex-col">
+          <label htmlFor="bulk-delete-group" className="font-medium text-gray-700">Message Group</label>
+          <MessageGroupSelector
+            initialValue={bulkDeleteGroup}
+            onChange={val => updateBulkDeleteFilter(setBulkDeleteGroup, val.key)}
+            dropdown={true}
+            showNoneOption={true}
+            className="w-full"
+          />
+        </div>
+        <div className="flex flex-col">
+          <label htmlFor="bulk-delete-sender" className="font-medium text-gray-700">Sender NetID or Email</label>
+          <input
+            id="bulk-delete-sender"
+            type="text"
+            className="border rounded px-3 py-2"
+            value={bulkDeleteSender}
+            onChange={e => updateBulkDeleteFilter(setBulkDeleteSender, e.target.value)}
+          />
+        </div>
+        <div className="flex flex-col flex-1">
+          <label htmlFor="bulk-delete-ids" className="font-medium text-gray-700">Message IDs (comma or newline separated)</label>
+          <textarea
+            id="bulk-delete-ids"
+            className="border rounded px-3 py-2"
+            rows={2}
+            value={bulkDeleteIds}
+            onChange={e => updateBulkDeleteFilter(setBulkDeleteIds, e.target.value)}
+          />
+        </div>
+      </div>
+      <div className="flex gap-2 mb-2">
+        <button
+          type="button"
+          className="px-3 py-1 rounded border border-gray-300 hover:bg-gray-100"
+          onClick={() => handleBulkDelete(true)}
+          disabled={isReadOnlyAdmin || ((!bulkDeleteGroup || bulkDeleteGroup === "none") && !bulkDeleteSender.trim() && !bulkDeleteIds.trim())}
+        >
+          Preview
+        </button>
+        <button
+          type="button"
+          className="bg-cornell-red text-white font-semibold py-1 px-4 rounded-lg shadow hover:bg-red-800 transition"
+          onClick={() => handleBulkDelete(false)}
+          disabled={isReadOnlyAdmin || !bulkDeleteMatches}
+        >
+          Delete {bulkDeleteMatches ?? ""} message(s)
+        </button>
+      </div>
+      {bulkDeleteStatus && <div className="mb-4 text-cornell-blue font-semibold">{bulkDeleteStatus}</div>}
     </section>
     );
 }
@@ -37,6 +37,9 @@ export default function SwappingOptions() {
 	const [loading, setLoading] = useState<boolean>(false);
 	const [statusMsg, setStatusMsg] = useState<string>("");
 	const [selectedEventFilter, setSelectedEventFilter] = useState<string>("");
+	const [bulkSwapFrom, setBulkSwapFrom] = useState<string>("");
+	const [bulkSwapRecipients, setBulkSwapRecipients] = useState<string>("");
+	const [bulkSwapStatus, setBulkSwapStatus] = useState<string>("");
 	const firstMessageGroup = config?.message_group_list_map ? Object.keys(config.message_group_list_map)[0] : "";
 
 	useEffect(() => {
@@ -127,6 +130,25 @@ export default function SwappingOptions() {
 		}
 	};
 
+	const handleBulkSwap = async () => {
+		setBulkSwapStatus("Swapping...");
+		const res = await fetch("/api/admin/bulk-swap-messages", {
+			method: "POST",
+			headers: {
+				"Content-Type": "application/json",
+			},
+			body: JSON.stringify({ message_group: bulkSwapFrom, recipients: bulkSwapRecipients }),
+		});
+		const data = await res.json();
+		if (res.ok) {
+			setBulkSwapStatus(`Moved ${data.moved_messages} message(s) and returned ${data.returned_attachments} attachment(s).`);
+			setBulkSwapRecipients("");
+			fetchSwapPrefs();
+		} else {
+			setBulkSwapStatus(data.error || "Bulk swap failed");
+		}
+	};
+
 	return (
 		<div className="mb-8">
 			<h3 className="text-xl font-bold mb-2">Message Swapping</h3>
@@ -259,6 +281,43 @@ export default function SwappingOptions() {
 			{statusMsg && (
 				<div className="text-green-600 font-semibold mb-4 text-center">{statusMsg}</div>
 			)}
+			<h4 className="text-lg font-bold mt-6 mb-2">Bulk Swap</h4>
+			<p className="mb-2">Swap several recipients at once, exactly as if each had pressed the swap button: their attachment for the "from" group is returned, their messages are moved, and a swap pref is saved.</p>
+			<div className="flex flex-col md:flex-row gap-4 items-start mb-4">
+				<div className="flex flex-col">
+					<label htmlFor="bulk-swap-from" className="font-medium text-gray-700">Swap From</label>
+					<select
+						id="bulk-swap-from"
+						className="border rounded px-3 py-2"
+						value={bulkSwapFrom}
+						onChange={(e) => setBulkSwapFrom(e.target.value)}
+					>
+						<option value="">Select a group</option>
+						{swapping.filter(entry => entry.enabled).map(entry => (
+							<option key={`${entry.from}-${entry.to}`} value={entry.from}>{entry.from} → {entry.to}</option>
+						))}
+					</select>
+				</div>
+				<div className="flex flex-col flex-1">
+					<label htmlFor="bulk-swap-recipients" className="font-medium text-gray-700">Recipients (NetIDs or emails, comma or newline separated)</label>
+					<textarea
+						id="bulk-swap-recipients"
+						className="border rounded px-3 py-2"
+						rows={3}
+						value={bulkSwapRecipients}
+						onChange={(e) => setBulkSwapRecipients(e.target.value)}
+					/>
+				</div>
+			</div>
+			<button
+				type="button"
+				className="bg-cornell-blue text-white font-semibold py-2 px-6 rounded-lg shadow hover:bg-cornell-red transition mb-2"
+				onClick={handleBulkSwap}
+				disabled={isReadOnlyAdmin || !bulkSwapFrom || !bulkSwapRecipients.trim()}
+			>
+				Swap
+			</button>
+			{bulkSwapStatus && <div className="mb-4 text-cornell-blue font-semibold">{bulkSwapStatus}</div>}
 			<h4 className="text-lg font-bold mt-6 mb-2">Swap Prefs Table</h4>
 			<p className="mb-2">The swap_prefs table. Num entries: {swapPrefs.length}</p>
 			<p className="mb-2">Deleting will remove the pref (so no future messages will be moved), but you will have to manually move the existing messages back.</p>
@@ -2,42 +2,89 @@ import React, { useEffect, useState } from "react";
 import Table, { TableHeader } from "@/components/Table";
 import FormattedTimestamp from "@/components/FormattedTimestamp";
 
+function formatLogs(logs: any[]) {
+  return logs.map((log: any) => ({
+    ...log,
+    log_timestamp: <FormattedTimestamp timestamp={log.log_timestamp} />,
+  }));
+}
+
+function formatDeleted(messages: any[]) {
+  return messages.map((msg: any) => ({
+    ...msg,
+    created_timestamp: <FormattedTimestamp timestamp={msg.created_timestamp} />,
+    deleted_timestamp: <FormattedTimestamp timestamp={msg.deleted_timestamp} />,
+  }));
+}
+
 export default function AdminLogsPage() {
   const [logs, setLogs] = useState<any[]>([]);
+  const [logsCursor, setLogsCursor] = useState<string | null>(null);
   const [recentlyDeleted, setRecentlyDeleted] = useState<any[]>([]);
+  const [deletedCursor, setDeletedCursor] = useState<string | null>(null);
+  const [counts, setCounts] = useState<{ logs: number; recently_deleted_messages: number } | null>(null);
+  const [logType, setLogType] = useState("");
+  const [user, setUser] = useState("");
+  const [since, setSince] = useState("");
+  const [until, setUntil] = useState("");
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState("");
 
-  useEffect(() => {
-    console.log("AdminLogsPage mounted");
-    async function fetchLogs() {
-      setLoading(true);
-      setError("");
-      try {
-        const res = await fetch("/api/admin/logs");
-        if (!res.ok) throw new Error("Failed to fetch logs");
-        const data = await res.json();
-        setLogs(
-          (data.logs || []).map((log: any) => ({
-            ...log,
-            log_timestamp: <FormattedTimestamp timestamp={log.log_timestamp} />,
-          }))
-        );
-        setRecentlyDeleted(
-          (data.recently_deleted_messages || []).map((msg: any) => ({
-            ...msg,
-            created_timestamp: <FormattedTimestamp timestamp={msg.created_timestamp} />,
-            deleted_timestamp: <FormattedTimestamp timestamp={msg.deleted_timestamp} />,
-          }))
-        );
-      } catch (err: any) {
-        setError(err.message || "Unknown error");
-      }
-      setLoading(false);
+  function logFilterParams(cursor?: string | null) {
+    const params = new URLSearchParams();
+    if (logType) params.set("log_type", logType);
+    if (user) params.set("user", user);
+    if (since) params.set("since", since);
+    if (until) params.set("until", until);
+    if (cursor) params.set("cursor", cursor);
+    return params.toString();
+  }
+
+  async function fetchLogs(cursor?: string | null) {
+    const res = await fetch(`/api/admin/logs?${logFilterParams(cursor)}`);
+    if (!res.ok) throw new Error("Failed to fetch logs");
+    const data = await res.json();
+    setLogs(prev => [...(cursor ? prev : []), ...formatLogs(data.logs || [])]);
+    setLogsCursor(data.next_cursor);
+  }
+
+  async function fetchRecentlyDeleted(cursor?: string | null) {
+    const res = await fetch(`/api/admin/recently-deleted-messages${cursor ? `?cursor=${encodeURIComponent(cursor)}` : ""}`);
+    if (!res.ok) throw new Error("Failed to fetch recently deleted messages");
+    const data = await res.json();
+    setRecentlyDeleted(prev => [...(cursor ? prev : []), ...formatDeleted(data.recently_deleted_messages || [])]);
+    setDeletedCursor(data.next_cursor);
+  }
+
+  async function fetchCounts() {
+    setCounts(null);
+    const res = await fetch(`/api/admin/logs/count?${logFilterParams()}`);
+    if (res.ok) setCounts(await res.json());
+  }
+
+  async function withErrors(load: () => Promise<void>) {
+    setError("");
+    try {
+      await load();
+    } catch (err: any) {
+      setError(err.message || "Unknown error");
     }
-    fetchLogs();
+  }
+
+  useEffect(() => {
+    withErrors(() => fetchRecentlyDeleted());
   }, []);
 
+  // Fetch the first page of logs, debouncing filter changes after the initial load
+  useEffect(() => {
+    const timer = setTimeout(async () => {
+      await withErrors(() => fetchLogs());
+      setLoading(false);
+      fetchCounts();
+    }, loading ? 0 : 500);
+    return () => clearTimeout(timer);
+  }, [logType, user, since, until]);
+
   const logHeaders: TableHeader[] = [
     { key: "id", label: "ID" },
     { key: "log_timestamp", label: "Timestamp" },
@@ -69,12 +116,40 @@ export default function AdminLogsPage() {
       ) : (
         <>
           <h2 className="text-xl font-semibold mb-2">Logs</h2>
-          <p className="mb-2 text-gray-700">The logs table. Num entries: {logs.length}</p>
-          <Table headers={logHeaders} data={logs} className="mb-8" maxHeight={400} />
+          <form className="flex flex-col md:flex-row gap-4 items-start mb-4" onSubmit={e => e.preventDefault()}>
+            <div className="flex flex-col">
+              <label htmlFor="log-type-filter" className="font-medium text-gray-700">Type</label>
+              <select id="log-type-filter" className="border rounded px-3 py-2" value={logType} onChange={e => setLogType(e.target.value)}>
+                <option value="">All</option>
+                <option value="INFO">INFO</option>
+                <option value="ERROR">ERROR</option>
+              </select>
+            </div>
+            <div className="flex flex-col">
+              <label htmlFor="log-user-filter" className="font-medium text-gray-700">NetID</label>
+              <input id="log-user-filter" type="text" className="border rounded px-3 py-2" placeholder="rf377" value={user} onChange={e => setUser(e.target.value)} />
+            </div>
+            <div className="flex flex-col">
+              <label htmlFor="log-since-filter" className="font-medium text-gray-700">From</label>
+              <input id="log-since-filter" type="datetime-local" className="border rounded px-3 py-2" value={since} onChange={e => setSince(e.target.value)} />
+            </div>
+            <div className="flex flex-col">
+              <label htmlFor="log-until-filter" className="font-medium text-gray-700">To</label>
+              <input id="log-until-filter" type="datetime-local" className="border rounded px-3 py-2" value={until} onChange={e => setUntil(e.target.value)} />
+            </div>
+          </form>
+          <p className="mb-2 text-gray-700">The logs table. Showing {logs.length} of {counts ? counts.logs : "..."} entries.</p>
+          <Table headers={logHeaders} data={logs} className="mb-2" maxHeight={400} />
+          {logsCursor && (
+            <button className="mb-8 px-3 py-1 rounded border border-gray-300 hover:bg-gray-100" onClick={() => withErrors(() => fetchLogs(logsCursor))}>Load more</button>
+          )}
 
-          <h2 className="text-xl font-semibold mb-2">Recently Deleted Messages</h2>
-          <p className="mb-2 text-gray-700">The recently deleted messages table. Num entries: {recentlyDeleted.length}</p>
-          <Table headers={deletedHeaders} data={recentlyDeleted} maxHeight={400} />
+          <h2 className="text-xl font-semibold mb-2 mt-8">Recently Deleted Messages</h2>
+          <p className="mb-2 text-gray-700">The recently deleted messages table. Showing {recentlyDeleted.length} of {counts ? counts.recently_deleted_messages : "..."} entries.</p>
+          <Table headers={deletedHeaders} data={recentlyDeleted} className="mb-2" maxHeight={400} />
+          {deletedCursor && (
+            <button className="px-3 py-1 rounded border border-gray-300 hover:bg-gray-100" onClick={() => withErrors(() => fetchRecentlyDeleted(deletedCursor))}>Load more</button>
+          )}
         </>
       )}
     </main>